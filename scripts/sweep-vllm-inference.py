@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+scripts/sweep-vllm-inference.py
+Parameter sweep and baseline regression check for test-vllm-inference.py
+
+Runs every combination of the --param values, each in its own subprocess
+so GPU memory is fully released between configurations, and collects the
+JSON reports. Parameters are test-vllm-inference.py flags without the
+leading dashes, plus "layout":
+  - layout=RxT: R replicas of tensor-parallel size T, each pinned to its
+    own GPUs with CUDA_VISIBLE_DEVICES and given its own 1/R slice of the
+    same prompts (--shard i/R), so layouts are compared on one workload. The
+    replicas run at once; throughput is summed and latency percentiles are
+    recomputed over all of their requests.
+
+Configurations on the throughput/latency Pareto front (no other config is
+at least as fast with no worse --latency-metric) are marked. With
+--baseline, each config is compared to the same config in a previous
+sweep report and the sweep fails if throughput drops, or latency rises,
+by more than --threshold percent. --update-baseline replaces the baseline
+only when nothing regressed, unless --force-baseline is given.
+
+Usage:
+    python3 sweep-vllm-inference.py --param gpu-memory=0.85,0.9 --param max-num-seqs=64,256
+    python3 sweep-vllm-inference.py --model /models/qwen2.5-32b-awq --param layout=1x2,2x1
+    python3 sweep-vllm-inference.py --param max-model-len=4096,8192 -- --dataset synthetic
+    python3 sweep-vllm-inference.py --grid-file grid.json --baseline sweep-baseline.json
+    python3 sweep-vllm-inference.py --grid-file grid.json --baseline sweep-baseline.json --update-baseline
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from vllm_client import summarize
+
+
+BENCHMARK = Path(__file__).resolve().parent / "test-vllm-inference.py"
+
+
+def parse_value(text):
+    """Numbers as numbers, everything else as strings"""
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_grid(params, grid_file):
+    grid = {}
+    if grid_file:
+        with open(grid_file) as f:
+            grid.update({k: v if isinstance(v, list) else [v] for k, v in json.load(f).items()})
+    for param in params:
+        name, sep, values = param.partition("=")
+        if not sep or not values:
+            raise ValueError(f"--param must be NAME=V1,V2,...: '{param}'")
+        grid[name] = [parse_value(v) for v in values.split(",")]
+    return grid
+
+
+def expand(grid):
+    """Every combination of the grid, as dicts"""
+    names = list(grid)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(grid[n] for n in names))]
+
+
+def parse_layout(layout):
+    replicas, sep, tp = str(layout).lower().partition("x")
+    if not sep:
+        raise ValueError(f"layout must be REPLICASxTP, e.g. 2x1: '{layout}'")
+    return int(replicas), int(tp)
+
+
+def config_key(config):
+    return ",".join(f"{k}={config[k]}" for k in sorted(config))
+
+
+def count_gpus():
+    if not shutil.which("nvidia-smi"):
+        return 0
+    try:
+        output = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True, timeout=30).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return 0
+    return sum(1 for line in output.splitlines() if line.startswith("GPU "))
+
+
+def build_commands(args, config, workdir):
+    """One (command, env, report path) per replica of a configuration"""
+    replicas, tp = parse_layout(config.get("layout", "1x1"))
+    if args.gpus and replicas * tp > args.gpus:
+        raise ValueError(f"layout {replicas}x{tp} needs {replicas * tp} GPUs, {args.gpus} available")
+    if args.num_prompts < replicas:
+        raise ValueError(f"layout {replicas}x{tp} needs at least {replicas} prompts, got {args.num_prompts}")
+    flags = []
+    for name, value in config.items():
+        if name == "layout":
+            continue
+        flags += [f"--{name}", str(value)]
+
+    commands = []
+    for i in range(replicas):
+        report = workdir / f"replica{i}.json"
+        cmd = [
+            args.python, str(args.script),
+            "--model", args.model,
+            "--num-prompts", str(args.num_prompts),
+            *(["--shard", f"{i}/{replicas}"] if replicas > 1 else []),
+            "--tensor-parallel", str(tp),
+            *flags,
+            "--output", str(report),
+            *args.extra,
+        ]
+        env = dict(os.environ)
+        if replicas > 1 or args.gpus:
+            env["CUDA_VISIBLE_DEVICES"] = ",".join(str(g) for g in range(i * tp, (i + 1) * tp))
+        commands.append((cmd, env, report))
+    return commands
+
+
+def merge_reports(reports):
+    """Combine replica reports into one result"""
+    requests = [r for report in reports for r in report["requests"]]
+    elapsed = max(report["elapsed_s"] for report in reports)
+    total_tokens = sum(report["total_tokens"] for report in reports)
+    return {
+        "prompts": len(requests),
+        "elapsed_s": elapsed,
+        "total_tokens": total_tokens,
+        # Replicas run at once, so tokens over the slowest replica's time
+        "throughput_tokens_per_s": round(total_tokens / elapsed, 2) if elapsed else 0.0,
+        "latency": {
+            key: summarize([r[key] for r in requests if r.get(key) is not None], scale=1)
+            for key in ("ttft_ms", "tpot_ms", "e2e_ms")
+        },
+    }
+
+
+def run_config(args, config):
+    """Run one configuration to completion and return its result"""
+    workdir = Path(tempfile.mkdtemp(prefix="vllm-sweep-"))
+    result = {"config": config, "key": config_key(config), "ok": False}
+    try:
+        commands = build_commands(args, config, workdir)
+        start = time.perf_counter()
+        procs = []
+        for i, (cmd, env, _) in enumerate(commands):
+            log = open(workdir / f"replica{i}.log", "w")
+            procs.append((subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT), log))
+        deadline = start + args.timeout
+        for proc, log in procs:
+            try:
+                proc.wait(timeout=max(1, deadline - time.perf_counter()))
+            except subprocess.TimeoutExpired:
+                for p, _ in procs:
+                    p.kill()
+                    p.wait()  # reap it, and record its exit code
+                result["error"] = f"Timed out after {args.timeout}s"
+            finally:
+                log.close()
+        result["wall_s"] = round(time.perf_counter() - start, 1)
+        result["exit_codes"] = [p.returncode for p, _ in procs]
+
+        reports = []
+        for i, (_, _, report) in enumerate(commands):
+            if not report.exists():
+                tail = (workdir / f"replica{i}.log").read_text(errors="replace").strip().splitlines()[-5:]
+                result.setdefault("error", f"replica {i} wrote no report: {' | '.join(tail)}")
+                return result
+            with open(report) as f:
+                reports.append(json.load(f))
+        result.update(merge_reports(reports))
+        # The benchmark exits 1 on failed validation but still reports
+        result["ok"] = "error" not in result and result["total_tokens"] > 0
+    except (OSError, ValueError) as e:
+        result["error"] = str(e)
+    finally:
+        if args.keep_logs:
+            result["logs"] = str(workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def metric(result, path):
+    """A value such as 'latency.e2e_ms.p99' from a result"""
+    value = result
+    for part in path.split("."):
+        value = (value or {}).get(part)
+    return value
+
+
+def mark_pareto(results, latency_metric):
+    """Flag results that no other result beats on both throughput and latency"""
+    ok = [r for r in results if r["ok"] and metric(r, latency_metric) is not None]
+    for r in ok:
+        tput, lat = r["throughput_tokens_per_s"], metric(r, latency_metric)
+        r["pareto"] = not any(
+            o["throughput_tokens_per_s"] >= tput and metric(o, latency_metric) <= lat
+            and (o["throughput_tokens_per_s"] > tput or metric(o, latency_metric) < lat)
+            for o in ok
+        )
+
+
+def compare_to_baseline(results, baseline, latency_metric, threshold):
+    """Regressions beyond threshold percent, as messages"""
+    previous = {r["key"]: r for r in baseline.get("results", []) if r.get("ok")}
+    regressions = []
+    for r in results:
+        base = previous.get(r["key"])
+        if base is None:
+            continue
+        if not r["ok"]:
+            regressions.append(f"{r['key']}: failed ({r.get('error', 'no tokens')}), baseline passed")
+            continue
+        old, new = base["throughput_tokens_per_s"], r["throughput_tokens_per_s"]
+        change = (new - old) / old * 100 if old else 0.0
+        r["baseline_throughput_change_pct"] = round(change, 1)
+        if change < -threshold:
+            regressions.append(f"{r['key']}: throughput {old:.1f} -> {new:.1f} tok/s ({change:+.1f}%)")
+        old, new = metric(base, latency_metric), metric(r, latency_metric)
+        if old and new is not None:
+            change = (new - old) / old * 100
+            r["baseline_latency_change_pct"] = round(change, 1)
+            if change > threshold:
+                regressions.append(f"{r['key']}: {latency_metric} {old:.1f} -> {new:.1f} ms ({change:+.1f}%)")
+    return regressions
+
+
+def print_table(results, latency_metric):
+    print(f"\n=== Sweep Results ===")
+    print(f"{'':<2}{'config':<52} {'tok/s':>9} {latency_metric:>18} {'vs base':>8}")
+    ranked = sorted(results, key=lambda r: -(r.get("throughput_tokens_per_s") or 0))
+    for r in ranked:
+        flag = "* " if r.get("pareto") else "  "
+        if not r["ok"]:
+            print(f"{flag}{r['key']:<52} {'FAILED':>9}  {r.get('error', '')[:60]}")
+            continue
+        lat = metric(r, latency_metric)
+        delta = r.get("baseline_throughput_change_pct")
+        print(f"{flag}{r['key']:<52} {r['throughput_tokens_per_s']:>9.1f} "
+              f"{lat if lat is not None else 'n/a':>18} {f'{delta:+.1f}%' if delta is not None else '':>8}")
+    print(f"\n* Pareto-optimal for throughput vs {latency_metric}")
+
+
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(
+        description="Sweep test-vllm-inference.py over a configuration grid",
+        epilog="Arguments after -- are passed to every benchmark run.",
+    )
+    parser.add_argument("--model", "-m", default="facebook/opt-125m",
+                        help="Model name or path (default: facebook/opt-125m)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=V1,V2",
+                        help="Benchmark flag (without --) or 'layout' and the values to sweep; repeatable")
+    parser.add_argument("--grid-file", help="JSON object of NAME: [values] to sweep")
+    parser.add_argument("--num-prompts", type=int, default=200, help="Prompts per configuration (default: 200)")
+    parser.add_argument("--latency-metric", default="latency.e2e_ms.p99",
+                        help="Latency for the Pareto front and baseline check (default: latency.e2e_ms.p99)")
+    parser.add_argument("--gpus", type=int, help="GPUs available for layouts (default: from nvidia-smi)")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds per configuration (default: 1800)")
+    parser.add_argument("--baseline", help="Previous sweep report to check for regressions")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Allowed regression vs baseline, in percent (default: 10)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Write this sweep to --baseline if it has no regressions")
+    parser.add_argument("--force-baseline", action="store_true",
+                        help="With --update-baseline, write it even with regressions (accept them)")
+    parser.add_argument("--output", "-o", default="vllm-sweep-results.json",
+                        help="Sweep report path (default: vllm-sweep-results.json)")
+    parser.add_argument("--script", default=str(BENCHMARK), help=argparse.SUPPRESS)
+    parser.add_argument("--python", default=sys.executable, help="Interpreter for the benchmark (default: this one)")
+    parser.add_argument("--keep-logs", action="store_true", help="Keep each configuration's logs and reports")
+    parser.add_argument("--dry-run", action="store_true", help="Print the commands without running them")
+    parser.add_argument("extra", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.extra[:1] == ["--"]:
+        args.extra = args.extra[1:]
+    if args.gpus is None:
+        args.gpus = count_gpus()
+
+    try:
+        configs = expand(parse_grid(args.param, args.grid_file))
+        for config in configs:
+            parse_layout(config.get("layout", "1x1"))
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        return 1
+
+    print(f"\n=== vLLM Inference Sweep ===\n")
+    print(f"Model: {args.model}")
+    print(f"Configurations: {len(configs)}")
+    print(f"GPUs: {args.gpus or 'unknown'}")
+
+    if args.dry_run:
+        for config in configs:
+            print(f"\n{config_key(config)}")
+            try:
+                for cmd, env, _ in build_commands(args, config, Path("<tmp>")):
+                    devices = env.get("CUDA_VISIBLE_DEVICES")
+                    print(f"  {'CUDA_VISIBLE_DEVICES=' + devices + ' ' if devices else ''}{' '.join(cmd)}")
+            except ValueError as e:
+                print(f"  skipped: {e}")
+        return 0
+
+    results = []
+    for i, config in enumerate(configs, 1):
+        print(f"\n[{i}/{len(configs)}] {config_key(config)}")
+        result = run_config(args, config)
+        if result["ok"]:
+            print(f"  {result['throughput_tokens_per_s']:.1f} tok/s, "
+                  f"{args.latency_metric} {metric(result, args.latency_metric)} ms ({result['wall_s']}s)")
+        else:
+            print(f"  FAILED: {result.get('error', 'no tokens generated')}")
+        results.append(result)
+
+    mark_pareto(results, args.latency_metric)
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.latency_metric, args.threshold)
+    elif args.baseline and not args.update_baseline:
+        print(f"\nWARNING: baseline {args.baseline} not found; skipping regression check")
+
+    print_table(results, args.latency_metric)
+
+    report = {
+        "model": args.model,
+        "num_prompts": args.num_prompts,
+        "latency_metric": args.latency_metric,
+        "extra_args": args.extra,
+        "results": results,
+        "pareto": [r["key"] for r in results if r.get("pareto")],
+        "regressions": regressions,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+    if args.baseline and args.update_baseline:
+        if regressions and not args.force_baseline:
+            # Otherwise the regressed numbers become the bar the next run passes
+            print(f"Baseline not updated: regressions found (use --force-baseline to accept them)")
+        else:
+            with open(args.baseline, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Baseline updated: {args.baseline}")
+
+    if regressions:
+        print(f"\n=== Regressions (> {args.threshold:g}% vs {args.baseline}) ===")
+        for message in regressions:
+            print(f"  {message}")
+        return 1
+    if not any(r["ok"] for r in results):
+        print("\nNo configuration completed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        exit(main())
+    except KeyboardInterrupt:
+        print("\n\nSweep interrupted by user")
+        exit(1)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3.12
+"""
+scripts/test-pytorch-collectives.py
+Microbenchmark torch.distributed collectives across GPUs
+
+Sweeps message sizes for all_reduce, all_gather, broadcast and
+reduce_scatter and reports, as nccl-tests does:
+  - time:   mean per call, slowest rank
+  - algbw:  size / time
+  - busbw:  algbw scaled to the traffic each link carries, comparable
+            to the hardware's peak bandwidth whatever the rank count:
+              all_reduce       2(n-1)/n
+              all_gather       (n-1)/n    (size = gathered output)
+              reduce_scatter   (n-1)/n    (size = scattered input)
+              broadcast        1
+
+Each collective's result is checked once at the smallest size before
+timing. Training throughput in test-pytorch-ddp.py mixes compute and
+communication; low busbw here points at the interconnect (PCIe topology,
+P2P disabled, NCCL falling back to sockets).
+
+--device cpu uses gloo with N processes, so it runs without GPUs.
+Collectives a backend doesn't support are reported and skipped.
+
+Usage:
+    python3.12 test-pytorch-collectives.py                        # all GPUs, NCCL
+    python3.12 test-pytorch-collectives.py --ops all_reduce --max-bytes 1G
+    python3.12 test-pytorch-collectives.py --device cpu --nprocs 2 --max-bytes 16M
+    python3.12 test-pytorch-collectives.py --min-busbw 20 --output collectives.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import time
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+OPS = ["all_reduce", "all_gather", "broadcast", "reduce_scatter"]
+
+# Bus bandwidth factor for n ranks
+BUS_FACTOR = {
+    "all_reduce": lambda n: 2 * (n - 1) / n,
+    "all_gather": lambda n: (n - 1) / n,
+    "reduce_scatter": lambda n: (n - 1) / n,
+    "broadcast": lambda n: 1.0,
+}
+
+DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+def parse_size(text):
+    """Bytes from '64', '32K', '16M' or '1G'"""
+    text = text.strip().upper().removesuffix("B")
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, scale in (("G", 2**30), ("M", 2**20), ("K", 2**10)):
+        if size >= scale:
+            return f"{size / scale:g}{unit}"
+    return f"{size}B"
+
+
+def find_free_port():
+    """Ask the OS for a port nobody is listening on"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def make_call(op, size, world_size, dtype, device):
+    """Tensors for one message size and a function running the collective once"""
+    # Gathered/scattered sizes must split evenly across ranks
+    count = max(world_size, size // dtype.itemsize // world_size * world_size)
+    rank = dist.get_rank()
+
+    if op == "all_reduce":
+        tensor = torch.ones(count, dtype=dtype, device=device)
+        return count, tensor, lambda: dist.all_reduce(tensor)
+    if op == "broadcast":
+        tensor = torch.full((count,), float(rank), dtype=dtype, device=device)
+        return count, tensor, lambda: dist.broadcast(tensor, src=0)
+    if op == "all_gather":
+        shard = torch.full((count // world_size,), float(rank), dtype=dtype, device=device)
+        output = torch.empty(count, dtype=dtype, device=device)
+        return count, output, lambda: dist.all_gather_into_tensor(output, shard)
+    # reduce_scatter
+    full = torch.ones(count, dtype=dtype, device=device)
+    output = torch.empty(count // world_size, dtype=dtype, device=device)
+    return count, output, lambda: dist.reduce_scatter_tensor(output, full)
+
+
+def check_result(op, result, world_size):
+    """Whether a collective produced the expected values"""
+    if op in ("all_reduce", "reduce_scatter"):
+        expected = torch.full_like(result, float(world_size))
+    elif op == "broadcast":
+        expected = torch.zeros_like(result)
+    else:
+        shard = result.numel() // world_size
+        expected = torch.arange(world_size, dtype=result.dtype, device=result.device).repeat_interleave(shard)
+    return torch.equal(result, expected)
+
+
+def run_collectives(rank, world_size, args, port, results):
+    """Benchmark function for each rank"""
+
+    os.environ['MASTER_ADDR'] = 'localhost'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group(backend=args.backend, init_method='env://', rank=rank, world_size=world_size)
+
+    if args.device == 'cuda':
+        torch.cuda.set_device(rank)
+        device = torch.device(f'cuda:{rank}')
+    else:
+        device = torch.device('cpu')
+    dtype = DTYPES[args.dtype]
+
+    def sync():
+        if args.device == 'cuda':
+            torch.cuda.synchronize(device)
+
+    rows, errors = [], {}
+    for op in args.ops:
+        # Correctness first, at the smallest size
+        try:
+            _, result, call = make_call(op, args.sizes[0], world_size, dtype, device)
+            call()
+            sync()
+            correct = check_result(op, result, world_size)
+        except (RuntimeError, NotImplementedError) as e:
+            errors[op] = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+            continue
+        # Every rank must agree to carry on
+        flag = torch.tensor([0 if correct else 1], device=device)
+        dist.all_reduce(flag, op=dist.ReduceOp.MAX)
+        if flag.item():
+            errors[op] = "wrong result"
+            continue
+
+        for size in args.sizes:
+            count, _, call = make_call(op, size, world_size, dtype, device)
+            for _ in range(args.warmup):
+                call()
+            sync()
+            dist.barrier()
+            start = time.perf_counter()
+            for _ in range(args.iters):
+                call()
+            sync()
+            elapsed = torch.tensor([(time.perf_counter() - start) / args.iters], dtype=torch.float64, device=device)
+            # The collective isn't done until the slowest rank is
+            dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+            seconds = elapsed.item()
+            nbytes = count * dtype.itemsize
+            algbw = nbytes / seconds / 1e9
+            rows.append({
+                "op": op,
+                "bytes": nbytes,
+                "count": count,
+                "time_us": round(seconds * 1e6, 2),
+                "algbw_gbps": round(algbw, 3),
+                "busbw_gbps": round(algbw * BUS_FACTOR[op](world_size), 3),
+            })
+            if rank == 0 and args.verbose:
+                print(f"  {op} {format_size(nbytes)}: {seconds * 1e6:.1f} us")
+
+    if rank == 0:
+        results.put({"rows": rows, "errors": errors})
+    dist.destroy_process_group()
+
+
+def main():
+    """Main entry point"""
+
+    parser = argparse.ArgumentParser(description="Benchmark torch.distributed collectives")
+    parser.add_argument("--device", choices=["auto", "cuda", "cpu"], default="auto",
+                        help="cuda (nccl) or cpu (gloo); auto picks cuda when available (default: auto)")
+    parser.add_argument("--backend", choices=["nccl", "gloo"],
+                        help="Process group backend (default: nccl on cuda, gloo on cpu)")
+    parser.add_argument("--nprocs", type=int, help="Ranks (default: all GPUs, or 2 on cpu)")
+    parser.add_argument("--ops", default=",".join(OPS), help="Comma-separated collectives (default: all)")
+    parser.add_argument("--min-bytes", default="8K", help="Smallest message (default: 8K)")
+    parser.add_argument("--max-bytes", help="Largest message (default: 256M on cuda, 16M on cpu)")
+    parser.add_argument("--factor", type=int, default=4, help="Size multiplier between steps (default: 4)")
+    parser.add_argument("--dtype", choices=list(DTYPES), default="float32", help="Element type (default: float32)")
+    parser.add_argument("--iters", type=int, default=20, help="Timed calls per size (default: 20)")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed calls per size (default: 5)")
+    parser.add_argument("--min-busbw", type=float,
+                        help="Fail if all_reduce bus bandwidth at the largest size is below this, in GB/s")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Print each measurement as it completes")
+    parser.add_argument("--output", "-o", help="Write the results JSON here")
+    args = parser.parse_args()
+
+    if args.device == "auto":
+        args.device = "cuda" if torch.cuda.is_available() else "cpu"
+    cuda = args.device == "cuda"
+    args.backend = args.backend or ("nccl" if cuda else "gloo")
+    args.ops = [op.strip() for op in args.ops.split(",") if op.strip()]
+    unknown = [op for op in args.ops if op not in OPS]
+    if unknown:
+        print(f"ERROR: Unknown collective {', '.join(unknown)}; choose from {', '.join(OPS)}")
+        return 1
+
+    if cuda and not torch.cuda.is_available():
+        print("ERROR: CUDA not available (use --device cpu to test on CPU)")
+        return 1
+    if args.backend == "nccl" and not cuda:
+        print("ERROR: The nccl backend needs --device cuda")
+        return 1
+
+    world_size = args.nprocs or (torch.cuda.device_count() if cuda else 2)
+    if cuda and world_size > torch.cuda.device_count():
+        print(f"ERROR: {world_size} ranks need {world_size} GPUs, {torch.cuda.device_count()} detected")
+        return 1
+    if world_size < 2:
+        print(f"WARNING: Only {world_size} rank; collectives won't touch the interconnect")
+
+    try:
+        min_bytes = parse_size(args.min_bytes)
+        max_bytes = parse_size(args.max_bytes or ("256M" if cuda else "16M"))
+    except ValueError as e:
+        print(f"ERROR: Invalid size: {e}")
+        return 1
+    args.sizes = []
+    size = min_bytes
+    while size <= max_bytes:
+        args.sizes.append(size)
+        size *= max(2, args.factor)
+
+    print(f"\n=== torch.distributed Collectives Benchmark ===")
+    print(f"PyTorch version: {torch.__version__}")
+    if cuda:
+        print(f"CUDA version: {torch.version.cuda}")
+        if args.backend == "nccl":
+            print(f"NCCL version: {'.'.join(str(v) for v in torch.cuda.nccl.version())}")
+        for i in range(world_size):
+            print(f"GPU {i}: {torch.cuda.get_device_name(i)}")
+    print(f"Backend: {args.backend}, {world_size} ranks, {args.dtype}")
+    print(f"Sizes: {format_size(args.sizes[0])} to {format_size(args.sizes[-1])}, "
+          f"{args.iters} iterations (+{args.warmup} warmup)\n")
+
+    results = mp.get_context('spawn').SimpleQueue()
+    mp.spawn(run_collectives, args=(world_size, args, find_free_port(), results), nprocs=world_size, join=True)
+    outcome = results.get()
+    rows, errors = outcome["rows"], outcome["errors"]
+
+    for op in args.ops:
+        print(f"=== {op} ===")
+        if op in errors:
+            print(f"  skipped: {errors[op]}\n")
+            continue
+        print(f"{'size':>8} {'count':>12} {'time (us)':>11} {'algbw GB/s':>11} {'busbw GB/s':>11}")
+        for row in (r for r in rows if r["op"] == op):
+            print(f"{format_size(row['bytes']):>8} {row['count']:>12} {row['time_us']:>11.1f} "
+                  f"{row['algbw_gbps']:>11.2f} {row['busbw_gbps']:>11.2f}")
+        print()
+
+    if args.output:
+        report = {
+            "device": args.device,
+            "backend": args.backend,
+            "world_size": world_size,
+            "dtype": args.dtype,
+            "iters": args.iters,
+            "results": rows,
+            "errors": errors,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}\n")
+
+    # Validation
+    print(f"=== Validation ===")
+    success = True
+    wrong = [op for op, error in errors.items() if error == "wrong result"]
+    if wrong:
+        print(f"✗ Wrong results from {', '.join(wrong)}")
+        success = False
+    else:
+        print("✓ Collectives returned correct results")
+
+    largest = [r for r in rows if r["op"] == "all_reduce"][-1:]
+    if args.min_busbw is None:
+        if largest:
+            print(f"- all_reduce bus bandwidth {largest[0]['busbw_gbps']:.2f} GB/s at "
+                  f"{format_size(largest[0]['bytes'])} (no --min-busbw set)")
+    elif not largest:
+        print("✗ No all_reduce result to check against --min-busbw")
+        success = False
+    elif largest[0]["busbw_gbps"] >= args.min_busbw:
+        print(f"✓ all_reduce bus bandwidth {largest[0]['busbw_gbps']:.2f} GB/s >= {args.min_busbw:g} GB/s")
+    else:
+        print(f"✗ all_reduce bus bandwidth {largest[0]['busbw_gbps']:.2f} GB/s < {args.min_busbw:g} GB/s")
+        success = False
+
+    if success:
+        print(f"\nTest completed successfully!")
+        return 0
+    print(f"\nSome checks failed")
+    return 1
+
+if __name__ == "__main__":
+    exit(main())
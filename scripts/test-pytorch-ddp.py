@@ -2,141 +2,594 @@
 """
 scripts/test-pytorch-ddp.py
 Test PyTorch DistributedDataParallel (DDP) on multiple GPUs
+
+Trains ResNet on synthetic data at each world size in --world-sizes
+(default: 1 and every available GPU), each run in fresh processes on a
+free port. Per-rank batch size is fixed, so ideal scaling is N times the
+world_size=1 throughput; scaling efficiency is measured against that real
+single-rank baseline. Warmup iterations are excluded from timing.
+
+--device cpu runs the same harness with the gloo backend and N CPU
+processes (threads split evenly between them), so it can be checked on a
+machine without GPUs.
+
+Training options (apply to every run):
+  --precision bf16|fp16   autocast mixed precision (fp16 adds a GradScaler)
+  --channels-last         NHWC memory format for model and inputs
+  --compile               torch.compile the DDP model
+  --bucket-cap-mb N       DDP gradient bucket size
+  --gradient-as-bucket-view, --static-graph   DDP options
+  --grad-accum N          step the optimizer every N micro-batches, skipping
+                          the all-reduce (no_sync) on the others
+  --zero                  ZeroRedundancyOptimizer (shards optimizer state;
+                          matters with --optimizer adamw)
+
+--matrix runs a set of these configurations at one world size instead of
+the scaling test, and compares throughput and peak memory to fp32 with
+default DDP settings.
+
+By default every step reuses one tensor already on the device. --data disk
+instead writes a synthetic uint8 image dataset to --data-dir as memory-
+mapped NumPy shards (once; reused while the shape matches) and reads it
+through a DataLoader with a DistributedSampler, --workers, --pin-memory,
+--prefetch-factor and --persistent-workers. Each step is then split into
+data wait (next batch, host-to-device copy and conversion) and compute,
+with a device sync between them so the split is exact.
+
+Usage:
+    python3.12 test-pytorch-ddp.py                          # 1 GPU, then all GPUs
+    python3.12 test-pytorch-ddp.py --world-sizes 1,2,4
+    python3.12 test-pytorch-ddp.py --device cpu --world-sizes 1,2 --model resnet18
+    python3.12 test-pytorch-ddp.py --output ddp-scaling.json
+    python3.12 test-pytorch-ddp.py --precision bf16 --channels-last --world-sizes 1,2
+    python3.12 test-pytorch-ddp.py --matrix                          # all presets on all GPUs
+    python3.12 test-pytorch-ddp.py --matrix baseline,bf16,bf16-channels-last,compile --optimizer adamw
+    python3.12 test-pytorch-ddp.py --data disk --workers 8 --data-dir /mnt/scratch/ddp-data
+    python3.12 test-pytorch-ddp.py --device cpu --data disk --workers 2 --world-sizes 1,2 --model resnet18
 """
 
+import argparse
+import itertools
+import json
 import os
+import resource
+import socket
+import statistics
+import tempfile
 import time
+from contextlib import nullcontext
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.distributed as dist
 import torch.multiprocessing as mp
+from torch.distributed.optim import ZeroRedundancyOptimizer
 from torch.nn.parallel import DistributedDataParallel as DDP
-from torchvision.models import resnet50
+from torch.utils.data import DataLoader, Dataset, DistributedSampler
+from torchvision import models
+
+
+TRAINING_DEFAULTS = {
+    "precision": "fp32",
+    "channels_last": False,
+    "compile": False,
+    "bucket_cap_mb": None,
+    "gradient_as_bucket_view": False,
+    "static_graph": False,
+    "grad_accum": 1,
+    "zero": False,
+}
+
+# --matrix presets: overrides of TRAINING_DEFAULTS
+MATRIX = {
+    "baseline": {},
+    "bf16": {"precision": "bf16"},
+    "fp16": {"precision": "fp16"},
+    "channels-last": {"channels_last": True},
+    "bf16-channels-last": {"precision": "bf16", "channels_last": True},
+    "compile": {"precision": "bf16", "channels_last": True, "compile": True},
+    "bucket-100mb": {"bucket_cap_mb": 100},
+    "bucket-view": {"gradient_as_bucket_view": True},
+    "static-graph": {"static_graph": True},
+    "grad-accum-4": {"grad_accum": 4},
+    "zero": {"zero": True},
+    "combined": {"precision": "bf16", "channels_last": True, "gradient_as_bucket_view": True,
+                 "static_graph": True, "zero": True},
+}
+
+
+class ShardDataset(Dataset):
+    """Images and labels from memory-mapped .npy shards written by write_dataset"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        self.shards = None  # opened lazily, once per worker process
+
+    def __len__(self):
+        return self.meta["samples"]
+
+    def __getitem__(self, index):
+        if self.shards is None:
+            self.shards = [
+                (np.load(os.path.join(self.directory, f"images-{i:05d}.npy"), mmap_mode="r"),
+                 np.load(os.path.join(self.directory, f"labels-{i:05d}.npy"), mmap_mode="r"))
+                for i in range(self.meta["shards"])
+            ]
+        images, labels = self.shards[index // self.meta["shard_size"]]
+        offset = index % self.meta["shard_size"]
+        return torch.from_numpy(np.array(images[offset])), int(labels[offset])
+
+
+def write_dataset(directory, samples, image_size, shard_size):
+    """Write random uint8 images as .npy shards, unless a matching set exists"""
+    meta = {"samples": samples, "image_size": image_size, "shard_size": shard_size,
+            "shards": (samples + shard_size - 1) // shard_size}
+    meta_path = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return False
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    for i in range(meta["shards"]):
+        count = min(shard_size, samples - i * shard_size)
+        images = np.lib.format.open_memmap(os.path.join(directory, f"images-{i:05d}.npy"), mode="w+",
+                                           dtype=np.uint8, shape=(count, 3, image_size, image_size))
+        images[:] = rng.integers(0, 256, size=images.shape, dtype=np.uint8)
+        images.flush()
+        del images
+        np.save(os.path.join(directory, f"labels-{i:05d}.npy"), rng.integers(0, 1000, size=count, dtype=np.int64))
+    # Written last, so an interrupted write is redone next time
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return True
+
+
+def device_batches(loader, sampler, device, memory_format, non_blocking):
+    """Batches on the device as float images in [0, 1], epoch after epoch"""
+    for epoch in itertools.count():
+        sampler.set_epoch(epoch)
+        for images, labels in loader:
+            images = images.to(device, non_blocking=non_blocking).float().div_(255)
+            yield images.contiguous(memory_format=memory_format), labels.to(device, non_blocking=non_blocking)
+
 
-def train_ddp(rank, world_size):
-    """Training function for each GPU process"""
+def find_free_port():
+    """Ask the OS for a port nobody is listening on"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def train_ddp(rank, world_size, args, port, results):
+    """Training function for each rank"""
 
     # Initialize process group
     os.environ['MASTER_ADDR'] = 'localhost'
-    os.environ['MASTER_PORT'] = '12355'
+    os.environ['MASTER_PORT'] = str(port)
 
     dist.init_process_group(
-        backend='nccl',
+        backend=args.backend,
         init_method='env://',
         rank=rank,
         world_size=world_size
     )
 
     # Set device
-    torch.cuda.set_device(rank)
-    device = torch.device(f'cuda:{rank}')
+    if args.device == 'cuda':
+        torch.cuda.set_device(rank)
+        device = torch.device(f'cuda:{rank}')
+    else:
+        # Same threads per rank at every world size (fixed by main), so the
+        # single-rank baseline doesn't get all the cores
+        torch.set_num_threads(args.threads_per_rank)
+        device = torch.device('cpu')
 
-    if rank == 0:
-        print(f"\n=== PyTorch DDP Multi-GPU Test ===")
-        print(f"PyTorch version: {torch.__version__}")
-        print(f"CUDA version: {torch.version.cuda}")
-        print(f"World size: {world_size} GPUs")
-        print(f"Backend: NCCL\n")
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
 
     # Create model and wrap with DDP
-    model = resnet50(weights=None).to(device)
-    ddp_model = DDP(model, device_ids=[rank])
+    model = getattr(models, args.model)(weights=None).to(device, memory_format=memory_format)
+    ddp_options = {
+        "gradient_as_bucket_view": args.gradient_as_bucket_view,
+        "static_graph": args.static_graph,
+    }
+    if args.bucket_cap_mb:
+        ddp_options["bucket_cap_mb"] = args.bucket_cap_mb
+    ddp_model = DDP(model, device_ids=[rank] if args.device == 'cuda' else None, **ddp_options)
+    forward = torch.compile(ddp_model) if args.compile else ddp_model
 
-    # Synthetic data
-    batch_size = 32
-    data = torch.randn(batch_size, 3, 224, 224).to(device)
-    target = torch.randint(0, 1000, (batch_size,)).to(device)
+    if args.data == 'disk':
+        dataset = ShardDataset(args.data_dir)
+        sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True, drop_last=True)
+        loader_options = {}
+        if args.workers:
+            loader_options = {"prefetch_factor": args.prefetch_factor,
+                              "persistent_workers": args.persistent_workers}
+        loader = DataLoader(dataset, batch_size=args.batch_size, sampler=sampler, num_workers=args.workers,
+                            pin_memory=args.pin_memory, drop_last=True, **loader_options)
+        batches = device_batches(loader, sampler, device, memory_format, non_blocking=args.pin_memory)
+    else:
+        # Synthetic data
+        data = torch.randn(args.batch_size, 3, args.image_size, args.image_size).to(device, memory_format=memory_format)
+        target = torch.randint(0, 1000, (args.batch_size,)).to(device)
+        batches = itertools.repeat((data, target))
 
     # Loss and optimizer
     criterion = nn.CrossEntropyLoss()
-    optimizer = torch.optim.SGD(ddp_model.parameters(), lr=0.01)
+    optimizer_class, optimizer_options = {
+        "sgd": (torch.optim.SGD, {"lr": 0.01}),
+        "adamw": (torch.optim.AdamW, {"lr": 1e-3}),
+    }[args.optimizer]
+    if args.zero:
+        optimizer = ZeroRedundancyOptimizer(ddp_model.parameters(), optimizer_class=optimizer_class,
+                                            **optimizer_options)
+    else:
+        optimizer = optimizer_class(ddp_model.parameters(), **optimizer_options)
 
-    # Training loop
-    iterations = 100
-    start_time = time.time()
+    amp_dtype = {"bf16": torch.bfloat16, "fp16": torch.float16}.get(args.precision)
+    scaler = torch.amp.GradScaler(args.device, enabled=args.precision == "fp16")
+    micro_step = 0
 
-    for i in range(iterations):
-        optimizer.zero_grad()
-        output = ddp_model(data)
-        loss = criterion(output, target)
-        loss.backward()
-        optimizer.step()
+    def step(data, target):
+        nonlocal micro_step
+        micro_step += 1
+        boundary = micro_step % args.grad_accum == 0
+        # Gradients are only all-reduced on the micro-batch that steps
+        with (ddp_model.no_sync() if not boundary else nullcontext()):
+            with torch.autocast(device_type=args.device, dtype=amp_dtype, enabled=amp_dtype is not None):
+                output = forward(data)
+                loss = criterion(output, target) / args.grad_accum
+            scaler.scale(loss).backward()
+        if boundary:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad(set_to_none=True)
+        return loss
 
-        if rank == 0 and i % 20 == 0:
-            print(f"Iteration {i}/{iterations}, Loss: {loss.item():.4f}")
+    def sync():
+        if args.device == 'cuda':
+            torch.cuda.synchronize(device)
+        dist.barrier()
 
-    # Synchronize all processes
-    dist.barrier()
+    # Only split data wait from compute when there is an input pipeline;
+    # the per-step device sync would otherwise cost time for nothing
+    timed_steps = args.data == 'disk'
+    data_wait, compute = [], []
 
-    elapsed = time.time() - start_time
-    throughput = (iterations * batch_size * world_size) / elapsed
+    def device_sync():
+        if timed_steps and args.device == 'cuda':
+            torch.cuda.synchronize(device)
 
-    if rank == 0:
-        print(f"\n=== Training Complete ===")
-        print(f"Total time: {elapsed:.2f}s")
-        print(f"Throughput: {throughput:.2f} samples/sec")
-        print(f"Average iteration time: {(elapsed/iterations)*1000:.2f}ms")
-
-        # Calculate scaling efficiency (compared to single GPU)
-        single_gpu_throughput = throughput / world_size
-        scaling_efficiency = throughput / (single_gpu_throughput * world_size)
-        print(f"Scaling efficiency: {scaling_efficiency*100:.1f}%")
-
-        # Success criteria
-        print(f"\n=== Validation ===")
-        if throughput > 50:  # Minimum expected throughput
-            print("✓ Throughput test PASSED")
-        else:
-            print("✗ Throughput test FAILED (too slow)")
+    for _ in range(args.warmup):
+        step(*next(batches))
+    sync()
 
-        if scaling_efficiency > 0.75:  # 75% efficiency minimum
-            print("✓ Scaling efficiency PASSED")
-        else:
-            print("✗ Scaling efficiency FAILED (poor scaling)")
+    # Training loop
+    start_time = time.perf_counter()
+    for i in range(args.iterations):
+        step_start = time.perf_counter()
+        data, target = next(batches)
+        device_sync()
+        data_ready = time.perf_counter()
+        loss = step(data, target)
+        device_sync()
+        if timed_steps:
+            data_wait.append(data_ready - step_start)
+            compute.append(time.perf_counter() - data_ready)
+        if rank == 0 and i % 20 == 0:
+            print(f"  [world_size={world_size}] Iteration {i}/{args.iterations}, Loss: {loss.item() * args.grad_accum:.4f}")
+    sync()
+    elapsed = time.perf_counter() - start_time
 
-        print(f"\nTest completed successfully!")
+    pipeline = {}
+    if timed_steps:
+        # The slowest rank's input pipeline holds everyone up at the all-reduce
+        totals = torch.tensor([sum(data_wait), sum(compute)], dtype=torch.float64, device=device)
+        dist.all_reduce(totals, op=dist.ReduceOp.MAX)
+        ordered = sorted(data_wait)
+        pipeline = {
+            "data_wait_ms": round(statistics.fmean(data_wait) * 1000, 2),
+            "data_wait_p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 2),
+            "compute_ms": round(statistics.fmean(compute) * 1000, 2),
+            "data_wait_fraction": round(sum(data_wait) / (sum(data_wait) + sum(compute)), 4),
+            "max_rank_data_wait_s": round(totals[0].item(), 3),
+        }
+
+    if rank == 0:
+        if args.device == 'cuda':
+            peak_memory_mb = torch.cuda.max_memory_allocated(device) / 2**20
+        else:
+            # ru_maxrss is in KB on Linux: peak RSS of this rank's process
+            peak_memory_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        results.put({
+            "world_size": world_size,
+            "elapsed_s": elapsed,
+            "throughput": args.iterations * args.batch_size * world_size / elapsed,
+            "iteration_ms": elapsed / args.iterations * 1000,
+            "peak_memory_mb": round(peak_memory_mb, 1),
+            **pipeline,
+        })
 
     # Cleanup
     dist.destroy_process_group()
 
+
+def run_world(world_size, args):
+    """Train with world_size ranks in fresh processes and return rank 0's timing"""
+    ctx = mp.get_context('spawn')
+    results = ctx.SimpleQueue()
+    mp.spawn(
+        train_ddp,
+        args=(world_size, args, find_free_port(), results),
+        nprocs=world_size,
+        join=True
+    )
+    return results.get()
+
+
+def pipeline_header(args):
+    return f" {'data ms':>8} {'compute ms':>11} {'wait':>6}" if args.data == "disk" else ""
+
+
+def pipeline_columns(run):
+    """Data wait vs compute per step, for --data disk runs"""
+    if "data_wait_ms" not in run:
+        return ""
+    return f" {run['data_wait_ms']:>8.2f} {run['compute_ms']:>11.2f} {run['data_wait_fraction'] * 100:>5.1f}%"
+
+
+def input_pipeline(args):
+    if args.data != "disk":
+        return None
+    return {"data_dir": args.data_dir, "dataset_size": args.dataset_size, "workers": args.workers,
+            "pin_memory": args.pin_memory, "prefetch_factor": args.prefetch_factor,
+            "persistent_workers": args.persistent_workers}
+
+
+def describe(config):
+    """Training options that differ from the defaults"""
+    changed = [f"{k}={v}" for k, v in config.items() if TRAINING_DEFAULTS[k] != v]
+    return ", ".join(changed) or "fp32, default DDP"
+
+
+def run_matrix(names, world_size, args):
+    """Run each preset at world_size; failures are recorded, not fatal"""
+    runs = []
+    for name in names:
+        config = {**TRAINING_DEFAULTS, **MATRIX[name]}
+        print(f"--- {name}: {describe(config)} ---")
+        if config["precision"] == "fp16" and args.device == "cpu":
+            print("  skipped: fp16 autocast needs cuda")
+            runs.append({"name": name, "config": config, "error": "fp16 needs cuda"})
+            continue
+        try:
+            result = run_world(world_size, argparse.Namespace(**{**vars(args), **config}))
+        except Exception as e:
+            # e.g. torch.compile without a working compiler toolchain
+            print(f"  FAILED: {str(e).strip().splitlines()[-1] if str(e).strip() else type(e).__name__}")
+            runs.append({"name": name, "config": config, "error": str(e).strip()[-500:]})
+            continue
+        runs.append({"name": name, "config": config, **result})
+
+    baseline = next((r for r in runs if r["name"] == "baseline" and "error" not in r), None)
+    print(f"\n=== Optimization Matrix ({world_size} rank{'s' if world_size > 1 else ''}) ===")
+    print(f"{'config':<20} {'samples/s':>11} {'vs base':>8} {'iter ms':>9} {'peak MB':>9} {'vs base':>8}"
+          f"{pipeline_header(args)}")
+    for run in sorted(runs, key=lambda r: -r.get("throughput", 0)):
+        if "error" in run:
+            print(f"{run['name']:<20} {'failed':>11}")
+            continue
+        if baseline:
+            run["speedup"] = run["throughput"] / baseline["throughput"]
+            run["memory_ratio"] = run["peak_memory_mb"] / baseline["peak_memory_mb"]
+        speedup = f"{run['speedup']:.2f}x" if baseline else "n/a"
+        memory = f"{run['memory_ratio']:.2f}x" if baseline else "n/a"
+        print(f"{run['name']:<20} {run['throughput']:>11.2f} {speedup:>8} {run['iteration_ms']:>9.2f} "
+              f"{run['peak_memory_mb']:>9.0f} {memory:>8}{pipeline_columns(run)}")
+    return runs
+
+
 def main():
     """Main entry point"""
 
+    parser = argparse.ArgumentParser(description="Measure PyTorch DDP scaling")
+    parser.add_argument("--device", choices=["auto", "cuda", "cpu"], default="auto",
+                        help="cuda (nccl) or cpu (gloo); auto picks cuda when available (default: auto)")
+    parser.add_argument("--backend", choices=["nccl", "gloo"],
+                        help="Process group backend (default: nccl on cuda, gloo on cpu)")
+    parser.add_argument("--world-sizes",
+                        help="Comma-separated ranks per run (default: 1 and all GPUs, or 1,2 on cpu)")
+    parser.add_argument("--model", choices=["resnet18", "resnet50"], default="resnet50",
+                        help="torchvision model (default: resnet50)")
+    parser.add_argument("--batch-size", type=int, help="Per-rank batch size (default: 32 on cuda, 8 on cpu)")
+    parser.add_argument("--image-size", type=int, help="Input resolution (default: 224 on cuda, 64 on cpu)")
+    parser.add_argument("--iterations", type=int, default=100, help="Timed iterations (default: 100)")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed iterations first (default: 10)")
+    parser.add_argument("--min-efficiency", type=float, default=0.75,
+                        help="Minimum scaling efficiency at the largest world size (default: 0.75)")
+    parser.add_argument("--optimizer", choices=["sgd", "adamw"], default="sgd", help="Optimizer (default: sgd)")
+    parser.add_argument("--precision", choices=["fp32", "bf16", "fp16"], default="fp32",
+                        help="Autocast precision (default: fp32)")
+    parser.add_argument("--channels-last", action="store_true", help="Use channels_last memory format")
+    parser.add_argument("--compile", action="store_true", help="torch.compile the model")
+    parser.add_argument("--bucket-cap-mb", type=int, help="DDP gradient bucket size (default: DDP's 25)")
+    parser.add_argument("--gradient-as-bucket-view", action="store_true", help="DDP gradient_as_bucket_view")
+    parser.add_argument("--static-graph", action="store_true", help="DDP static_graph")
+    parser.add_argument("--grad-accum", type=int, default=1, help="Micro-batches per optimizer step (default: 1)")
+    parser.add_argument("--zero", action="store_true", help="Shard optimizer state with ZeroRedundancyOptimizer")
+    parser.add_argument("--matrix", nargs="?", const="all", metavar="PRESETS",
+                        help=f"Compare comma-separated presets (default: all) at the largest world size: "
+                             f"{', '.join(MATRIX)}")
+    parser.add_argument("--data", choices=["synthetic", "disk"], default="synthetic",
+                        help="One on-device tensor, or a DataLoader over on-disk shards (default: synthetic)")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "ddp-bench-data"),
+                        help="Where --data disk writes its shards (default: $TMPDIR/ddp-bench-data)")
+    parser.add_argument("--dataset-size", type=int, default=4096, help="Samples on disk (default: 4096)")
+    parser.add_argument("--shard-size", type=int, default=512, help="Samples per shard (default: 512)")
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader workers per rank (default: 4)")
+    parser.add_argument("--pin-memory", action=argparse.BooleanOptionalAction,
+                        help="Pin host batches for async copies (default: on for cuda)")
+    parser.add_argument("--prefetch-factor", type=int, default=2,
+                        help="Batches prefetched per worker (default: 2)")
+    parser.add_argument("--persistent-workers", action=argparse.BooleanOptionalAction, default=True,
+                        help="Keep workers alive between epochs (default: on)")
+    parser.add_argument("--output", "-o", help="Write the results JSON here")
+    args = parser.parse_args()
+
+    if args.device == "auto":
+        args.device = "cuda" if torch.cuda.is_available() else "cpu"
+    cuda = args.device == "cuda"
+    args.backend = args.backend or ("nccl" if cuda else "gloo")
+    args.batch_size = args.batch_size or (32 if cuda else 8)
+    args.image_size = args.image_size or (224 if cuda else 64)
+    args.cpu_threads = os.cpu_count() or 1
+    if args.pin_memory is None:
+        args.pin_memory = cuda
+    if args.grad_accum < 1:
+        print("ERROR: --grad-accum must be at least 1")
+        return 1
+    if args.precision == "fp16" and not cuda:
+        print("ERROR: fp16 autocast needs --device cuda (use --precision bf16 on cpu)")
+        return 1
+    matrix = None
+    if args.matrix:
+        matrix = list(MATRIX) if args.matrix == "all" else [n.strip() for n in args.matrix.split(",")]
+        unknown = [n for n in matrix if n not in MATRIX]
+        if unknown:
+            print(f"ERROR: Unknown preset {', '.join(unknown)}; choose from {', '.join(MATRIX)}")
+            return 1
+
     # Check CUDA availability
-    if not torch.cuda.is_available():
-        print("ERROR: CUDA not available")
+    if cuda and not torch.cuda.is_available():
+        print("ERROR: CUDA not available (use --device cpu to test on CPU)")
         print(f"PyTorch version: {torch.__version__}")
         print(f"CUDA compiled: {torch.version.cuda}")
         return 1
+    if args.backend == "nccl" and not cuda:
+        print("ERROR: The nccl backend needs --device cuda")
+        return 1
+
+    available = torch.cuda.device_count() if cuda else args.cpu_threads
+    if args.world_sizes:
+        world_sizes = sorted({int(n) for n in args.world_sizes.split(",")})
+    else:
+        world_sizes = sorted({1, available if cuda else min(2, available)})
+    if world_sizes[0] != 1 and not matrix:
+        # Efficiency needs the single-rank baseline
+        world_sizes.insert(0, 1)
+    if cuda and world_sizes[-1] > available:
+        print(f"ERROR: World size {world_sizes[-1]} needs {world_sizes[-1]} GPUs, {available} detected")
+        return 1
+    # Sized for the largest world size so the CPU isn't oversubscribed there
+    args.threads_per_rank = max(1, args.cpu_threads // world_sizes[-1])
+    if args.data == "disk" and args.dataset_size // world_sizes[-1] < args.batch_size:
+        print(f"ERROR: --dataset-size {args.dataset_size} is too small for batch {args.batch_size} "
+              f"on {world_sizes[-1]} ranks")
+        return 1
+
+    print(f"\n=== PyTorch DDP Scaling Test ===")
+    print(f"PyTorch version: {torch.__version__}")
+    if cuda:
+        print(f"CUDA version: {torch.version.cuda}")
+        for i in range(available):
+            print(f"GPU {i}: {torch.cuda.get_device_name(i)}")
+    else:
+        print(f"CPU threads: {args.cpu_threads} ({args.threads_per_rank} per rank)")
+    print(f"Backend: {args.backend}")
+    print(f"Model: {args.model}, {args.image_size}x{args.image_size}, batch {args.batch_size} per rank, "
+          f"{args.optimizer}")
+    print(f"Iterations: {args.iterations} (+{args.warmup} warmup)")
+    if args.data == "disk":
+        if write_dataset(args.data_dir, args.dataset_size, args.image_size, args.shard_size):
+            print(f"Wrote {args.dataset_size} samples to {args.data_dir}")
+        print(f"Input pipeline: {args.data_dir}, {args.workers} workers, pin_memory={args.pin_memory}, "
+              f"prefetch_factor={args.prefetch_factor}, persistent_workers={args.persistent_workers}")
 
-    # Get GPU count
-    world_size = torch.cuda.device_count()
-
-    if world_size < 2:
-        print(f"WARNING: Only {world_size} GPU(s) detected")
-        print("Multi-GPU test requires at least 2 GPUs")
-        print("Running single-GPU test instead...")
-        world_size = 1
-
-    # Display GPU information
-    print(f"\n=== GPU Configuration ===")
-    for i in range(world_size):
-        print(f"GPU {i}: {torch.cuda.get_device_name(i)}")
-    print()
-
-    # Launch distributed training
-    if world_size > 1:
-        mp.spawn(
-            train_ddp,
-            args=(world_size,),
-            nprocs=world_size,
-            join=True
-        )
+    if matrix:
+        print(f"Matrix: {len(matrix)} configurations at world size {world_sizes[-1]}\n")
+        runs = run_matrix(matrix, world_sizes[-1], args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"device": args.device, "backend": args.backend, "model": args.model,
+                           "input_pipeline": input_pipeline(args),
+                           "optimizer": args.optimizer, "batch_size_per_rank": args.batch_size,
+                           "image_size": args.image_size, "world_size": world_sizes[-1], "matrix": runs}, f, indent=2)
+            print(f"\nResults written to {args.output}")
+        if not any("error" not in r for r in runs):
+            print("\nNo configuration completed")
+            return 1
+        return 0
+
+    training = {k: getattr(args, k) for k in TRAINING_DEFAULTS}
+    print(f"Training options: {describe(training)}")
+    print(f"World sizes: {', '.join(str(n) for n in world_sizes)}\n")
+
+    # Launch distributed training, one fresh process group per world size
+    runs = []
+    for world_size in world_sizes:
+        print(f"--- world_size={world_size} ---")
+        runs.append(run_world(world_size, args))
+
+    baseline = runs[0]["throughput"]
+    for run in runs:
+        run["speedup"] = run["throughput"] / baseline
+        run["scaling_efficiency"] = run["speedup"] / run["world_size"]
+
+    print(f"\n=== Training Complete ===")
+    print(f"{'ranks':>5} {'samples/s':>11} {'per rank':>10} {'iter ms':>9} {'speedup':>8} {'efficiency':>11} "
+          f"{'peak MB':>9}{pipeline_header(args)}")
+    for run in runs:
+        print(f"{run['world_size']:>5} {run['throughput']:>11.2f} {run['throughput'] / run['world_size']:>10.2f} "
+              f"{run['iteration_ms']:>9.2f} {run['speedup']:>7.2f}x {run['scaling_efficiency'] * 100:>10.1f}% "
+              f"{run['peak_memory_mb']:>9.0f}{pipeline_columns(run)}")
+
+    if args.output:
+        report = {
+            "device": args.device,
+            "backend": args.backend,
+            "model": args.model,
+            "optimizer": args.optimizer,
+            "training": training,
+            "input_pipeline": input_pipeline(args),
+            "batch_size_per_rank": args.batch_size,
+            "image_size": args.image_size,
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "runs": runs,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    # Success criteria
+    print(f"\n=== Validation ===")
+    success = True
+    largest = runs[-1]
+    if not cuda:
+        print("- Throughput test skipped on CPU")
+    elif largest["throughput"] > 50:  # Minimum expected throughput
+        print("✓ Throughput test PASSED")
+    else:
+        print("✗ Throughput test FAILED (too slow)")
+        success = False
+
+    if largest["world_size"] == 1:
+        print("- Scaling efficiency skipped (only one rank)")
+    elif largest["scaling_efficiency"] > args.min_efficiency:
+        print(f"✓ Scaling efficiency PASSED ({largest['scaling_efficiency'] * 100:.1f}% at "
+              f"{largest['world_size']} ranks)")
     else:
-        # Single GPU test
-        train_ddp(0, 1)
+        print(f"✗ Scaling efficiency FAILED ({largest['scaling_efficiency'] * 100:.1f}% at "
+              f"{largest['world_size']} ranks, need {args.min_efficiency * 100:.0f}%)")
+        success = False
 
-    return 0
+    if success:
+        print(f"\nTest completed successfully!")
+        return 0
+    print(f"\nSome checks failed")
+    return 1
 
 if __name__ == "__main__":
     exit(main())
@@ -3,15 +3,84 @@
 scripts/test-vllm-inference.py
 Test vLLM inference performance
 
+Every prompt is streamed through the async engine so each request's
+latency is measured the way a user sees it:
+  - TTFT: time to first token, from submission
+  - ITL:  inter-token latency, the gap between consecutive tokens
+  - TPOT: time per output token after the first, per request
+  - E2E:  end-to-end latency, from submission to the last token
+Percentiles (p50/p95/p99) are printed and written to a JSON report,
+overall and per prompt-length bucket.
+
+Prompts come from --dataset (see vllm_workloads.py): the builtin short
+prompts, synthetic prompts with length distributions and a shared-prefix
+ratio, or a JSONL file of prompts or conversations. Synthetic requests
+ignore EOS so they generate exactly their sampled output length.
+
 Usage:
     python3.12 test-vllm-inference.py                           # Default: facebook/opt-125m
     python3.12 test-vllm-inference.py --model /models/qwen2.5-32b-awq
     python3.12 test-vllm-inference.py --model /models/llama-3.3-8b-q4 --max-tokens 100
+    python3.12 test-vllm-inference.py --output /tmp/vllm-latency.json
+    python3.12 test-vllm-inference.py --dataset synthetic --input-len lognormal:3000,0.6 --prefix-ratio 0.4
+    python3.12 test-vllm-inference.py --dataset /data/prod-sample.jsonl --num-prompts 500
 """
 
 import argparse
+import asyncio
+import json
+import statistics
 import time
-from vllm import LLM, SamplingParams
+import uuid
+from vllm import AsyncEngineArgs, SamplingParams
+from vllm.engine.async_llm_engine import AsyncLLMEngine
+
+import vllm_workloads
+from vllm_client import summarize
+
+
+async def stream_request(engine, request, sampling_params):
+    """Run one request, timestamping every step that produced new tokens"""
+    prompt = request["prompt"]
+    submitted = time.perf_counter()
+    token_times = []
+    final = None
+    async for output in engine.generate(prompt, sampling_params, request_id=str(uuid.uuid4())):
+        now = time.perf_counter()
+        # Outputs are cumulative; a step may emit several tokens at once
+        new_tokens = len(output.outputs[0].token_ids) - len(token_times)
+        if new_tokens > 0:
+            previous = token_times[-1] if token_times else submitted
+            # Spread a multi-token step evenly so ITL stays per token
+            token_times.extend(previous + (now - previous) * (i + 1) / new_tokens for i in range(new_tokens))
+        final = output
+
+    ttft = token_times[0] - submitted if token_times else None
+    e2e = (token_times[-1] if token_times else time.perf_counter()) - submitted
+    return {
+        "prompt": prompt,
+        "prompt_tokens": len(final.prompt_token_ids) if final and final.prompt_token_ids else request["prompt_tokens"],
+        "text": final.outputs[0].text if final else "",
+        "output_tokens": len(token_times),
+        "ttft": ttft,
+        "e2e": e2e,
+        "itl": [b - a for a, b in zip(token_times, token_times[1:])],
+        "tpot": (e2e - ttft) / (len(token_times) - 1) if len(token_times) > 1 else None,
+    }
+
+
+async def run_prompts(engine, requests, sampling_params):
+    """Submit all requests at once, as LLM.generate would, and stream them"""
+    return await asyncio.gather(*(stream_request(engine, r, p) for r, p in zip(requests, sampling_params)))
+
+
+def latency_summary(results):
+    return {
+        "ttft_ms": summarize([r["ttft"] for r in results if r["ttft"] is not None]),
+        "itl_ms": summarize([gap for r in results for gap in r["itl"]]),
+        "tpot_ms": summarize([r["tpot"] for r in results if r["tpot"] is not None]),
+        "e2e_ms": summarize([r["e2e"] for r in results]),
+    }
 
 
 def main():
@@ -35,6 +104,16 @@ def main():
         default=30,
         help="Number of prompts to run (default: 30)"
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for synthetic prompts (default: 0)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="Run only slice I/N of the --num-prompts workload, e.g. 0/2 (for replicas)"
+    )
     parser.add_argument(
         "--gpu-memory",
         type=float,
@@ -47,8 +126,35 @@ def main():
         default=1,
         help="Tensor parallel size (default: 1)"
     )
+    parser.add_argument(
+        "--max-num-seqs",
+        type=int,
+        help="Max sequences per scheduler step (default: vLLM's)"
+    )
+    parser.add_argument(
+        "--max-model-len",
+        type=int,
+        help="Max context length (default: the model's)"
+    )
+    parser.add_argument(
+        "--output", "-o",
+        default="vllm-inference-results.json",
+        help="JSON report path (default: vllm-inference-results.json)"
+    )
+    vllm_workloads.add_arguments(parser)
     args = parser.parse_args()
 
+    try:
+        requests = vllm_workloads.build(args, args.num_prompts, args.max_tokens, seed=args.seed)
+        if args.shard:
+            requests = vllm_workloads.shard(requests, args.shard)
+            if not requests:
+                raise ValueError(f"Shard {args.shard} of {args.num_prompts} prompts is empty")
+        buckets = vllm_workloads.parse_buckets(args.buckets)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        return 1
+
     print(f"\n=== vLLM Inference Test ===\n")
 
     # Initialize vLLM
@@ -57,60 +163,77 @@ def main():
         print("Note: First run will download the model (~250MB)")
 
     try:
-        llm = LLM(
+        engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(
             model=args.model,
             tensor_parallel_size=args.tensor_parallel,
             gpu_memory_utilization=args.gpu_memory,
+            **({"max_num_seqs": args.max_num_seqs} if args.max_num_seqs else {}),
+            **({"max_model_len": args.max_model_len} if args.max_model_len else {}),
             download_dir="/tmp/vllm_cache",
             trust_remote_code=True,
-        )
+        ))
         print("Model loaded successfully\n")
     except Exception as e:
         print(f"ERROR: Failed to load model: {e}")
         return 1
 
-    # Test prompts
-    base_prompts = [
-        "Once upon a time",
-        "The meaning of life is",
-        "Artificial intelligence will",
-        "In the future, technology",
-        "Machine learning is",
+    # Sampling parameters, one per request for its output length
+    sampling_params = [
+        SamplingParams(
+            temperature=0.8,
+            top_p=0.95,
+            max_tokens=r["max_tokens"],
+            ignore_eos=args.dataset == "synthetic",
+        )
+        for r in requests
     ]
-    # Repeat to reach desired count
-    repeats = max(1, args.num_prompts // len(base_prompts))
-    prompts = (base_prompts * repeats)[:args.num_prompts]
-
-    # Sampling parameters
-    sampling_params = SamplingParams(
-        temperature=0.8,
-        top_p=0.95,
-        max_tokens=args.max_tokens,
-    )
+    prompts = [r["prompt"] for r in requests]
 
     print(f"=== Inference Configuration ===")
     print(f"Model: {args.model}")
+    print(f"Dataset: {args.dataset}")
     print(f"Prompts: {len(prompts)}")
-    print(f"Max tokens per prompt: {args.max_tokens}")
+    if args.dataset == "synthetic":
+        print(f"Input length: {args.input_len}")
+        print(f"Output length: {args.output_len or f'fixed:{args.max_tokens}'}")
+        print(f"Shared prefix: {args.prefix_ratio:.0%} of each prompt, {args.prefix_groups} group(s)")
+    else:
+        print(f"Max tokens per prompt: {max(r['max_tokens'] for r in requests)}")
     print(f"Temperature: 0.8")
     print(f"Top-p: 0.95")
-    print(f"Tensor parallel: {args.tensor_parallel}\n")
+    print(f"Tensor parallel: {args.tensor_parallel}")
+    print(f"GPU memory utilization: {args.gpu_memory}")
+    print(f"Max num seqs: {args.max_num_seqs or 'default'}")
+    print(f"Max model len: {args.max_model_len or 'default'}\n")
 
     # Run inference
     print("Running inference...")
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     try:
-        outputs = llm.generate(prompts, sampling_params)
+        results = asyncio.run(run_prompts(engine, requests, sampling_params))
     except Exception as e:
         print(f"ERROR: Inference failed: {e}")
         return 1
+    finally:
+        if hasattr(engine, "shutdown"):
+            engine.shutdown()
 
-    elapsed = time.time() - start_time
+    elapsed = time.perf_counter() - start_time
 
     # Calculate metrics
-    total_tokens = sum(len(output.outputs[0].token_ids) for output in outputs)
+    total_tokens = sum(r["output_tokens"] for r in results)
     throughput = total_tokens / elapsed
+    latency = latency_summary(results)
+    by_bucket = {
+        label: {
+            "requests": len(rs),
+            "prompt_tokens_mean": round(statistics.fmean(r["prompt_tokens"] for r in rs), 1),
+            "output_tokens": sum(r["output_tokens"] for r in rs),
+            **latency_summary(rs),
+        }
+        for label, rs in vllm_workloads.by_bucket(results, buckets).items()
+    }
 
     print(f"\n=== Results ===")
     print(f"Prompts processed: {len(prompts)}")
@@ -118,14 +241,65 @@ def main():
     print(f"Time: {elapsed:.2f}s")
     print(f"Throughput: {throughput:.2f} tokens/sec")
     print(f"Average tokens per prompt: {total_tokens / len(prompts):.1f}")
-    print(f"Average time per prompt: {(elapsed / len(prompts)) * 1000:.1f}ms")
+
+    print(f"\n=== Latency (ms) ===")
+    print(f"{'Metric':<6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name, key in (("TTFT", "ttft_ms"), ("ITL", "itl_ms"), ("TPOT", "tpot_ms"), ("E2E", "e2e_ms")):
+        s = latency[key]
+        if s is None:
+            print(f"{name:<6} {'n/a':>9}")
+            continue
+        print(f"{name:<6} {s['mean']:>9.1f} {s['p50']:>9.1f} {s['p95']:>9.1f} {s['p99']:>9.1f} {s['max']:>9.1f}")
+
+    print(f"\n=== By Prompt Length (tokens) ===")
+    print(f"{'Bucket':<12} {'reqs':>5} {'prompt':>7} {'TTFT p50':>9} {'TTFT p99':>9} {'TPOT p50':>9} {'E2E p99':>9}")
+    for label, b in by_bucket.items():
+        stat = lambda key, field: f"{b[key][field]:.1f}" if b[key] else "n/a"
+        print(f"{label:<12} {b['requests']:>5} {b['prompt_tokens_mean']:>7.0f} {stat('ttft_ms', 'p50'):>9} "
+              f"{stat('ttft_ms', 'p99'):>9} {stat('tpot_ms', 'p50'):>9} {stat('e2e_ms', 'p99'):>9}")
 
     # Show sample outputs
     print(f"\n=== Sample Outputs ===")
-    for i, output in enumerate(outputs[:3]):  # Show first 3
-        generated_text = output.outputs[0].text
-        print(f"\n{i+1}. Prompt: \"{output.prompt}\"")
-        print(f"   Output: \"{generated_text.strip()}\"")
+    for i, result in enumerate(results[:3]):  # Show first 3
+        prompt = result["prompt"] if len(result["prompt"]) <= 80 else result["prompt"][:77] + "..."
+        print(f"\n{i+1}. Prompt: \"{prompt}\"")
+        print(f"   Output: \"{result['text'].strip()}\"")
+
+    report = {
+        "model": args.model,
+        "tensor_parallel": args.tensor_parallel,
+        "gpu_memory_utilization": args.gpu_memory,
+        "max_num_seqs": args.max_num_seqs,
+        "max_model_len": args.max_model_len,
+        "dataset": args.dataset,
+        "workload": {
+            "input_len": args.input_len,
+            "output_len": args.output_len or f"fixed:{args.max_tokens}",
+            "prefix_ratio": args.prefix_ratio,
+            "prefix_groups": args.prefix_groups,
+        } if args.dataset == "synthetic" else None,
+        "prompts": len(prompts),
+        "max_tokens": args.max_tokens,
+        "elapsed_s": round(elapsed, 3),
+        "total_tokens": total_tokens,
+        "throughput_tokens_per_s": round(throughput, 2),
+        "latency": latency,
+        "by_prompt_length": by_bucket,
+        "requests": [
+            {
+                "prompt": r["prompt"][:200],
+                "prompt_tokens": r["prompt_tokens"],
+                "output_tokens": r["output_tokens"],
+                "ttft_ms": round(r["ttft"] * 1000, 2) if r["ttft"] is not None else None,
+                "tpot_ms": round(r["tpot"] * 1000, 2) if r["tpot"] is not None else None,
+                "e2e_ms": round(r["e2e"] * 1000, 2),
+            }
+            for r in results
+        ],
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.output}")
 
     # Validation
     print(f"\n=== Validation ===")
@@ -150,7 +324,7 @@ def main():
         success = False
 
     # Check output quality (basic check)
-    sample_output = outputs[0].outputs[0].text
+    sample_output = results[0]["text"]
     if len(sample_output.strip()) > 0:
         print(f"  Generated text is non-empty")
     else:
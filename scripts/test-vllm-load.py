@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+scripts/test-vllm-load.py
+Online-serving load test for the vLLM OpenAI-compatible endpoint
+
+Sends requests to /v1/completions (or /v1/chat/completions) over a pool
+of keep-alive HTTP connections. Arrivals can be a Poisson process or a
+constant rate, capped at a maximum number of requests in flight. For each
+request, TTFT, inter-token latency (ITL), time per output token (TPOT)
+and end-to-end latency are measured from the streamed response. Goodput
+counts completed requests per second that met every latency SLO given.
+
+--concurrency and --rate take comma-separated lists to sweep; every
+combination is run in turn and summarized in one table.
+
+Requests come from --dataset (see vllm_workloads.py): --prompt repeated,
+synthetic prompts with length distributions and a shared-prefix ratio, or
+a JSONL file. Each run is also broken down by prompt-length bucket.
+
+Standard library only. Runs without a GPU against the stub server:
+    python3 vllm-stub-server.py --port 9001 &
+    python3 test-vllm-load.py --port 9001 --num-requests 200 --rate 50
+
+Usage:
+    python3 test-vllm-load.py                                  # localhost:8001, 100 requests
+    python3 test-vllm-load.py --rate 4 --arrival poisson --num-requests 200
+    python3 test-vllm-load.py --concurrency 1,4,16,64 --rate inf
+    python3 test-vllm-load.py --slo-ttft-ms 500 --slo-tpot-ms 50 --output load.json
+    python3 test-vllm-load.py --dataset synthetic --input-len lognormal:3000,0.6 --prefix-ratio 0.4
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import time
+
+import vllm_workloads
+from vllm_client import ConnectionPool, arrival_gaps, get_json, send_completion, summarize
+
+
+# === Load ===
+
+async def run_load(pool, args, workload, rate, concurrency):
+    """Issue the workload at the given arrival rate with at most `concurrency` in flight"""
+    rng = random.Random(args.seed)
+    gaps = arrival_gaps(rate, args.arrival, rng)
+    in_flight = asyncio.Semaphore(concurrency)
+    tasks = []
+
+    async def one(item):
+        async with in_flight:
+            return await send_completion(pool, args, item)
+
+    start = time.perf_counter()
+    next_at = start
+    for item in workload:
+        # Schedule against absolute times so sleep overhead doesn't accumulate
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(item)))
+        next_at += next(gaps)
+    results = await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def meets_slo(result, args):
+    checks = (("ttft", args.slo_ttft_ms), ("tpot", args.slo_tpot_ms), ("e2e", args.slo_e2e_ms))
+    for key, limit in checks:
+        if limit is None:
+            continue
+        value = result.get(key)
+        if value is None or value * 1000 > limit:
+            return False
+    return True
+
+
+def latency_summary(ok):
+    return {
+        "ttft_ms": summarize([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "itl_ms": summarize([gap for r in ok for gap in r["itl"]]),
+        "tpot_ms": summarize([r["tpot"] for r in ok if r.get("tpot") is not None]),
+        "e2e_ms": summarize([r["e2e"] for r in ok]),
+    }
+
+
+def summarize_run(results, elapsed, args, rate, concurrency):
+    ok = [r for r in results if r["ok"]]
+    good = [r for r in ok if meets_slo(r, args)]
+    output_tokens = sum(r["output_tokens"] for r in ok)
+    by_bucket = {}
+    for label, rs in vllm_workloads.by_bucket(results, args.bucket_edges).items():
+        bucket_ok = [r for r in rs if r["ok"]]
+        by_bucket[label] = {
+            "requests": len(rs),
+            "completed": len(bucket_ok),
+            "prompt_tokens_mean": round(statistics.fmean(r["prompt_tokens"] for r in rs), 1),
+            "slo_attainment": round(sum(1 for r in bucket_ok if meets_slo(r, args)) / len(rs), 4),
+            **latency_summary(bucket_ok),
+        }
+    return {
+        "rate": "inf" if math.isinf(rate) else rate,
+        "arrival": args.arrival,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "completed": len(ok),
+        "failed": len(results) - len(ok),
+        "errors": sorted({r["error"] for r in results if r.get("error")})[:5],
+        "duration_s": round(elapsed, 3),
+        "request_throughput": round(len(ok) / elapsed, 3),
+        "output_token_throughput": round(output_tokens / elapsed, 2),
+        "goodput": round(len(good) / elapsed, 3),
+        "slo_attainment": round(len(good) / len(results), 4) if results else None,
+        **latency_summary(ok),
+        "by_prompt_length": by_bucket,
+    }
+
+
+def print_run(summary):
+    def pct(key, field):
+        s = summary[key]
+        return f"{s[field]:.1f}" if s else "n/a"
+
+    print(f"  completed {summary['completed']}/{summary['requests']} in {summary['duration_s']:.2f}s"
+          f"  ({summary['request_throughput']:.2f} req/s, {summary['output_token_throughput']:.1f} tok/s)")
+    print(f"  TTFT p50/p99: {pct('ttft_ms', 'p50')}/{pct('ttft_ms', 'p99')} ms"
+          f"  ITL p50/p99: {pct('itl_ms', 'p50')}/{pct('itl_ms', 'p99')} ms"
+          f"  E2E p50/p99: {pct('e2e_ms', 'p50')}/{pct('e2e_ms', 'p99')} ms")
+    print(f"  goodput: {summary['goodput']:.2f} req/s ({summary['slo_attainment'] * 100:.1f}% within SLO)")
+    if len(summary["by_prompt_length"]) > 1:
+        print(f"  {'prompt tokens':<14} {'reqs':>5} {'TTFT p50':>9} {'TTFT p99':>9} {'TPOT p50':>9} "
+              f"{'E2E p99':>9} {'in SLO':>7}")
+        for label, b in summary["by_prompt_length"].items():
+            stat = lambda key, field: f"{b[key][field]:.1f}" if b[key] else "n/a"
+            print(f"  {label:<14} {b['requests']:>5} {stat('ttft_ms', 'p50'):>9} {stat('ttft_ms', 'p99'):>9} "
+                  f"{stat('tpot_ms', 'p50'):>9} {stat('e2e_ms', 'p99'):>9} {b['slo_attainment'] * 100:>6.1f}%")
+    for error in summary["errors"]:
+        print(f"  error: {error}")
+
+
+def print_table(runs):
+    print(f"\n=== Sweep Summary ===")
+    print(f"{'rate':>6} {'conc':>5} {'req/s':>8} {'tok/s':>9} {'goodput':>8} {'TTFT p99':>9} "
+          f"{'ITL p99':>8} {'E2E p99':>9} {'fail':>5}")
+    for s in runs:
+        p99 = lambda key: f"{s[key]['p99']:.1f}" if s[key] else "n/a"
+        rate = s["rate"] if s["rate"] == "inf" else f"{s['rate']:g}"
+        print(f"{rate:>6} {s['concurrency']:>5} {s['request_throughput']:>8.2f} "
+              f"{s['output_token_throughput']:>9.1f} {s['goodput']:>8.2f} {p99('ttft_ms'):>9} "
+              f"{p99('itl_ms'):>8} {p99('e2e_ms'):>9} {s['failed']:>5}")
+
+
+def parse_list(value, cast):
+    return [cast(v) for v in str(value).split(",") if v.strip()]
+
+
+async def run(args):
+    rates = parse_list(args.rate, float)
+    concurrencies = parse_list(args.concurrency, int)
+    pool = ConnectionPool(args.host, args.port, max(concurrencies))
+
+    try:
+        if not args.model:
+            models = await get_json(pool, "/v1/models", args.headers)
+            args.model = models["data"][0]["id"]
+        print(f"Model: {args.model}")
+
+        workload = vllm_workloads.build(args, args.num_requests, args.max_tokens, [args.prompt], args.seed)
+        if args.warmup:
+            print(f"Warming up with {args.warmup} requests...")
+            await run_load(pool, args, workload[:args.warmup], math.inf, max(concurrencies))
+
+        runs = []
+        for rate in rates:
+            for concurrency in concurrencies:
+                label = "inf" if math.isinf(rate) else f"{rate:g}"
+                print(f"\n--- rate={label} req/s ({args.arrival}), concurrency={concurrency} ---")
+                results, elapsed = await run_load(pool, args, workload, rate, concurrency)
+                summary = summarize_run(results, elapsed, args, rate, concurrency)
+                print_run(summary)
+                runs.append(summary)
+    finally:
+        pool.close()
+
+    if len(runs) > 1:
+        print_table(runs)
+    return runs, pool.connects
+
+
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(description="Load test a vLLM OpenAI-compatible endpoint")
+    parser.add_argument("--host", default="localhost", help="Server host (default: localhost)")
+    parser.add_argument("--port", type=int, default=8001, help="Server port (default: 8001, vLLM direct)")
+    parser.add_argument("--model", "-m", help="Model id (default: first from /v1/models)")
+    parser.add_argument("--api-key", help="Bearer token for the API gateway")
+    parser.add_argument("--endpoint", choices=["completions", "chat"], default="completions",
+                        help="API to call (default: completions)")
+    parser.add_argument("--num-requests", "-n", type=int, default=100, help="Requests per run (default: 100)")
+    parser.add_argument("--rate", default="inf",
+                        help="Arrival rate in req/s, comma-separated to sweep; inf sends all at once (default: inf)")
+    parser.add_argument("--arrival", choices=["poisson", "constant"], default="poisson",
+                        help="Inter-arrival distribution (default: poisson)")
+    parser.add_argument("--concurrency", default="64",
+                        help="Max requests in flight, comma-separated to sweep (default: 64)")
+    parser.add_argument("--prompt", default="Explain how a GPU schedules warps in one paragraph.",
+                        help="Prompt text for --dataset builtin")
+    parser.add_argument("--max-tokens", type=int, default=128, help="Max tokens per request (default: 128)")
+    parser.add_argument("--ignore-eos", action="store_true",
+                        help="Ask vLLM to always generate max-tokens (always on for --dataset synthetic)")
+    parser.add_argument("--no-stream", dest="stream", action="store_false",
+                        help="Disable streaming (only E2E latency is measured)")
+    parser.add_argument("--slo-ttft-ms", type=float, help="Goodput SLO: max TTFT")
+    parser.add_argument("--slo-tpot-ms", type=float, help="Goodput SLO: max time per output token")
+    parser.add_argument("--slo-e2e-ms", type=float, help="Goodput SLO: max end-to-end latency")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for response headers")
+    parser.add_argument("--read-timeout", type=float, default=60,
+                        help="Seconds without response data before a request fails (default: 60)")
+    parser.add_argument("--warmup", type=int, default=0, help="Unmeasured requests before the first run")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for arrivals and synthetic prompts (default: 0)")
+    parser.add_argument("--output", "-o", help="Write the results JSON here")
+    vllm_workloads.add_arguments(parser)
+    args = parser.parse_args()
+    args.headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+    args.ignore_eos = args.ignore_eos or args.dataset == "synthetic"
+    try:
+        args.bucket_edges = vllm_workloads.parse_buckets(args.buckets)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+
+    print(f"\n=== vLLM Load Test ===\n")
+    print(f"Target: http://{args.host}:{args.port} ({args.endpoint}, {'streaming' if args.stream else 'non-streaming'})")
+
+    try:
+        runs, connects = asyncio.run(run(args))
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"ERROR: {e}")
+        return 1
+
+    total = sum(r["requests"] for r in runs) + args.warmup
+    print(f"\nConnections opened: {connects} for {total} requests")
+
+    if args.output:
+        report = {
+            "target": f"http://{args.host}:{args.port}",
+            "model": args.model,
+            "endpoint": args.endpoint,
+            "stream": args.stream,
+            "dataset": args.dataset,
+            "workload": {
+                "input_len": args.input_len,
+                "output_len": args.output_len or f"fixed:{args.max_tokens}",
+                "prefix_ratio": args.prefix_ratio,
+                "prefix_groups": args.prefix_groups,
+            } if args.dataset == "synthetic" else None,
+            "max_tokens": args.max_tokens,
+            "slo_ms": {"ttft": args.slo_ttft_ms, "tpot": args.slo_tpot_ms, "e2e": args.slo_e2e_ms},
+            "runs": runs,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if any(r["completed"] == 0 for r in runs):
+        print("\nSome runs completed no requests")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        exit(main())
+    except KeyboardInterrupt:
+        print("\n\nTest interrupted by user")
+        exit(1)
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+scripts/test-vllm-router.py
+Benchmark client-side routing across vLLM replicas
+
+In replica mode each GPU serves its own copy of the model on its own
+port. This sends one workload across N OpenAI-compatible endpoints with
+each routing policy in turn:
+  - round-robin:        endpoints in rotation
+  - least-outstanding:  the endpoint with the fewest requests in flight
+  - prefix-affinity:    requests whose prompts start with the same
+                        --affinity-words go to the same endpoint (rendezvous
+                        hashing), so its prefix cache is reused; falls back
+                        to least-outstanding when that endpoint has
+                        --affinity-slack more requests in flight than the
+                        least loaded one
+
+For each policy it reports per-replica share of requests, utilization
+(fraction of the run with at least one request in flight), mean and peak
+requests in flight, TTFT/E2E tail latency and prefix-cache hits (when the
+server reports cached tokens), then compares the policies.
+
+Prefix caches are reset between policies with POST /reset_prefix_cache
+(vLLM needs VLLM_SERVER_DEV_MODE=1); where that fails, each policy gets a
+workload with a different seed so it starts from a cold cache.
+
+Standard library only. --stubs N starts N local stub servers, so the
+benchmark runs without a GPU:
+    python3 test-vllm-router.py --stubs 2 --dataset synthetic --prefix-ratio 0.5 --prefix-groups 8 \\
+        --stub-args "--prefill-ms-per-1k 40 --prefix-cache-tokens 20000"
+
+Usage:
+    python3 test-vllm-router.py --endpoints localhost:8001,localhost:8002
+    python3 test-vllm-router.py --endpoints localhost:8001,localhost:8002 --policy prefix-affinity --rate 8
+    python3 test-vllm-router.py --stubs 4 --num-requests 400 --output router.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import random
+import shlex
+import subprocess
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import vllm_workloads
+from vllm_client import ConnectionPool, arrival_gaps, get_json, request, send_completion, summarize
+
+
+POLICIES = ["round-robin", "least-outstanding", "prefix-affinity"]
+STUB_SERVER = Path(__file__).resolve().parent / "vllm-stub-server.py"
+
+
+class Replica:
+    """One endpoint and its load accounting"""
+
+    def __init__(self, url, pool_size):
+        parts = urlsplit(url if "://" in url else f"http://{url}")
+        self.name = f"{parts.hostname}:{parts.port or 80}"
+        self.pool = ConnectionPool(parts.hostname, parts.port or 80, pool_size)
+        self.reset()
+
+    def reset(self):
+        self.outstanding = 0
+        self.peak = 0
+        self.results = []
+        self.busy = 0.0  # seconds with at least one request in flight
+        self.area = 0.0  # integral of requests in flight over time
+        self.changed = time.perf_counter()
+
+    def _account(self):
+        now = time.perf_counter()
+        if self.outstanding:
+            self.busy += now - self.changed
+            self.area += self.outstanding * (now - self.changed)
+        self.changed = now
+
+    def start(self):
+        self._account()
+        self.outstanding += 1
+        self.peak = max(self.peak, self.outstanding)
+
+    def finish(self, result):
+        self._account()
+        self.outstanding -= 1
+        self.results.append(result)
+
+
+class Router:
+    """Picks a replica for each request according to a policy"""
+
+    def __init__(self, replicas, policy, affinity_words, affinity_slack):
+        self.replicas = replicas
+        self.policy = policy
+        self.affinity_words = affinity_words
+        self.affinity_slack = affinity_slack
+        self.rotation = itertools.cycle(range(len(replicas)))
+        self.affinity_hits = 0
+        self.affinity_fallbacks = 0
+
+    def least_outstanding(self):
+        # Start from the next in rotation so ties spread evenly
+        offset = next(self.rotation)
+        order = self.replicas[offset:] + self.replicas[:offset]
+        return min(order, key=lambda r: r.outstanding)
+
+    def pick(self, item):
+        if self.policy == "round-robin":
+            return self.replicas[next(self.rotation)]
+        if self.policy == "least-outstanding":
+            return self.least_outstanding()
+
+        key = " ".join(item["prompt"].split()[:self.affinity_words])
+        # Rendezvous hashing: adding or removing a replica only moves its own keys
+        preferred = max(self.replicas, key=lambda r: hashlib.blake2b(f"{r.name}|{key}".encode()).digest())
+        least = self.least_outstanding()
+        if preferred.outstanding - least.outstanding >= self.affinity_slack:
+            self.affinity_fallbacks += 1
+            return least
+        self.affinity_hits += 1
+        return preferred
+
+
+async def reset_prefix_caches(replicas, headers, timeout):
+    """POST /reset_prefix_cache to every replica; True if all accepted it"""
+
+    async def drain(body):
+        async for _ in body:
+            pass
+
+    ok = True
+    for replica in replicas:
+        try:
+            status, _, body, done = await asyncio.wait_for(
+                request(replica.pool, "POST", "/reset_prefix_cache", headers=headers), timeout
+            )
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, TimeoutError):
+            ok = False
+            continue
+        drained = False
+        try:
+            await asyncio.wait_for(drain(body), timeout)
+            drained = True
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, TimeoutError):
+            pass
+        finally:
+            # Always hand the connection back so the pool doesn't leak it
+            await done(drained)
+        ok = ok and drained and status == 200
+    return ok
+
+
+async def run_policy(replicas, router, args, workload):
+    """Send the workload through the router; return wall-clock seconds"""
+    for replica in replicas:
+        replica.reset()
+    gaps = arrival_gaps(args.rate, args.arrival, random.Random(args.seed))
+    in_flight = asyncio.Semaphore(args.concurrency)
+
+    async def one(item):
+        async with in_flight:
+            # Route at dispatch time so load-aware policies see current load
+            replica = router.pick(item)
+            replica.start()
+            result = await send_completion(replica.pool, args, item)
+            replica.finish(result)
+
+    tasks = []
+    start = time.perf_counter()
+    next_at = start
+    for item in workload:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(item)))
+        next_at += next(gaps)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    for replica in replicas:
+        replica._account()
+    return elapsed
+
+
+def cache_hit_rate(results):
+    reported = [r for r in results if r.get("cached_tokens") is not None and r.get("prompt_tokens")]
+    if not reported:
+        return None
+    return round(sum(r["cached_tokens"] for r in reported) / sum(r["prompt_tokens"] for r in reported), 4)
+
+
+def summarize_policy(policy, replicas, router, elapsed):
+    everything = [r for replica in replicas for r in replica.results]
+    ok = [r for r in everything if r["ok"]]
+    per_replica = []
+    for replica in replicas:
+        done = [r for r in replica.results if r["ok"]]
+        per_replica.append({
+            "replica": replica.name,
+            "requests": len(replica.results),
+            "share": round(len(replica.results) / len(everything), 4) if everything else 0.0,
+            "failed": len(replica.results) - len(done),
+            "utilization": round(replica.busy / elapsed, 4),
+            "mean_outstanding": round(replica.area / elapsed, 2),
+            "peak_outstanding": replica.peak,
+            "cache_hit_rate": cache_hit_rate(done),
+            "ttft_ms": summarize([r["ttft"] for r in done if r["ttft"] is not None]),
+            "e2e_ms": summarize([r["e2e"] for r in done]),
+        })
+    shares = [r["share"] for r in per_replica]
+    return {
+        "policy": policy,
+        "requests": len(everything),
+        "completed": len(ok),
+        "failed": len(everything) - len(ok),
+        "errors": sorted({r["error"] for r in everything if r.get("error")})[:5],
+        "duration_s": round(elapsed, 3),
+        "request_throughput": round(len(ok) / elapsed, 3),
+        "output_token_throughput": round(sum(r["output_tokens"] for r in ok) / elapsed, 2),
+        # 1.0 is a perfectly even spread; 2.0 means one replica got twice its share
+        "imbalance": round(max(shares) * len(shares), 3) if everything else None,
+        "cache_hit_rate": cache_hit_rate(ok),
+        "affinity_fallbacks": router.affinity_fallbacks if policy == "prefix-affinity" else None,
+        "ttft_ms": summarize([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "e2e_ms": summarize([r["e2e"] for r in ok]),
+        "replicas": per_replica,
+    }
+
+
+def fmt(stat, field):
+    return f"{stat[field]:.1f}" if stat else "n/a"
+
+
+def pct(value):
+    return f"{value * 100:.1f}%" if value is not None else "n/a"
+
+
+def print_policy(summary):
+    print(f"  completed {summary['completed']}/{summary['requests']} in {summary['duration_s']:.2f}s"
+          f"  ({summary['request_throughput']:.2f} req/s, {summary['output_token_throughput']:.1f} tok/s)")
+    print(f"  {'replica':<22} {'reqs':>5} {'share':>7} {'util':>7} {'avg q':>6} {'peak':>5} "
+          f"{'TTFT p50':>9} {'TTFT p99':>9} {'E2E p99':>9} {'cache':>7}")
+    for r in summary["replicas"]:
+        print(f"  {r['replica']:<22} {r['requests']:>5} {pct(r['share']):>7} {pct(r['utilization']):>7} "
+              f"{r['mean_outstanding']:>6.1f} {r['peak_outstanding']:>5} {fmt(r['ttft_ms'], 'p50'):>9} "
+              f"{fmt(r['ttft_ms'], 'p99'):>9} {fmt(r['e2e_ms'], 'p99'):>9} {pct(r['cache_hit_rate']):>7}")
+    if summary["affinity_fallbacks"] is not None:
+        print(f"  affinity fallbacks to least-outstanding: {summary['affinity_fallbacks']}")
+    for error in summary["errors"]:
+        print(f"  error: {error}")
+
+
+def print_comparison(summaries):
+    print(f"\n=== Policy Comparison ===")
+    print(f"{'policy':<19} {'req/s':>7} {'tok/s':>9} {'imbal':>6} {'TTFT p50':>9} {'TTFT p99':>9} "
+          f"{'E2E p50':>9} {'E2E p99':>9} {'cache':>7} {'fail':>5}")
+    for s in summaries:
+        print(f"{s['policy']:<19} {s['request_throughput']:>7.2f} {s['output_token_throughput']:>9.1f} "
+              f"{s['imbalance'] or 0:>6.2f} {fmt(s['ttft_ms'], 'p50'):>9} {fmt(s['ttft_ms'], 'p99'):>9} "
+              f"{fmt(s['e2e_ms'], 'p50'):>9} {fmt(s['e2e_ms'], 'p99'):>9} {pct(s['cache_hit_rate']):>7} "
+              f"{s['failed']:>5}")
+
+
+def start_stubs(count, stub_args):
+    """Start local stub servers on free ports; return (processes, endpoints)"""
+    procs, endpoints = [], []
+    try:
+        for _ in range(count):
+            proc = subprocess.Popen(
+                [sys.executable, str(STUB_SERVER), "--port", "0", *shlex.split(stub_args)],
+                stdout=subprocess.PIPE, text=True,
+            )
+            procs.append(proc)
+            line = proc.stdout.readline()
+            if "http://" not in line:
+                raise RuntimeError(f"Stub server failed to start: {line.strip() or 'no output'}")
+            endpoints.append(line.strip().rsplit("http://", 1)[1])
+    except BaseException:
+        # main() never sees these processes, so stop them here
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+        raise
+    return procs, endpoints
+
+
+async def run(args, endpoints):
+    replicas = [Replica(e, args.concurrency) for e in endpoints]
+    try:
+        if not args.model:
+            models = await get_json(replicas[0].pool, "/v1/models", args.headers)
+            args.model = models["data"][0]["id"]
+        print(f"Model: {args.model}")
+
+        summaries = []
+        for i, policy in enumerate(args.policies):
+            print(f"\n--- {policy} ---")
+            seed = args.seed
+            if i and not await reset_prefix_caches(replicas, args.headers, args.timeout):
+                # A fresh set of prompts so this policy doesn't inherit warm caches
+                seed += i
+                print(f"  (prefix caches not reset; using workload seed {seed})")
+            workload = vllm_workloads.build(args, args.num_requests, args.max_tokens, [args.prompt], seed)
+            router = Router(replicas, policy, args.affinity_words, args.affinity_slack)
+            elapsed = await run_policy(replicas, router, args, workload)
+            summary = summarize_policy(policy, replicas, router, elapsed)
+            print_policy(summary)
+            summaries.append(summary)
+    finally:
+        for replica in replicas:
+            replica.pool.close()
+
+    if len(summaries) > 1:
+        print_comparison(summaries)
+    return summaries
+
+
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(description="Benchmark routing policies across vLLM replicas")
+    parser.add_argument("--endpoints", default="localhost:8001,localhost:8002",
+                        help="Comma-separated replica HOST:PORT or URLs (default: localhost:8001,localhost:8002)")
+    parser.add_argument("--stubs", type=int, help="Start this many local stub servers instead of --endpoints")
+    parser.add_argument("--stub-args", default="", help="Extra vllm-stub-server.py arguments for --stubs")
+    parser.add_argument("--policy", default=",".join(POLICIES),
+                        help=f"Comma-separated policies to compare (default: {','.join(POLICIES)})")
+    parser.add_argument("--affinity-words", type=int, default=64,
+                        help="Leading prompt words hashed for prefix-affinity (default: 64)")
+    parser.add_argument("--affinity-slack", type=int, default=8,
+                        help="In-flight excess over the least loaded replica before prefix-affinity "
+                             "falls back (default: 8)")
+    parser.add_argument("--model", "-m", help="Model id (default: first from /v1/models)")
+    parser.add_argument("--api-key", help="Bearer token for the API gateway")
+    parser.add_argument("--endpoint", choices=["completions", "chat"], default="completions",
+                        help="API to call (default: completions)")
+    parser.add_argument("--num-requests", "-n", type=int, default=200, help="Requests per policy (default: 200)")
+    parser.add_argument("--rate", type=float, default=math.inf,
+                        help="Arrival rate in req/s; inf sends all at once (default: inf)")
+    parser.add_argument("--arrival", choices=["poisson", "constant"], default="poisson",
+                        help="Inter-arrival distribution (default: poisson)")
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="Max requests in flight across all replicas (default: 64)")
+    parser.add_argument("--prompt", default="Explain how a GPU schedules warps in one paragraph.",
+                        help="Prompt text for --dataset builtin")
+    parser.add_argument("--max-tokens", type=int, default=128, help="Max tokens per request (default: 128)")
+    parser.add_argument("--ignore-eos", action="store_true",
+                        help="Ask vLLM to always generate max-tokens (always on for --dataset synthetic)")
+    parser.add_argument("--no-stream", dest="stream", action="store_false",
+                        help="Disable streaming (only E2E latency is measured)")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for response headers")
+    parser.add_argument("--read-timeout", type=float, default=60,
+                        help="Seconds without response data before a request fails (default: 60)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for arrivals and synthetic prompts (default: 0)")
+    parser.add_argument("--output", "-o", help="Write the results JSON here")
+    vllm_workloads.add_arguments(parser)
+    args = parser.parse_args()
+    args.headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+    args.ignore_eos = args.ignore_eos or args.dataset == "synthetic"
+    args.policies = [p.strip() for p in args.policy.split(",") if p.strip()]
+    unknown = [p for p in args.policies if p not in POLICIES]
+    if unknown:
+        print(f"ERROR: Unknown policy {', '.join(unknown)}; choose from {', '.join(POLICIES)}")
+        return 1
+
+    print(f"\n=== vLLM Replica Router Benchmark ===\n")
+
+    stubs = []
+    try:
+        if args.stubs:
+            stubs, endpoints = start_stubs(args.stubs, args.stub_args)
+            print(f"Started {args.stubs} stub servers: {', '.join(endpoints)}")
+        else:
+            endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+        print(f"Replicas: {len(endpoints)}")
+        summaries = asyncio.run(run(args, endpoints))
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"ERROR: {e}")
+        return 1
+    finally:
+        for proc in stubs:
+            proc.terminate()
+            proc.wait()
+
+    if args.output:
+        report = {
+            "endpoints": endpoints,
+            "model": args.model,
+            "dataset": args.dataset,
+            "rate": "inf" if math.isinf(args.rate) else args.rate,
+            "concurrency": args.concurrency,
+            "affinity_words": args.affinity_words,
+            "affinity_slack": args.affinity_slack,
+            "policies": summaries,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if any(s["completed"] == 0 for s in summaries):
+        print("\nSome policies completed no requests")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        exit(main())
+    except KeyboardInterrupt:
+        print("\n\nTest interrupted by user")
+        exit(1)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+scripts/vllm-stub-server.py
+OpenAI-compatible stub server for testing load generators without a GPU
+
+Serves /v1/models, /v1/completions and /v1/chat/completions (streaming
+and non-streaming) with synthetic tokens, plus /health and
+/reset_prefix_cache, with configurable timing:
+  - --ttft-ms:          delay before the first token (prefill)
+  - --token-delay-ms:   delay between tokens (decode)
+  - --max-concurrency:  requests decoded at once; the rest queue
+  - --batch-slowdown:   extra decode delay per additional active request,
+                        as a fraction of --token-delay-ms
+  - --prefill-ms-per-1k: extra prefill delay per 1000 uncached prompt tokens
+  - --prefix-cache-tokens: prompt tokens kept in an LRU prefix cache (in
+                        blocks of 16 words, like vLLM's automatic prefix
+                        caching); cached tokens skip the prefill delay and
+                        are reported in usage.prompt_tokens_details
+
+Standard library only. Connections are HTTP/1.1 keep-alive.
+
+Usage:
+    python3 vllm-stub-server.py                          # 127.0.0.1:8001
+    python3 vllm-stub-server.py --port 9001 --token-delay-ms 5 --ttft-ms 50
+    python3 vllm-stub-server.py --max-concurrency 8 --batch-slowdown 0.05
+    python3 vllm-stub-server.py --prefill-ms-per-1k 40 --prefix-cache-tokens 200000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+
+BLOCK_WORDS = 16
+
+
+class StubModel:
+    """Timing model shared by all connections"""
+
+    def __init__(self, args):
+        self.name = args.model
+        self.ttft = args.ttft_ms / 1000
+        self.token_delay = args.token_delay_ms / 1000
+        self.batch_slowdown = args.batch_slowdown
+        self.prefill_per_token = args.prefill_ms_per_1k / 1000 / 1000
+        self.cache_blocks = args.prefix_cache_tokens // BLOCK_WORDS
+        self.cache = OrderedDict()  # block hash (covering the whole prefix) -> None, LRU order
+        self.slots = asyncio.Semaphore(args.max_concurrency)
+        self.active = 0
+        self.served = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def lookup_prefix(self, words):
+        """Prompt tokens already in the prefix cache; caches the rest"""
+        if not self.cache_blocks:
+            return 0
+        cached = 0
+        hashed = None
+        for start in range(0, len(words) - len(words) % BLOCK_WORDS, BLOCK_WORDS):
+            hashed = hash((hashed, tuple(words[start:start + BLOCK_WORDS])))
+            if hashed in self.cache and cached == start:
+                cached += BLOCK_WORDS
+                self.cache.move_to_end(hashed)
+            else:
+                self.cache[hashed] = None
+        while len(self.cache) > self.cache_blocks:
+            self.cache.popitem(last=False)
+        return cached
+
+    async def generate(self, max_tokens, prompt="", stats=None):
+        """Yield synthetic tokens with prefill and per-token decode delays"""
+        async with self.slots:
+            self.active += 1
+            try:
+                words = prompt.split()
+                cached = self.lookup_prefix(words)
+                self.prompt_tokens += len(words)
+                self.cached_tokens += cached
+                if stats is not None:
+                    stats["cached_tokens"] = cached
+                await asyncio.sleep(self.ttft + self.prefill_per_token * (len(words) - cached))
+                for i in range(max_tokens):
+                    if i:
+                        slowdown = 1 + self.batch_slowdown * (self.active - 1)
+                        await asyncio.sleep(self.token_delay * slowdown)
+                    yield f" tok{i}"
+            finally:
+                self.active -= 1
+                self.served += 1
+
+
+def count_tokens(text):
+    """Rough token count: whitespace-separated words"""
+    return max(1, len(text.split()))
+
+
+def prompt_of(path, body):
+    if path.endswith("/chat/completions"):
+        return " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+    prompt = body.get("prompt", "")
+    return " ".join(prompt) if isinstance(prompt, list) else str(prompt)
+
+
+def chunk(path, model, request_id, text=None, finish_reason=None, usage=None):
+    """One streaming chunk in the OpenAI format for the endpoint"""
+    if path.endswith("/chat/completions"):
+        choice = {"index": 0, "delta": {"content": text} if text is not None else {}, "finish_reason": finish_reason}
+        obj = "chat.completion.chunk"
+    else:
+        choice = {"index": 0, "text": text or "", "finish_reason": finish_reason}
+        obj = "text_completion"
+    data = {"id": request_id, "object": obj, "created": int(time.time()), "model": model,
+            "choices": [] if usage else [choice]}
+    if usage:
+        data["usage"] = usage
+    return data
+
+
+async def read_request(reader):
+    """Parse one HTTP/1.1 request; None when the client closed the connection"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode().split(" ", 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?")[0], headers, body
+
+
+def send_json(writer, status, data, keep_alive):
+    body = json.dumps(data).encode()
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+    )
+
+
+async def handle_completion(model, path, body, writer, keep_alive):
+    prompt = prompt_of(path, body)
+    prompt_tokens = count_tokens(prompt)
+    max_tokens = int(body.get("max_tokens") or 16)
+    request_id = f"cmpl-{uuid.uuid4().hex[:16]}"
+    stats = {"cached_tokens": 0}
+    usage_of = lambda n: {"prompt_tokens": prompt_tokens, "completion_tokens": n, "total_tokens": prompt_tokens + n,
+                          "prompt_tokens_details": {"cached_tokens": stats["cached_tokens"]}}
+
+    if not body.get("stream"):
+        tokens = [t async for t in model.generate(max_tokens, prompt, stats)]
+        text = "".join(tokens)
+        if path.endswith("/chat/completions"):
+            choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "length"}
+        else:
+            choice = {"index": 0, "text": text, "finish_reason": "length"}
+        send_json(writer, "200 OK", {"id": request_id, "object": "completion", "model": model.name,
+                                     "choices": [choice], "usage": usage_of(len(tokens))}, keep_alive)
+        await writer.drain()
+        return
+
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n"
+        + f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+    )
+
+    def event(data):
+        payload = f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode()
+        writer.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+
+    produced = 0
+    async for token in model.generate(max_tokens, prompt, stats):
+        produced += 1
+        event(chunk(path, model.name, request_id, text=token))
+        await writer.drain()
+    event(chunk(path, model.name, request_id, text="", finish_reason="length"))
+    if (body.get("stream_options") or {}).get("include_usage"):
+        event(chunk(path, model.name, request_id, usage=usage_of(produced)))
+    event("[DONE]")
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def handle_connection(model, reader, writer):
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            method, path, headers, raw = request
+            keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+            if method == "GET" and path == "/v1/models":
+                send_json(writer, "200 OK", {"object": "list", "data": [{"id": model.name, "object": "model"}]},
+                          keep_alive)
+            elif method == "GET" and path == "/health":
+                send_json(writer, "200 OK", {
+                    "active": model.active,
+                    "served": model.served,
+                    "prompt_tokens": model.prompt_tokens,
+                    "cached_tokens": model.cached_tokens,
+                }, keep_alive)
+            elif method == "POST" and path == "/reset_prefix_cache":
+                model.cache.clear()
+                send_json(writer, "200 OK", {}, keep_alive)
+            elif method == "POST" and path in ("/v1/completions", "/v1/chat/completions"):
+                await handle_completion(model, path, json.loads(raw or b"{}"), writer, keep_alive)
+            else:
+                send_json(writer, "404 Not Found", {"error": f"No route for {method} {path}"}, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(args):
+    model = StubModel(args)
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(model, r, w), args.host, args.port, backlog=1024
+    )
+    port = server.sockets[0].getsockname()[1]
+    print(f"Stub OpenAI server for '{model.name}' on http://{args.host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8001, help="Port (default: 8001, 0 for any)")
+    parser.add_argument("--model", default="stub-model", help="Model id to report (default: stub-model)")
+    parser.add_argument("--ttft-ms", type=float, default=20, help="Delay before the first token (default: 20)")
+    parser.add_argument("--token-delay-ms", type=float, default=10, help="Delay between tokens (default: 10)")
+    parser.add_argument("--max-concurrency", type=int, default=64,
+                        help="Requests decoded at once; more queue (default: 64)")
+    parser.add_argument("--batch-slowdown", type=float, default=0.0,
+                        help="Extra decode delay per additional active request, as a fraction (default: 0)")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0,
+                        help="Extra prefill delay per 1000 uncached prompt tokens (default: 0)")
+    parser.add_argument("--prefix-cache-tokens", type=int, default=0,
+                        help="Prefix cache size in prompt tokens, 0 to disable (default: 0)")
+    args = parser.parse_args()
+
+    asyncio.run(serve(args))
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        exit(main())
+    except KeyboardInterrupt:
+        exit(0)
@@ -0,0 +1,308 @@
+"""
+scripts/vllm_client.py
+Minimal asyncio client for OpenAI-compatible endpoints (vLLM, the stub server)
+
+Used by test-vllm-load.py and test-vllm-router.py; the latency statistics
+(percentile, summarize) are shared with test-vllm-inference.py and
+sweep-vllm-inference.py too. Standard library only:
+requests go over a pool of keep-alive HTTP/1.1 connections per endpoint,
+and streamed responses are timestamped per content event so TTFT and
+inter-token latency are measured as the client sees them.
+"""
+
+import asyncio
+import json
+import math
+import statistics
+import time
+
+
+# === HTTP client ===
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
+
+    def close(self):
+        self.reusable = False
+        self.writer.close()
+
+
+class ConnectionPool:
+    """Up to `size` keep-alive connections to one host, reused across requests"""
+
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle = []
+        self.opened = 0
+        self.connects = 0
+        self.available = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.available:
+            while not self.idle and self.opened >= self.size:
+                await self.available.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.opened += 1
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            async with self.available:
+                self.opened -= 1
+                self.available.notify()
+            raise
+        self.connects += 1
+        return Connection(reader, writer)
+
+    async def release(self, conn):
+        async with self.available:
+            if conn.reusable:
+                self.idle.append(conn)
+            else:
+                self.opened -= 1
+            self.available.notify()
+
+    def close(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle.clear()
+
+
+async def read_headers(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server")
+    status = int(status_line.split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def iter_body(conn, headers):
+    """Yield body chunks as they arrive (chunked or Content-Length)"""
+    reader = conn.reader
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()  # blank line after the last chunk
+                return
+            data = await reader.readexactly(size)
+            await reader.readline()
+            yield data
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining:
+            data = await reader.read(min(remaining, 65536))
+            if not data:
+                raise ConnectionError("Connection closed mid-body")
+            remaining -= len(data)
+            yield data
+    else:
+        conn.reusable = False
+        while data := await reader.read(65536):
+            yield data
+
+
+async def with_read_timeout(chunks, timeout):
+    """Yield body chunks, raising TimeoutError if the body stalls for `timeout` seconds"""
+    while True:
+        try:
+            data = await asyncio.wait_for(anext(chunks), timeout)
+        except StopAsyncIteration:
+            return
+        yield data
+
+
+async def request(pool, method, path, body=None, headers=None):
+    """
+    Send a request and return (status, headers, body chunk iterator, done).
+
+    Call done() once the body has been consumed so the connection goes
+    back to the pool.
+    """
+    conn = await pool.acquire()
+    payload = json.dumps(body).encode() if body is not None else b""
+    lines = [f"{method} {path} HTTP/1.1", f"Host: {pool.host}:{pool.port}", "Connection: keep-alive",
+             f"Content-Length: {len(payload)}"]
+    if body is not None:
+        lines.append("Content-Type: application/json")
+    lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    try:
+        conn.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+        await conn.writer.drain()
+        status, response_headers = await read_headers(conn.reader)
+    except BaseException:
+        conn.close()
+        await pool.release(conn)
+        raise
+    if response_headers.get("connection", "").lower() == "close":
+        conn.reusable = False
+
+    async def done(ok=True):
+        if not ok or not conn.reusable:
+            conn.close()
+        await pool.release(conn)
+
+    return status, response_headers, iter_body(conn, response_headers), done
+
+
+async def get_json(pool, path, headers=None):
+    status, response_headers, body, done = await request(pool, "GET", path, headers=headers)
+    ok = False
+    try:
+        data = b"".join([c async for c in body])
+        ok = True
+    finally:
+        await done(ok)
+    if status != 200:
+        raise RuntimeError(f"GET {path} returned HTTP {status}: {data[:200]!r}")
+    return json.loads(data)
+
+
+# === One request ===
+
+def text_of(event, chat):
+    choices = event.get("choices") or []
+    if not choices:
+        return ""
+    if chat:
+        return (choices[0].get("delta") or {}).get("content") or ""
+    return choices[0].get("text") or ""
+
+
+async def send_completion(pool, args, item):
+    """Run one completion and measure its latency from the client side"""
+    chat = args.endpoint == "chat"
+    body = {"model": args.model, "max_tokens": item["max_tokens"], "temperature": 0.0}
+    if args.ignore_eos:
+        body["ignore_eos"] = True
+    if chat:
+        body["messages"] = item.get("messages") or [{"role": "user", "content": item["prompt"]}]
+    else:
+        body["prompt"] = item["prompt"]
+    if args.stream:
+        body["stream"] = True
+        body["stream_options"] = {"include_usage": True}
+    path = "/v1/chat/completions" if chat else "/v1/completions"
+
+    result = {"ok": False, "ttft": None, "e2e": None, "itl": [], "output_tokens": 0,
+              "prompt_tokens": item["prompt_tokens"]}
+    start = time.perf_counter()
+    try:
+        status, _, chunks, done = await asyncio.wait_for(
+            request(pool, "POST", path, body, args.headers), args.timeout
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    # The header timeout doesn't cover the body; a stream that stalls
+    # after the headers would otherwise hang this request forever
+    chunks = with_read_timeout(chunks, args.read_timeout)
+    ok = False
+    try:
+        if status != 200:
+            data = b"".join([c async for c in chunks])
+            result["error"] = f"HTTP {status}: {data[:200].decode(errors='replace')}"
+            ok = True
+            return result
+
+        token_times = []
+        usage = None
+        if args.stream:
+            buffer = b""
+            async for data in chunks:
+                buffer += data
+                while b"\n\n" in buffer:
+                    event, buffer = buffer.split(b"\n\n", 1)
+                    for line in event.split(b"\n"):
+                        if not line.startswith(b"data:"):
+                            continue
+                        payload = line[5:].strip()
+                        if payload == b"[DONE]":
+                            continue
+                        message = json.loads(payload)
+                        usage = message.get("usage") or usage
+                        if text_of(message, chat):
+                            token_times.append(time.perf_counter())
+        else:
+            message = json.loads(b"".join([c async for c in chunks]))
+            usage = message.get("usage")
+            token_times.append(time.perf_counter())
+        ok = True
+    except TimeoutError:
+        result["error"] = f"TimeoutError: no response data for {args.read_timeout:g}s"
+        return result
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    finally:
+        await done(ok)
+
+    end = time.perf_counter()
+    result["ok"] = bool(token_times)
+    if not token_times:
+        result["error"] = "No tokens in response"
+        return result
+    # Content events usually carry one token; usage gives the exact count
+    result["output_tokens"] = (usage or {}).get("completion_tokens") or len(token_times)
+    result["prompt_tokens"] = (usage or {}).get("prompt_tokens") or item["prompt_tokens"]
+    # Reported by vLLM with --enable-prompt-tokens-details, and by the stub server
+    result["cached_tokens"] = ((usage or {}).get("prompt_tokens_details") or {}).get("cached_tokens")
+    result["e2e"] = end - start
+    if args.stream:
+        result["ttft"] = token_times[0] - start
+        result["itl"] = [b - a for a, b in zip(token_times, token_times[1:])]
+        if result["output_tokens"] > 1:
+            result["tpot"] = (token_times[-1] - token_times[0]) / (result["output_tokens"] - 1)
+    return result
+
+
+# === Load shape and statistics ===
+
+def arrival_gaps(rate, arrival, rng):
+    """Seconds between request arrivals"""
+    while True:
+        if math.isinf(rate):
+            yield 0.0
+        elif arrival == "poisson":
+            yield rng.expovariate(rate)
+        else:
+            yield 1.0 / rate
+
+
+def percentile(values, pct):
+    """Percentile with linear interpolation between closest ranks"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize(values, scale=1000):
+    """Mean and percentiles of latencies in seconds, reported in ms (scale=1 if already ms)"""
+    if not values:
+        return None
+    ms = [v * scale for v in values]
+    return {
+        "count": len(ms),
+        "mean": round(statistics.fmean(ms), 2),
+        "p50": round(percentile(ms, 50), 2),
+        "p90": round(percentile(ms, 90), 2),
+        "p95": round(percentile(ms, 95), 2),
+        "p99": round(percentile(ms, 99), 2),
+        "max": round(max(ms), 2),
+    }
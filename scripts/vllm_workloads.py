@@ -0,0 +1,234 @@
+"""
+scripts/vllm_workloads.py
+Workloads for the vLLM benchmarks (test-vllm-inference.py, test-vllm-load.py)
+
+A workload is a list of requests, each a dict with:
+  - prompt:        prompt text
+  - messages:      chat messages, when the source was a conversation
+  - max_tokens:    output length to request
+  - prompt_tokens: estimated prompt length (words), used until the server
+                   reports the real count
+
+Sources (--dataset):
+  - builtin:    a few short prompts, repeated (quick smoke test)
+  - synthetic:  random text with --input-len/--output-len distributions and
+                --prefix-ratio of each prompt shared across requests
+  - FILE.jsonl: one request per line, as {"prompt": ...}, OpenAI
+                {"messages": [...]} or ShareGPT {"conversations": [...]};
+                an optional "max_tokens" or "output_tokens" sets the length
+
+Length distributions are written as:
+    fixed:N  uniform:LO-HI  normal:MEAN,STD  lognormal:MEDIAN,SIGMA
+
+Results are broken down by prompt-length bucket (--buckets), so a mix of
+short chat turns and long RAG prompts isn't reported as one average.
+
+Example, long RAG prompts sharing a 40% system/context prefix:
+    --dataset synthetic --input-len lognormal:3000,0.6 --output-len uniform:128-512 \\
+        --prefix-ratio 0.4 --prefix-groups 4
+"""
+
+import json
+import math
+import random
+
+
+BUILTIN_PROMPTS = [
+    "Once upon a time",
+    "The meaning of life is",
+    "Artificial intelligence will",
+    "In the future, technology",
+    "Machine learning is",
+]
+
+# Common English words are about one token each in most tokenizers
+VOCABULARY = (
+    "the of and to in is that for it as was with be by on not he this are or his from at which but "
+    "have an they you were her she there one all we their has been would more when if no out so said "
+    "what up its about into than them can only other new some could time these two may then do first "
+    "any my now such like our over man me even most made after also did many before must through back "
+    "years where much your way well down should because each just those people how too little state "
+    "good very make world still own see men work long get here between both life being under never day "
+    "same another know while last might us great old year off come since against go came right used "
+    "take three system data model server memory network request cluster storage query document report"
+).split()
+
+DEFAULT_BUCKETS = "512,2048,8192"
+
+
+def add_arguments(parser):
+    """Add the workload options to an argparse parser"""
+    group = parser.add_argument_group("workload")
+    group.add_argument("--dataset", default="builtin",
+                       help="builtin, synthetic, or a JSONL file of requests (default: builtin)")
+    group.add_argument("--input-len", default="lognormal:1024,0.8",
+                       help="Synthetic prompt length distribution in tokens (default: lognormal:1024,0.8)")
+    group.add_argument("--output-len",
+                       help="Synthetic output length distribution (default: fixed at --max-tokens)")
+    group.add_argument("--prefix-ratio", type=float, default=0.0,
+                       help="Synthetic: fraction of each prompt that is a shared prefix, 0-1 (default: 0)")
+    group.add_argument("--prefix-groups", type=int, default=1,
+                       help="Synthetic: number of distinct shared prefixes (default: 1)")
+    group.add_argument("--buckets", default=DEFAULT_BUCKETS,
+                       help=f"Prompt-length bucket edges in tokens (default: {DEFAULT_BUCKETS})")
+
+
+def parse_distribution(spec):
+    """Parse a length distribution spec into a sampler taking a Random"""
+    kind, _, params = spec.partition(":")
+    try:
+        if kind == "fixed":
+            n = int(params)
+            sampler = lambda rng: n
+        elif kind == "uniform":
+            lo, hi = (int(v) for v in params.split("-"))
+            sampler = lambda rng: rng.randint(lo, hi)
+        elif kind == "normal":
+            mean, std = (float(v) for v in params.split(","))
+            sampler = lambda rng: round(rng.gauss(mean, std))
+        elif kind == "lognormal":
+            median, sigma = (float(v) for v in params.split(","))
+            sampler = lambda rng: round(rng.lognormvariate(math.log(median), sigma))
+        else:
+            raise ValueError(f"unknown kind '{kind}'")
+    except ValueError as e:
+        raise ValueError(f"Invalid length distribution '{spec}': {e}") from None
+    return lambda rng: max(1, sampler(rng))
+
+
+def random_text(rng, n_words):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(n_words))
+
+
+def synthetic(num, input_len, output_len, prefix_ratio=0.0, prefix_groups=1, seed=0):
+    """
+    Random prompts with the given length distributions.
+
+    The first prefix_ratio of every prompt is taken from one of
+    prefix_groups shared prefixes (a system prompt or retrieved context
+    reused across requests), so prefix-cache hit rates are controlled
+    rather than an accident of repeated prompts.
+    """
+    if not 0 <= prefix_ratio <= 1:
+        raise ValueError(f"--prefix-ratio must be between 0 and 1, got {prefix_ratio}")
+    rng = random.Random(seed)
+    sample_input = parse_distribution(input_len)
+    sample_output = parse_distribution(output_len)
+    prefixes = {}  # group -> shared words, grown to the longest prefix needed
+
+    requests = []
+    for i in range(num):
+        length = sample_input(rng)
+        shared = int(length * prefix_ratio)
+        group = rng.randrange(max(1, prefix_groups))
+        prefix = prefixes.setdefault(group, [])
+        if len(prefix) < shared:
+            prefix.extend(random_text(rng, shared - len(prefix)).split())
+        # A unique marker right after the prefix keeps the rest from matching
+        words = prefix[:shared] + [f"[{i}]"] + random_text(rng, max(0, length - shared - 1)).split()
+        requests.append({
+            "prompt": " ".join(words[:length]),
+            "max_tokens": sample_output(rng),
+            "prompt_tokens": length,
+        })
+    return requests
+
+
+def _conversation(record):
+    """Messages from an OpenAI or ShareGPT record, as (role, content) pairs"""
+    if "messages" in record:
+        return [(m.get("role", "user"), str(m.get("content", ""))) for m in record["messages"]]
+    roles = {"human": "user", "user": "user", "gpt": "assistant", "assistant": "assistant", "system": "system"}
+    return [(roles.get(m.get("from"), "user"), str(m.get("value", ""))) for m in record["conversations"]]
+
+
+def load_jsonl(path, default_max_tokens):
+    """
+    Requests from a JSONL file.
+
+    For conversations, the prompt is everything up to the last user turn;
+    the assistant turn that follows (if any) sets the output length.
+    """
+    requests = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_no}: {e}") from None
+            max_tokens = record.get("max_tokens") or record.get("output_tokens")
+            if "prompt" in record:
+                request = {"prompt": str(record["prompt"])}
+            elif "messages" in record or "conversations" in record:
+                turns = _conversation(record)
+                last_user = max((i for i, (role, _) in enumerate(turns) if role == "user"), default=None)
+                if last_user is None:
+                    continue
+                if max_tokens is None and last_user + 1 < len(turns):
+                    max_tokens = len(turns[last_user + 1][1].split()) or None
+                turns = turns[:last_user + 1]
+                request = {
+                    "prompt": "\n".join(f"{role}: {content}" for role, content in turns),
+                    "messages": [{"role": role, "content": content} for role, content in turns],
+                }
+            else:
+                raise ValueError(f"{path}:{line_no}: expected 'prompt', 'messages' or 'conversations'")
+            request["max_tokens"] = int(max_tokens or default_max_tokens)
+            request["prompt_tokens"] = len(request["prompt"].split())
+            requests.append(request)
+    if not requests:
+        raise ValueError(f"No requests in {path}")
+    return requests
+
+
+def build(args, num, default_max_tokens, builtin_prompts=BUILTIN_PROMPTS, seed=0):
+    """The workload selected by --dataset, cycled or truncated to num requests"""
+    if args.dataset == "builtin":
+        requests = [{"prompt": p, "max_tokens": default_max_tokens, "prompt_tokens": len(p.split())}
+                    for p in builtin_prompts]
+    elif args.dataset == "synthetic":
+        output_len = args.output_len or f"fixed:{default_max_tokens}"
+        return synthetic(num, args.input_len, output_len, args.prefix_ratio, args.prefix_groups, seed)
+    else:
+        requests = load_jsonl(args.dataset, default_max_tokens)
+    return [requests[i % len(requests)] for i in range(num)]
+
+
+def shard(requests, spec):
+    """Slice I of N ("I/N", 0-based) of a workload, taking every Nth request"""
+    index, sep, count = spec.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}', expected I/N") from None
+    if not sep or count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{spec}', expected I/N with 0 <= I < N")
+    # Interleaved rather than contiguous so each shard gets the same length mix
+    return requests[index::count]
+
+
+def parse_buckets(spec):
+    edges = sorted(int(v) for v in spec.split(",") if v.strip())
+    if not edges or edges[0] <= 0:
+        raise ValueError(f"Invalid --buckets '{spec}'")
+    return edges
+
+
+def bucket_label(prompt_tokens, edges):
+    lower = 0
+    for edge in edges:
+        if prompt_tokens < edge:
+            return f"{lower}-{edge}"
+        lower = edge
+    return f"{lower}+"
+
+
+def by_bucket(results, edges):
+    """Group results by prompt-length bucket, in bucket order"""
+    labels = [bucket_label(e - 1, edges) for e in edges] + [f"{edges[-1]}+"]
+    groups = {label: [] for label in labels}
+    for r in results:
+        groups[bucket_label(r["prompt_tokens"], edges)].append(r)
+    return {label: rs for label, rs in groups.items() if rs}
@@ -0,0 +1,659 @@
+"""
+Boot-time benchmark harness for qemu_system.
+
+Boots an image N times under a matrix of settings and measures how long
+each boot phase takes, relative to spawning the QEMU process:
+
+    spawned  -> qemu-system has daemonized
+    firmware -> first byte on the guest serial console
+    kernel   -> "Linux version" banner on the serial console
+    ssh      -> guest sshd answers with an SSH protocol banner
+
+Results are written to JSON with p50/p95 per phase and can be compared
+against a stored baseline with a regression threshold.
+
+With --density-budget it instead measures how many identical idle guests
+fit in a host memory budget, with and without balloon free page
+reporting and KSM.
+
+With --startup it measures MCP server launch: time from spawning
+`python -m qemu_mcp.server` to its reply to `initialize`, which the client
+pays at the start of every session. It exits 1 if the p50 exceeds
+--startup-budget.
+
+The guest must log to the serial console (console=ttyS0) for the firmware
+and kernel phases to be recorded. A CirrOS image booted with TCG is small
+enough to run on a GPU-less CI box:
+
+    python -m qemu_mcp.bench --image cirros.qcow2 --accel tcg --memory 256M --runs 5
+    python -m qemu_mcp.bench --image cirros.qcow2 --accel tcg --baseline bench-baseline.json
+    python -m qemu_mcp.bench --image cirros.qcow2 --accel tcg --memory 512M --density-budget 4G
+    python -m qemu_mcp.bench --startup
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from . import memory, qemu_img, qemu_system
+
+
+PHASES = ["spawned", "firmware", "kernel", "ssh"]
+KERNEL_MARKER = b"Linux version"
+POLL_INTERVAL = 0.05
+
+# Seconds from spawning the server to its initialize reply
+STARTUP_BUDGET = 2.0
+
+# Matrix axes and their defaults
+AXES = {
+    "accel": [None],
+    "io_profile": ["default"],
+    "memory": ["1G"],
+    "boot": ["firmware"],
+    "disk": ["overlay"],
+}
+
+
+def expand_matrix(matrix: dict[str, list]) -> list[dict]:
+    """Expand a settings matrix into a list of cases (cartesian product)."""
+    axes = {**AXES, **{k: v for k, v in matrix.items() if v}}
+    unknown = set(axes) - set(AXES)
+    if unknown:
+        raise ValueError(f"Unknown matrix axes: {unknown}. Valid: {set(AXES)}")
+    keys = list(AXES)
+    return [dict(zip(keys, values)) for values in itertools.product(*(axes[k] for k in keys))]
+
+
+def case_key(case: dict) -> str:
+    """Stable identifier for a matrix case, used to match against baselines."""
+    accel = case["accel"] or "auto"
+    return (
+        f"accel={accel},io={case['io_profile']},mem={case['memory']},"
+        f"boot={case['boot']},disk={case['disk']}"
+    )
+
+
+def percentile(values: list[float], pct: float) -> Optional[float]:
+    """Percentile with linear interpolation between closest ranks."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(runs: list[dict]) -> dict:
+    """Compute p50/p95/min/max per phase over successful runs."""
+    summary = {}
+    for phase in PHASES:
+        values = [r[phase] for r in runs if r.get(phase) is not None]
+        if not values:
+            continue
+        summary[phase] = {
+            "n": len(values),
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "min": round(min(values), 3),
+            "max": round(max(values), 3),
+        }
+    return summary
+
+
+def compare_to_baseline(
+    results: dict,
+    baseline: dict,
+    threshold: float = 0.2,
+    metric: str = "p50",
+) -> list[dict]:
+    """
+    Compare benchmark results against a baseline.
+
+    Args:
+        results: Output of run_benchmark
+        baseline: A previous run_benchmark output
+        threshold: Allowed relative slowdown (0.2 = 20%)
+        metric: Summary statistic to compare (p50, p95)
+
+    Returns:
+        List of regressions, empty if everything is within threshold
+    """
+    regressions = []
+    for key, case in results.get("cases", {}).items():
+        base_case = baseline.get("cases", {}).get(key)
+        if not base_case:
+            continue
+        for phase, stats in case.get("summary", {}).items():
+            base_stats = base_case.get("summary", {}).get(phase)
+            if not base_stats or not base_stats.get(metric):
+                continue
+            current, previous = stats[metric], base_stats[metric]
+            if current > previous * (1 + threshold):
+                regressions.append({
+                    "case": key,
+                    "phase": phase,
+                    "metric": metric,
+                    "baseline": previous,
+                    "current": current,
+                    "change": round(current / previous - 1, 3),
+                })
+    return regressions
+
+
+def _free_port() -> int:
+    """Ask the kernel for an unused TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _ssh_banner(port: int, timeout: float = 1.0) -> bool:
+    """Return True once the guest sshd sends its protocol banner."""
+    # QEMU user networking accepts on the forwarded port before the guest is
+    # up, so an open port alone does not mean SSH is ready.
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection("127.0.0.1", port), timeout=timeout
+        )
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        banner = await asyncio.wait_for(reader.read(255), timeout=timeout)
+        return banner.startswith(b"SSH-")
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+async def _watch_boot(serial_log: Path, ssh_port: int, start: float, timeout: float) -> dict:
+    """Poll the serial log and SSH port until the guest is reachable."""
+    marks: dict[str, float] = {}
+    while time.monotonic() - start < timeout:
+        if "kernel" not in marks and serial_log.exists():
+            data = serial_log.read_bytes()
+            if data and "firmware" not in marks:
+                marks["firmware"] = time.monotonic() - start
+            if KERNEL_MARKER in data:
+                marks["kernel"] = time.monotonic() - start
+        if await _ssh_banner(ssh_port):
+            marks["ssh"] = time.monotonic() - start
+            return marks
+        await asyncio.sleep(POLL_INTERVAL)
+    raise TimeoutError(f"Guest not SSH-ready after {timeout}s")
+
+
+async def boot_once(
+    image_path: str,
+    case: dict,
+    workdir: Path,
+    run: int,
+    timeout: float = 600,
+    direct_kernel: Optional[dict] = None,
+) -> dict:
+    """Boot one VM for a matrix case and record phase timings."""
+    ssh_port = _free_port()
+    serial_log = workdir / f"serial-{ssh_port}.log"
+    # Only direct cases get the kernel: boot_vm treats any kernel as a direct boot
+    direct = (direct_kernel or {}) if case["boot"] == "direct" else {}
+    if case["disk"] == "overlay":
+        disk = workdir / f"run-{run}-{ssh_port}.qcow2"
+        disk_format, snapshot = "qcow2", False
+    else:
+        disk, disk_format, snapshot = Path(image_path), "raw", True
+
+    record: dict = {"run": run, "success": False}
+    start = time.monotonic()
+    try:
+        if case["disk"] == "overlay":
+            # Overlay creation is not boot time, so restart the clock after it
+            await qemu_img.create_overlay(image_path, str(disk))
+            start = time.monotonic()
+        await qemu_system.boot_vm(
+            str(disk),
+            memory=case["memory"],
+            ssh_port=ssh_port,
+            accelerator=case["accel"],
+            disk_format=disk_format,
+            io_profile=case["io_profile"],
+            snapshot=snapshot,
+            serial_log=str(serial_log),
+            direct_boot=case["boot"] == "direct",
+            kernel=direct.get("kernel"),
+            initrd=direct.get("initrd"),
+            append=direct.get("append"),
+        )
+        record["spawned"] = time.monotonic() - start
+        record.update(await _watch_boot(serial_log, ssh_port, start, timeout))
+        record["success"] = True
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        try:
+            await qemu_system.stop_vm(ssh_port=ssh_port)
+        except RuntimeError:
+            pass
+        if case["disk"] == "overlay" and disk.exists():
+            disk.unlink()
+    return record
+
+
+async def run_benchmark(
+    image_path: str,
+    matrix: Optional[dict[str, list]] = None,
+    runs: int = 5,
+    timeout: float = 600,
+    direct_kernel: Optional[dict] = None,
+) -> dict:
+    """
+    Boot an image repeatedly for every case in the matrix.
+
+    Args:
+        image_path: Base image to boot (never modified)
+        matrix: Axis -> list of values (see AXES)
+        runs: Boots per case
+        timeout: Seconds to wait for SSH per boot
+        direct_kernel: kernel/initrd/append for boot=direct cases
+            (extracted from the image when not given)
+
+    Returns:
+        Dictionary with host info and per-case runs and summaries
+    """
+    base = Path(image_path).expanduser().resolve()
+    if not base.exists():
+        raise FileNotFoundError(f"Image not found: {image_path}")
+
+    cases = expand_matrix(matrix or {})
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "detected_accelerator": qemu_system.detect_accelerator(),
+        },
+        "image": str(base),
+        "runs": runs,
+        "cases": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="qemu-bench-") as tmp:
+        workdir = Path(tmp)
+        raw_image = None
+        if any(c["disk"] == "raw" for c in cases):
+            info = await qemu_img.image_info(str(base))
+            if info.get("format") == "raw":
+                raw_image = str(base)
+            else:
+                raw_image = str(workdir / "base.raw")
+                await qemu_img.image_convert(str(base), raw_image, "raw")
+
+        if any(c["boot"] == "direct" for c in cases) and not (direct_kernel or {}).get("kernel"):
+            # Extract once up front so extraction is not counted as boot time
+            extracted = await qemu_system.extract_boot_files(str(base))
+            direct_kernel = {
+                **extracted,
+                **{k: v for k, v in (direct_kernel or {}).items() if v},
+            }
+
+        for case in cases:
+            image = raw_image if case["disk"] == "raw" else str(base)
+            records = []
+            for run in range(runs):
+                records.append(
+                    await boot_once(image, case, workdir, run, timeout, direct_kernel)
+                )
+            results["cases"][case_key(case)] = {
+                "settings": case,
+                "runs": records,
+                "failures": sum(1 for r in records if not r["success"]),
+                "summary": summarize([r for r in records if r["success"]]),
+            }
+
+    results["boot_mode_savings"] = boot_mode_savings(results)
+    return results
+
+
+def boot_mode_savings(results: dict, metric: str = "p50") -> list[dict]:
+    """
+    Pair firmware and direct cases that differ only in boot mode and report
+    how much time direct kernel boot saves to SSH-ready.
+    """
+    savings = []
+    cases = results.get("cases", {})
+    for key, case in cases.items():
+        if case["settings"]["boot"] != "firmware":
+            continue
+        direct = cases.get(key.replace("boot=firmware", "boot=direct"))
+        if not direct:
+            continue
+        fw_ssh = case["summary"].get("ssh", {}).get(metric)
+        direct_ssh = direct["summary"].get("ssh", {}).get(metric)
+        if fw_ssh is None or direct_ssh is None:
+            continue
+        savings.append({
+            "case": key.replace(",boot=firmware", ""),
+            "metric": metric,
+            "firmware": fw_ssh,
+            "direct": direct_ssh,
+            "saved": round(fw_ssh - direct_ssh, 3),
+        })
+    return savings
+
+
+async def run_density(
+    image_path: str,
+    budget: str,
+    guest_memory: str = "1G",
+    features: bool = False,
+    max_guests: int = 64,
+    settle: float = 30,
+    timeout: float = 600,
+    balloon_target: Optional[str] = None,
+    accel: Optional[str] = None,
+) -> dict:
+    """
+    Boot identical idle guests until their combined memory exceeds a budget.
+
+    Guest memory is measured as the summed PSS of the QEMU processes after
+    each guest reaches SSH-ready and idles for `settle` seconds.
+
+    Args:
+        image_path: Base image (each guest gets its own overlay)
+        budget: Host memory budget (e.g. "16G")
+        guest_memory: -m size for each guest
+        features: Enable virtio-balloon free page reporting and host KSM
+        max_guests: Upper bound on guests to boot
+        settle: Seconds to idle after each boot before measuring
+        timeout: Seconds to wait for SSH per guest
+        balloon_target: Shrink each guest's balloon to this size (features only)
+        accel: Accelerator override
+
+    Returns:
+        Dictionary with how many guests fit and per-step memory samples
+    """
+    base = Path(image_path).expanduser().resolve()
+    if not base.exists():
+        raise FileNotFoundError(f"Image not found: {image_path}")
+    budget_bytes = qemu_img._parse_size(budget)
+
+    result: dict = {"features": features, "budget": budget_bytes, "guest_memory": guest_memory}
+    # KSM is host-wide: put it back the way we found it when the run ends
+    ksm_before = memory.ksm_status()
+    ksm_changed = False
+    try:
+        result["ksm"] = memory.ksm_set(features)
+        ksm_changed = True
+    except (PermissionError, RuntimeError) as e:
+        result["ksm"] = {"error": str(e), **memory.ksm_status()}
+
+    guests: list[dict] = []
+    samples = []
+    fits = 0
+    with tempfile.TemporaryDirectory(prefix="qemu-density-") as tmp:
+        workdir = Path(tmp)
+        try:
+            for n in range(1, max_guests + 1):
+                ssh_port = _free_port()
+                overlay = workdir / f"guest-{n}.qcow2"
+                await qemu_img.create_overlay(str(base), str(overlay))
+                start = time.monotonic()
+                vm = await qemu_system.boot_vm(
+                    str(overlay),
+                    memory=guest_memory,
+                    ssh_port=ssh_port,
+                    accelerator=accel,
+                    serial_log=str(workdir / f"serial-{ssh_port}.log"),
+                    balloon=features,
+                )
+                guests.append({"ssh_port": ssh_port, "pid": vm["pid"]})
+                await _watch_boot(workdir / f"serial-{ssh_port}.log", ssh_port, start, timeout)
+                if features and balloon_target:
+                    await memory.balloon(ssh_port, balloon_target)
+                await asyncio.sleep(settle)
+
+                total = sum(memory.process_pss(g["pid"]) or 0 for g in guests if g["pid"])
+                samples.append({"guests": n, "total_pss": total})
+                if total > budget_bytes:
+                    break
+                fits = n
+        finally:
+            for guest in guests:
+                try:
+                    await qemu_system.stop_vm(ssh_port=guest["ssh_port"])
+                except RuntimeError:
+                    pass
+            result["ksm_after"] = memory.ksm_status()
+            if ksm_changed:
+                try:
+                    memory.ksm_set(
+                        ksm_before.get("run") == 1,
+                        pages_to_scan=ksm_before.get("pages_to_scan"),
+                        sleep_millisecs=ksm_before.get("sleep_millisecs"),
+                    )
+                except (PermissionError, RuntimeError) as e:
+                    result["ksm_restore_error"] = str(e)
+
+    result["guests_fit"] = fits
+    result["samples"] = samples
+    if samples:
+        last = samples[-1]
+        result["pss_per_guest"] = last["total_pss"] // last["guests"]
+        result["pss_per_guest-human"] = qemu_img._format_size(result["pss_per_guest"])
+    return result
+
+
+async def startup_once(timeout: float = 30) -> float:
+    """Spawn the MCP server over stdio and time its reply to initialize."""
+    request = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "initialize",
+        "params": {
+            "protocolVersion": "2024-11-05",
+            "capabilities": {},
+            "clientInfo": {"name": "qemu-mcp-bench", "version": "0"},
+        },
+    }
+    package_root = Path(__file__).resolve().parent.parent
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(
+        p for p in (str(package_root), os.environ.get("PYTHONPATH")) if p
+    )}
+
+    start = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "qemu_mcp.server",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        env=env,
+    )
+    try:
+        process.stdin.write(json.dumps(request).encode() + b"\n")
+        await process.stdin.drain()
+        line = await asyncio.wait_for(process.stdout.readline(), timeout=timeout)
+        elapsed = time.monotonic() - start
+        if not line:
+            raise RuntimeError("Server exited before answering initialize")
+        if "result" not in json.loads(line):
+            raise RuntimeError(f"initialize failed: {line.decode().strip()}")
+        return elapsed
+    finally:
+        # Closing stdin ends the stdio session
+        process.stdin.close()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+
+async def measure_startup(runs: int = 5, budget: float = STARTUP_BUDGET) -> dict:
+    """
+    Measure server launch time over several spawns.
+
+    Args:
+        runs: Number of server launches
+        budget: Allowed p50 launch time in seconds
+
+    Returns:
+        Dictionary with per-run times, p50/max and whether p50 is within budget
+    """
+    times = [await startup_once() for _ in range(runs)]
+    p50 = percentile(times, 50)
+    return {
+        "runs": [round(t, 3) for t in times],
+        "p50": round(p50, 3),
+        "max": round(max(times), 3),
+        "budget": budget,
+        "within_budget": p50 <= budget,
+    }
+
+
+def _split(value: Optional[str]) -> list:
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark QEMU boot latency")
+    parser.add_argument("--image", help="Base disk image to boot")
+    parser.add_argument("--runs", type=int, default=5, help="Boots per case (default: 5)")
+    parser.add_argument("--accel", help="Comma-separated accelerators (default: auto)")
+    parser.add_argument("--io-profile", help=f"Comma-separated from {', '.join(qemu_system.IO_PROFILES)}")
+    parser.add_argument("--memory", help="Comma-separated memory sizes (default: 1G)")
+    parser.add_argument("--boot", help="Comma-separated boot modes: firmware, direct")
+    parser.add_argument("--disk", help="Comma-separated disk modes: overlay, raw")
+    parser.add_argument("--kernel", help="Kernel for boot=direct (default: extract from image)")
+    parser.add_argument("--initrd", help="Initrd for boot=direct")
+    parser.add_argument("--append", help="Kernel command line for boot=direct")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for SSH per boot")
+    parser.add_argument("--output", "-o", default="bench-results.json", help="Results JSON path")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown vs baseline (default: 0.2)")
+    parser.add_argument("--metric", default="p50", choices=["p50", "p95"], help="Statistic compared to baseline")
+    parser.add_argument("--density-budget", help="Run the density benchmark against this memory budget (e.g. 16G)")
+    parser.add_argument("--max-guests", type=int, default=64, help="Density: maximum guests to boot")
+    parser.add_argument("--settle", type=float, default=30, help="Density: idle seconds before measuring")
+    parser.add_argument("--balloon-target", help="Density: shrink each balloon to this size")
+    parser.add_argument("--startup", action="store_true", help="Measure MCP server launch time instead of boots")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+                        help=f"Startup: allowed p50 seconds (default: {STARTUP_BUDGET})")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        return _startup_main(args)
+    if not args.image:
+        parser.error("--image is required")
+    if args.density_budget:
+        return _density_main(args)
+
+    matrix = {
+        "accel": _split(args.accel),
+        "io_profile": _split(args.io_profile),
+        "memory": _split(args.memory),
+        "boot": _split(args.boot),
+        "disk": _split(args.disk),
+    }
+    direct_kernel = {"kernel": args.kernel, "initrd": args.initrd, "append": args.append}
+
+    results = asyncio.run(
+        run_benchmark(args.image, matrix, args.runs, args.timeout, direct_kernel)
+    )
+
+    status = 0
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare_to_baseline(results, baseline, args.threshold, args.metric)
+        results["baseline"] = {
+            "path": args.baseline,
+            "threshold": args.threshold,
+            "metric": args.metric,
+            "regressions": regressions,
+        }
+        if regressions:
+            status = 1
+
+    Path(args.output).write_text(json.dumps(results, indent=2))
+
+    for key, case in results["cases"].items():
+        phases = ", ".join(
+            f"{phase} p50={s['p50']:.2f}s p95={s['p95']:.2f}s"
+            for phase, s in case["summary"].items()
+        )
+        print(f"{key}: {phases or 'no successful boots'} ({case['failures']} failed)")
+    for saving in results["boot_mode_savings"]:
+        print(
+            f"Direct boot saves {saving['saved']:.2f}s to SSH-ready "
+            f"({saving['firmware']:.2f}s -> {saving['direct']:.2f}s) for {saving['case']}"
+        )
+    for r in results.get("baseline", {}).get("regressions", []):
+        print(
+            f"REGRESSION {r['case']} {r['phase']}: {r['baseline']:.2f}s -> "
+            f"{r['current']:.2f}s ({r['change'] * 100:+.0f}%)"
+        )
+    if any(case["failures"] for case in results["cases"].values()):
+        status = 1
+    print(f"Results written to {args.output}")
+    return status
+
+
+def _density_main(args: argparse.Namespace) -> int:
+    """Run the density benchmark with and without memory features."""
+    guest_memory = (_split(args.memory) or ["1G"])[0]
+    accel = (_split(args.accel) or [None])[0]
+
+    async def both() -> dict:
+        runs = {}
+        for label, features in (("baseline", False), ("balloon_ksm", True)):
+            runs[label] = await run_density(
+                args.image, args.density_budget, guest_memory, features,
+                args.max_guests, args.settle, args.timeout, args.balloon_target, accel,
+            )
+        return runs
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "image": args.image,
+        "density": asyncio.run(both()),
+    }
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    for label, run in results["density"].items():
+        print(
+            f"{label}: {run['guests_fit']} guests fit in {args.density_budget} "
+            f"({run.get('pss_per_guest-human', 'n/a')} per guest)"
+        )
+    print(f"Results written to {args.output}")
+    return 0
+
+
+def _startup_main(args: argparse.Namespace) -> int:
+    """Run the server startup benchmark against its budget."""
+    result = asyncio.run(measure_startup(args.runs, args.startup_budget))
+    Path(args.output).write_text(json.dumps({
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "startup": result,
+    }, indent=2))
+    verdict = "within" if result["within_budget"] else "OVER"
+    print(
+        f"Server startup p50={result['p50']:.2f}s max={result['max']:.2f}s "
+        f"({verdict} budget {result['budget']:.2f}s)"
+    )
+    print(f"Results written to {args.output}")
+    return 0 if result["within_budget"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Read-through cache for read-only tool results.
+
+Agents poll qemu_image_info, qemu_list_vms and qemu_vm_status in loops, and
+each call costs a subprocess or socket round trip. Results of tools
+declared with a cache TTL are kept for that long, keyed by tool name and
+normalized arguments (arguments ending in "_path" are resolved to real
+paths). Concurrent identical calls share one in-flight computation.
+
+Entries carry tags naming what they read, e.g. ("image", "/var/x.qcow2")
+or VMS. Mutating tools invalidate their tags before and after they run,
+and a computation that overlaps an invalidation of its tags is not stored.
+Errors are never cached. QEMU_MCP_CACHE=off disables the cache.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+from . import metrics, tracing
+
+
+ENABLED = os.environ.get("QEMU_MCP_CACHE", "on") != "off"
+MAX_ENTRIES = 1024
+
+# Tag for anything derived from the set of running VMs
+VMS = ("vms",)
+
+Tag = tuple
+
+
+def normalize_path(path: str) -> str:
+    return os.path.realpath(os.path.expanduser(path))
+
+
+def image(path: str) -> Tag:
+    """Tag for results read from one image file."""
+    return ("image", normalize_path(path))
+
+
+def make_key(tool: str, arguments: dict[str, Any]) -> str:
+    normalized = {
+        k: normalize_path(v) if k.endswith("_path") and isinstance(v, str) else v
+        for k, v in arguments.items()
+    }
+    return tool + ":" + json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "tags")
+
+    def __init__(self, value: dict, expires: float, tags: frozenset):
+        self.value = value
+        self.expires = expires
+        self.tags = tags
+
+
+class ResultCache:
+    """TTL cache with tag invalidation and in-flight coalescing."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: dict[str, _Entry] = {}
+        self._inflight: dict[str, tuple[asyncio.Future, frozenset]] = {}
+        # Bumped on every invalidation of a tag
+        self._versions: dict[Tag, int] = {}
+
+    def _versions_of(self, tags: frozenset) -> tuple:
+        return tuple(sorted((t, self._versions.get(t, 0)) for t in tags))
+
+    async def get(
+        self,
+        tool: str,
+        arguments: dict[str, Any],
+        ttl: float,
+        tags: Iterable[Tag],
+        compute: Callable[[], Awaitable[dict]],
+    ) -> dict:
+        """
+        Return a cached result, join an identical in-flight call, or compute.
+
+        Args:
+            tool: Tool name
+            arguments: Validated handler arguments
+            ttl: Seconds a result stays valid
+            tags: What the result was read from
+            compute: Coroutine factory producing the result
+
+        Returns:
+            A shallow copy of the result, so callers may add keys
+        """
+        key = make_key(tool, arguments)
+        with tracing.span("cache", tool=tool) as span:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > time.monotonic():
+                span["result"] = "hit"
+                metrics.CACHE_LOOKUPS.inc(tool=tool, result="hit")
+                return dict(entry.value)
+
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                span["result"] = "coalesced"
+                metrics.CACHE_LOOKUPS.inc(tool=tool, result="coalesced")
+                try:
+                    return dict(await asyncio.shield(inflight[0]))
+                except asyncio.CancelledError:
+                    if not inflight[0].cancelled():
+                        raise
+                    # The call we joined was cancelled, not us; run our own
+
+            span["result"] = "miss"
+            metrics.CACHE_LOOKUPS.inc(tool=tool, result="miss")
+            return await self._compute(key, ttl, frozenset(tags), compute)
+
+    async def _compute(
+        self, key: str, ttl: float, tags: frozenset, compute: Callable[[], Awaitable[dict]],
+    ) -> dict:
+        before = self._versions_of(tags)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (future, tags)
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; not an unretrieved error
+            raise
+        finally:
+            if self._inflight.get(key, (None,))[0] is future:
+                del self._inflight[key]
+        future.set_result(value)
+        if self._versions_of(tags) == before:
+            self._store(key, _Entry(value, time.monotonic() + ttl, tags))
+        return dict(value)
+
+    def _store(self, key: str, entry: _Entry) -> None:
+        if len(self._entries) >= self.max_entries:
+            now = time.monotonic()
+            for k in [k for k, e in self._entries.items() if e.expires <= now]:
+                del self._entries[k]
+            if len(self._entries) >= self.max_entries:
+                # Oldest insertion first
+                del self._entries[next(iter(self._entries))]
+        self._entries[key] = entry
+
+    def invalidate(self, tags: Iterable[Tag]) -> int:
+        """
+        Drop cached and in-flight results read from any of the tags.
+
+        Returns:
+            Number of cached entries dropped
+        """
+        tags = frozenset(tags)
+        if not tags:
+            return 0
+        for tag in tags:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+        # Later callers start a fresh computation instead of joining a stale one
+        for key in [k for k, (_, t) in self._inflight.items() if t & tags]:
+            del self._inflight[key]
+        stale = [k for k, e in self._entries.items() if e.tags & tags]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._inflight.clear()
+
+
+RESULTS = ResultCache()
@@ -0,0 +1,58 @@
+"""
+Keep the event loop responsive.
+
+Every tool call shares one asyncio loop, so a blocking call on it (a stat
+on a hung NFS mount, a slow pgrep) stalls all of them. Filesystem work runs
+in a small dedicated thread pool through run_blocking(), and monitor_lag()
+measures how late the loop wakes from a short sleep. Lag is exported as
+qemu_mcp_event_loop_lag_seconds, and lag at or above QEMU_MCP_LOOP_LAG_MS
+is logged and counted as a stall.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from . import metrics
+
+logger = logging.getLogger("qemu-mcp")
+
+# Bounded so a hung mount ties up at most this many threads
+BLOCKING_THREADS = int(os.environ.get("QEMU_MCP_BLOCKING_THREADS", "8"))
+LAG_THRESHOLD_MS = float(os.environ.get("QEMU_MCP_LOOP_LAG_MS", "100"))
+LAG_INTERVAL = 0.25  # seconds between probes
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function in the bounded I/O thread pool."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix="qemu-mcp-io")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def monitor_lag(interval: float = LAG_INTERVAL, threshold_ms: float = LAG_THRESHOLD_MS) -> None:
+    """
+    Sample event-loop lag until cancelled.
+
+    Args:
+        interval: Seconds to sleep between samples
+        threshold_ms: Lag that is logged and counted as a stall
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        metrics.LOOP_LAG.observe(lag)
+        if lag * 1000 >= threshold_ms:
+            metrics.LOOP_STALLS.inc()
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms")
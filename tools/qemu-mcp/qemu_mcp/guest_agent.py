@@ -0,0 +1,295 @@
+"""
+QEMU guest agent (qemu-ga) client.
+
+Runs commands and transfers files inside a VM over the virtio-serial
+channel that boot_vm attaches, instead of opening an SSH session per
+command. One connection per VM is kept open and reused.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from . import eventloop, tracing
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MiB per guest-file-read/write
+EXEC_POLL_INTERVAL = 0.05
+
+# Persistent connections by SSH port
+_agents: dict[int, "GuestAgent"] = {}
+
+
+def socket_path(ssh_port: int) -> str:
+    """Host-side unix socket for the guest agent channel of a VM."""
+    return f"/tmp/qemu-vm-{ssh_port}.qga"
+
+
+def qemu_args(ssh_port: int) -> list[str]:
+    """QEMU arguments that attach a qemu-ga virtio-serial channel."""
+    return [
+        "-chardev", f"socket,path={socket_path(ssh_port)},server=on,wait=off,id=qga0",
+        "-device", "virtio-serial",
+        "-device", "virtserialport,chardev=qga0,name=org.qemu.guest_agent.0",
+    ]
+
+
+class GuestAgentError(RuntimeError):
+    """Error returned by qemu-ga."""
+
+
+class GuestAgent:
+    """A persistent connection to one VM's guest agent."""
+
+    def __init__(self, path: str, timeout: float = 10):
+        self.path = path
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        """Open the socket and resynchronise with the agent."""
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(
+                f"Guest agent socket not found: {self.path}. Was the VM booted with enable_guest_agent?"
+            )
+        # Agent responses can be large (base64 file chunks)
+        self._reader, self._writer = await asyncio.open_unix_connection(
+            self.path, limit=64 * 1024 * 1024
+        )
+        # guest-sync-delimited makes the agent drop any partial input and
+        # prefix its reply with 0xFF, so stale data can be skipped.
+        sync_id = random.randint(1, 2**31)
+        reply = await self._request("guest-sync-delimited", {"id": sync_id})
+        while reply != sync_id:
+            reply = await self._read_reply()
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _read_reply(self) -> Any:
+        line = await asyncio.wait_for(self._reader.readline(), timeout=self.timeout)
+        if not line:
+            raise ConnectionError("Guest agent closed the connection")
+        message = json.loads(line.lstrip(b"\xff"))
+        if "error" in message:
+            error = message["error"]
+            raise GuestAgentError(f"{error.get('class')}: {error.get('desc')}")
+        return message.get("return")
+
+    async def _request(self, command: str, arguments: Optional[dict] = None) -> Any:
+        request = {"execute": command}
+        if arguments:
+            request["arguments"] = arguments
+        self._writer.write(json.dumps(request).encode() + b"\n")
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def execute(self, command: str, arguments: Optional[dict] = None) -> Any:
+        """Send one agent command and return its result."""
+        async with self._lock:
+            if not self.connected:
+                await self.connect()
+            try:
+                return await self._request(command, arguments)
+            except (ConnectionError, asyncio.TimeoutError):
+                await self.close()
+                raise
+
+    async def exec_start(self, command: str) -> int:
+        """Start a shell command in the guest and return its guest PID."""
+        result = await self.execute("guest-exec", {
+            "path": "/bin/sh",
+            "arg": ["-c", command],
+            "capture-output": True,
+        })
+        return result["pid"]
+
+    async def exec_wait(self, pid: int, timeout: float = 60) -> dict:
+        """Poll guest-exec-status until the command exits."""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = await self.execute("guest-exec-status", {"pid": pid})
+            if status.get("exited"):
+                return {
+                    "exitcode": status.get("exitcode", status.get("signal")),
+                    "stdout": base64.b64decode(status.get("out-data", "")).decode(errors="replace"),
+                    "stderr": base64.b64decode(status.get("err-data", "")).decode(errors="replace"),
+                }
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Guest command (pid {pid}) did not exit after {timeout}s")
+            await asyncio.sleep(EXEC_POLL_INTERVAL)
+
+
+def get_agent(ssh_port: int) -> GuestAgent:
+    """Return the pooled agent connection for a VM, creating it if needed."""
+    agent = _agents.get(ssh_port)
+    if agent is None:
+        agent = GuestAgent(socket_path(ssh_port))
+        _agents[ssh_port] = agent
+    return agent
+
+
+async def close_agent(ssh_port: int) -> None:
+    """Drop the pooled connection for a VM (e.g. when it is stopped)."""
+    agent = _agents.pop(ssh_port, None)
+    if agent is not None:
+        await agent.close()
+
+
+async def vm_exec(ssh_port: int, commands: list[str], timeout: int = 60) -> dict:
+    """
+    Run shell commands inside a VM through the guest agent.
+
+    All commands are started before any is waited on, so a batch runs
+    concurrently in the guest over the single agent connection.
+
+    Args:
+        ssh_port: SSH port identifying the VM
+        commands: Shell commands, each run with /bin/sh -c
+        timeout: Per-command timeout in seconds
+
+    Returns:
+        Dictionary with per-command exit code, output and duration. A
+        command that times out gets exitcode None and timed_out True;
+        the others are still collected.
+    """
+    if not commands:
+        raise ValueError("Must provide at least one command")
+
+    agent = get_agent(ssh_port)
+    started = []
+    for command in commands:
+        started.append((command, await agent.exec_start(command), time.monotonic()))
+
+    results = []
+    for command, pid, start in started:
+        # Each command's budget runs from its own start, not from when we
+        # got around to waiting on it
+        remaining = max(0, start + timeout - time.monotonic())
+        try:
+            outcome = await agent.exec_wait(pid, timeout=remaining)
+        except TimeoutError as e:
+            outcome = {"exitcode": None, "stdout": "", "stderr": str(e), "timed_out": True}
+        results.append({
+            "command": command,
+            **outcome,
+            "duration": round(time.monotonic() - start, 3),
+        })
+
+    return {
+        "ssh_port": ssh_port,
+        "success": all(r["exitcode"] == 0 for r in results),
+        "results": results,
+    }
+
+
+def _resolve_existing(source: str) -> Path:
+    src = Path(source).expanduser().resolve()
+    if not src.exists():
+        raise FileNotFoundError(f"Source file not found: {source}")
+    return src
+
+
+def _prepare_destination(destination: str) -> Path:
+    dst = Path(destination).expanduser().resolve()
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    return dst
+
+
+async def vm_copy(
+    ssh_port: int,
+    source: str,
+    destination: str,
+    direction: str = "to_guest",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> dict:
+    """
+    Copy a file between host and guest through the guest agent.
+
+    Args:
+        ssh_port: SSH port identifying the VM
+        source: Source path (host path for to_guest, guest path for from_guest)
+        destination: Destination path on the other side
+        direction: "to_guest" or "from_guest"
+        chunk_size: Bytes per guest-file-read/write call
+
+    Returns:
+        Dictionary with transfer results
+    """
+    if direction not in ("to_guest", "from_guest"):
+        raise ValueError(f"Invalid direction '{direction}'. Valid: to_guest, from_guest")
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+
+    agent = get_agent(ssh_port)
+    start = time.monotonic()
+    transferred = 0
+    chunks = 0
+
+    # One span for the whole transfer rather than one per chunk
+    with tracing.span("file", op="copy", path=source, direction=direction) as span:
+        if direction == "to_guest":
+            src = await eventloop.run_blocking(_resolve_existing, source)
+            handle = await agent.execute("guest-file-open", {"path": destination, "mode": "wb"})
+            try:
+                # Disk reads go through the I/O pool; only the agent calls run on the loop
+                f = await eventloop.run_blocking(open, src, "rb")
+                try:
+                    while chunk := await eventloop.run_blocking(f.read, chunk_size):
+                        await agent.execute("guest-file-write", {
+                            "handle": handle,
+                            "buf-b64": base64.b64encode(chunk).decode(),
+                        })
+                        transferred += len(chunk)
+                        chunks += 1
+                finally:
+                    await eventloop.run_blocking(f.close)
+            finally:
+                await agent.execute("guest-file-close", {"handle": handle})
+        else:
+            dst = await eventloop.run_blocking(_prepare_destination, destination)
+            handle = await agent.execute("guest-file-open", {"path": source, "mode": "rb"})
+            try:
+                f = await eventloop.run_blocking(open, dst, "wb")
+                try:
+                    while True:
+                        result = await agent.execute("guest-file-read", {
+                            "handle": handle,
+                            "count": chunk_size,
+                        })
+                        data = base64.b64decode(result.get("buf-b64", ""))
+                        await eventloop.run_blocking(f.write, data)
+                        transferred += len(data)
+                        chunks += 1
+                        if result.get("eof") or not data:
+                            break
+                finally:
+                    await eventloop.run_blocking(f.close)
+            finally:
+                await agent.execute("guest-file-close", {"handle": handle})
+        span["bytes"] = transferred
+
+    elapsed = time.monotonic() - start
+    return {
+        "success": True,
+        "ssh_port": ssh_port,
+        "direction": direction,
+        "source": source,
+        "destination": destination,
+        "bytes": transferred,
+        "chunks": chunks,
+        "duration": round(elapsed, 3),
+    }
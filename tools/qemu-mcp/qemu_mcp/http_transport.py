@@ -0,0 +1,168 @@
+"""
+Streamable HTTP transport for one shared, long-lived server.
+
+Over stdio every client session starts its own server process, so job
+tables, SSH connections and VM registries are per client. Served over
+HTTP, a single warm process handles many concurrent MCP sessions with
+shared state.
+
+There is no authentication, so the server only binds to a loopback
+address or a unix socket (created mode 0600). Host and Origin headers are
+checked to block DNS-rebinding from browsers.
+"""
+
+import ipaddress
+import logging
+import os
+import socket
+import stat
+from typing import Optional
+
+logger = logging.getLogger("qemu-mcp")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_CONNECTIONS = 32
+MCP_PATH = "/mcp"
+
+_LOCAL_HOSTS = ("127.0.0.1", "localhost", "[::1]")
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _bind_unix(path: str) -> socket.socket:
+    """Bind a unix socket only the current user can connect to."""
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise FileExistsError(f"Not a socket: {path}")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)  # stale socket from a previous run
+        else:
+            raise RuntimeError(f"Another server is listening on {path}")
+        finally:
+            probe.close()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    os.chmod(path, 0o600)
+    sock.listen()
+    return sock
+
+
+def _bind_tcp(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen()
+    return sock
+
+
+def _security_settings():
+    from mcp.server.transport_security import TransportSecuritySettings
+
+    return TransportSecuritySettings(
+        enable_dns_rebinding_protection=True,
+        allowed_hosts=[h for host in _LOCAL_HOSTS for h in (host, f"{host}:*")],
+        allowed_origins=[f"http://{host}:*" for host in _LOCAL_HOSTS],
+    )
+
+
+def create_app(mcp_server):
+    """
+    Build the ASGI app and its session manager.
+
+    Returns:
+        (app, session_manager); the manager's run() context must be
+        active while the app serves requests
+    """
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+
+    manager = StreamableHTTPSessionManager(app=mcp_server, security_settings=_security_settings())
+
+    async def app(scope, receive, send):
+        if scope["type"] == "http" and scope["path"].rstrip("/") == MCP_PATH:
+            await manager.handle_request(scope, receive, send)
+            return
+        if scope["type"] == "http":
+            await send({
+                "type": "http.response.start",
+                "status": 404,
+                "headers": [(b"content-type", b"text/plain")],
+            })
+            await send({"type": "http.response.body", "body": b"Not Found\n"})
+
+    return app, manager
+
+
+async def serve(
+    mcp_server,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    socket_path: Optional[str] = None,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    started=None,
+) -> None:
+    """
+    Serve MCP sessions over streamable HTTP until cancelled.
+
+    Args:
+        mcp_server: The MCP Server instance
+        host: Loopback address to bind (ignored with socket_path)
+        port: TCP port
+        socket_path: Unix socket path to bind instead of TCP
+        max_connections: Concurrent HTTP connections; more get HTTP 503
+        started: Optional asyncio.Event set once the socket is listening
+
+    Raises:
+        ValueError: Non-loopback host or bad limit
+    """
+    import uvicorn
+
+    if max_connections < 1:
+        raise ValueError("max_connections must be at least 1")
+    if socket_path:
+        sock = _bind_unix(socket_path)
+        where = f"unix:{socket_path}"
+    else:
+        if not is_loopback(host):
+            raise ValueError(f"Refusing to serve on non-loopback address {host}; use a unix socket or 127.0.0.1")
+        sock = _bind_tcp(host, port)
+        where = f"http://{host}:{sock.getsockname()[1]}{MCP_PATH}"
+
+    app, manager = create_app(mcp_server)
+    config = uvicorn.Config(
+        app,
+        lifespan="off",
+        limit_concurrency=max_connections,
+        log_level="warning",
+        # Streams are long-lived; let clients reconnect rather than hang
+        timeout_graceful_shutdown=5,
+    )
+    http_server = uvicorn.Server(config)
+
+    try:
+        async with manager.run():
+            logger.info(f"Serving MCP on {where} (max {max_connections} connections)")
+            if started is not None:
+                started.set()
+            await http_server.serve(sockets=[sock])
+    finally:
+        http_server.should_exit = True
+        sock.close()
+        if socket_path and os.path.lexists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,221 @@
+"""
+Per-device I/O governor for disk-heavy operations.
+
+Converts, verifies and boots running at once compete for the same disks,
+and short metadata calls (image info, overlays) stall behind them. Every
+operation that touches an image takes a slot on the block device(s) it
+reads or writes:
+
+- bulk operations (convert, verify) may hold QEMU_MCP_IO_SLOTS slots per
+  device;
+- interactive operations may also use QEMU_MCP_IO_INTERACTIVE_RESERVE
+  extra slots, and are queued ahead of bulk ones.
+
+qemu-img processes spawned by bulk operations run under `ionice -c2 -n7`
+(QEMU_MCP_IONICE=off disables) and, when QEMU_MCP_IO_CGROUP names a
+writable cgroup v2 directory, are moved into it with io.weight set to
+QEMU_MCP_IO_WEIGHT. Time spent queueing is recorded per priority in the
+qemu_mcp_io_queue_wait_seconds histogram, "io_wait" trace spans and
+qemu_io_status.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import shutil
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Optional
+
+from . import eventloop, metrics, tracing
+
+logger = logging.getLogger("qemu-mcp")
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+_RANK = {INTERACTIVE: 0, BULK: 1}
+
+SLOTS_PER_DEVICE = int(os.environ.get("QEMU_MCP_IO_SLOTS", "2"))
+INTERACTIVE_RESERVE = int(os.environ.get("QEMU_MCP_IO_INTERACTIVE_RESERVE", "2"))
+IONICE = os.environ.get("QEMU_MCP_IONICE", "on") != "off"
+CGROUP = os.environ.get("QEMU_MCP_IO_CGROUP")
+IO_WEIGHT = int(os.environ.get("QEMU_MCP_IO_WEIGHT", "50"))
+
+# Devices held and priority of the current task (and the calls it makes)
+_held: contextvars.ContextVar[frozenset] = contextvars.ContextVar("io_held", default=frozenset())
+_priority: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("io_priority", default=None)
+
+_waits: dict[str, deque] = {INTERACTIVE: deque(maxlen=200), BULK: deque(maxlen=200)}
+_seq = itertools.count()
+_cgroup_ready: Optional[bool] = None
+
+
+class _Device:
+    """Slots and waiters for one block device."""
+
+    def __init__(self):
+        self.active = {INTERACTIVE: 0, BULK: 0}
+        self.waiters: list[tuple[int, int, str, asyncio.Future]] = []
+
+    def admits(self, priority: str) -> bool:
+        total = self.active[INTERACTIVE] + self.active[BULK]
+        if total >= SLOTS_PER_DEVICE + INTERACTIVE_RESERVE:
+            return False
+        return priority == INTERACTIVE or self.active[BULK] < SLOTS_PER_DEVICE
+
+    def wake(self) -> None:
+        while self.waiters:
+            _, _, priority, future = self.waiters[0]
+            if future.done():  # cancelled while waiting
+                heapq.heappop(self.waiters)
+                continue
+            if not self.admits(priority):
+                break
+            heapq.heappop(self.waiters)
+            self.active[priority] += 1
+            future.set_result(None)
+
+    async def acquire(self, priority: str) -> None:
+        if not self.waiters and self.admits(priority):
+            self.active[priority] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (_RANK[priority], next(_seq), priority, future))
+        self.wake()  # the queue may hold only cancelled waiters
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(priority)  # granted just as we were cancelled
+            raise
+
+    def release(self, priority: str) -> None:
+        self.active[priority] -= 1
+        self.wake()
+
+
+_devices: dict[int, _Device] = {}
+
+
+def device_of(path: str) -> int:
+    """Block device holding a path, or its nearest existing parent."""
+    candidate = Path(path).expanduser().absolute()
+    for p in (candidate, *candidate.parents):
+        try:
+            return os.stat(p).st_dev
+        except OSError:
+            continue
+    return 0
+
+
+@contextlib.asynccontextmanager
+async def slot(paths: Iterable[str], priority: str) -> AsyncIterator[None]:
+    """
+    Hold an I/O slot on the device of each path for the duration.
+
+    Devices the current task already holds are not acquired again, so
+    operations can call each other (convert then info) without deadlock.
+
+    Args:
+        paths: Files read or written (need not exist yet)
+        priority: INTERACTIVE or BULK
+    """
+    held = _held.get()
+    found = await eventloop.run_blocking(lambda: {device_of(p) for p in paths})
+    devices = sorted(found - held)
+    start = time.monotonic()
+    acquired: list[int] = []
+    try:
+        with tracing.span("io_wait", priority=priority) as span:
+            # Fixed order, so two multi-device operations can't deadlock
+            for dev in devices:
+                await _devices.setdefault(dev, _Device()).acquire(priority)
+                acquired.append(dev)
+            waited = time.monotonic() - start
+            span["devices"] = len(devices)
+        if devices:
+            _waits[priority].append(waited)
+            metrics.IO_QUEUE_WAIT.observe(waited, priority=priority)
+        held_token = _held.set(held | set(devices))
+        priority_token = _priority.set(_priority.get() or priority)
+        try:
+            yield
+        finally:
+            _priority.reset(priority_token)
+            _held.reset(held_token)
+    finally:
+        for dev in acquired:
+            _devices[dev].release(priority)
+
+
+def wrap_command(cmd: list[str]) -> list[str]:
+    """Prefix a command with ionice when it runs for a bulk operation."""
+    if _priority.get() != BULK or not IONICE or not sys.platform.startswith("linux"):
+        return cmd
+    ionice = shutil.which("ionice")
+    if not ionice:
+        return cmd
+    return [ionice, "-c", "2", "-n", "7", *cmd]
+
+
+def _prepare_cgroup() -> bool:
+    global _cgroup_ready
+    if _cgroup_ready is None:
+        try:
+            Path(CGROUP, "io.weight").write_text(f"default {IO_WEIGHT}\n")
+            _cgroup_ready = True
+        except OSError as e:
+            logger.warning(f"Not using cgroup {CGROUP} for bulk I/O: {e}")
+            _cgroup_ready = False
+    return _cgroup_ready
+
+
+def assign_cgroup(pid: int) -> None:
+    """Move a process spawned for a bulk operation into the bulk I/O cgroup."""
+    if _priority.get() != BULK or not CGROUP or not _prepare_cgroup():
+        return
+    try:
+        Path(CGROUP, "cgroup.procs").write_text(f"{pid}\n")
+    except OSError as e:
+        # The process may already have exited
+        logger.debug(f"Could not move {pid} into {CGROUP}: {e}")
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def status() -> dict:
+    """Slots in use and queue waits, per device and priority."""
+    devices = [
+        {
+            "device": f"{os.major(dev)}:{os.minor(dev)}",
+            "active": dict(state.active),
+            "waiting": sum(1 for *_, f in state.waiters if not f.done()),
+        }
+        for dev, state in _devices.items()
+    ]
+    waits = {}
+    for priority, recent in _waits.items():
+        values = list(recent)
+        waits[priority] = {
+            "count": len(values),
+            "p50": round(_percentile(values, 0.5), 3) if values else None,
+            "p95": round(_percentile(values, 0.95), 3) if values else None,
+            "max": round(max(values), 3) if values else None,
+        }
+    return {
+        "slots_per_device": SLOTS_PER_DEVICE,
+        "interactive_reserve": INTERACTIVE_RESERVE,
+        "ionice": IONICE and bool(shutil.which("ionice")),
+        "cgroup": CGROUP,
+        "devices": devices,
+        "queue_wait": waits,
+    }
@@ -0,0 +1,160 @@
+"""
+Background jobs for long-running tools.
+
+Long operations (image convert, verify, fleet boot) run as managed
+asyncio tasks so the tool call returns a job id immediately. Clients poll
+progress, cancel or list jobs through the job tools. Finished jobs are
+kept for a bounded time and count.
+"""
+
+import asyncio
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from . import metrics, tracing
+
+
+MAX_FINISHED_JOBS = 100
+FINISHED_JOB_TTL = 3600  # seconds
+
+ACTIVE_STATES = ("pending", "running")
+
+_jobs: dict[str, "Job"] = {}
+_ids = itertools.count(1)
+
+
+class Job:
+    """A tool call running in the background."""
+
+    def __init__(self, tool: str, arguments: dict[str, Any]):
+        self.id = f"job-{next(_ids)}"
+        self.tool = tool
+        self.arguments = arguments
+        self.status = "pending"
+        self.progress: Optional[float] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[dict] = None
+        self.task: Optional[asyncio.Task] = None
+        self.trace_id: Optional[str] = None
+
+    def set_progress(self, fraction: float) -> None:
+        self.progress = round(min(max(fraction, 0.0), 1.0), 4)
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        info = {
+            "job_id": self.id,
+            "tool": self.tool,
+            "status": self.status,
+            "progress": self.progress,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "trace_id": self.trace_id,
+        }
+        if self.started:
+            info["elapsed"] = round((self.finished or time.time()) - self.started, 3)
+        if include_result:
+            info["arguments"] = self.arguments
+            if self.result is not None:
+                info["result"] = self.result
+            if self.error is not None:
+                info["error"] = self.error
+        return info
+
+    async def _run(self, func: Callable[[Callable[[float], None]], Awaitable[dict]]) -> None:
+        self.status = "running"
+        self.started = time.time()
+        # The task inherited the submitting call's trace; record its own
+        with tracing.trace(f"job:{self.tool}") as trace:
+            self.trace_id = trace.id
+            try:
+                self.result = await func(self.set_progress)
+                self.status = "succeeded"
+                self.progress = 1.0
+            except asyncio.CancelledError:
+                self.status = "cancelled"
+                trace.error = "CancelledError"
+            except Exception as e:
+                self.status = "failed"
+                self.error = {"error_type": type(e).__name__, "message": str(e)}
+                trace.error = type(e).__name__
+            finally:
+                self.finished = time.time()
+                metrics.JOB_DURATION.observe(
+                    self.finished - self.started, tool=self.tool, status=self.status
+                )
+
+
+def _prune() -> None:
+    """Drop finished jobs past the TTL, then the oldest beyond the cap."""
+    now = time.time()
+    finished = [j for j in _jobs.values() if j.status not in ACTIVE_STATES]
+    for job in finished:
+        if now - job.finished > FINISHED_JOB_TTL:
+            del _jobs[job.id]
+    finished = sorted(
+        (j for j in _jobs.values() if j.status not in ACTIVE_STATES),
+        key=lambda j: j.finished,
+    )
+    for job in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del _jobs[job.id]
+
+
+def submit(
+    tool: str,
+    arguments: dict[str, Any],
+    func: Callable[[Callable[[float], None]], Awaitable[dict]],
+) -> Job:
+    """
+    Start a job.
+
+    Args:
+        tool: Tool name, for listing
+        arguments: Tool arguments, for listing
+        func: Coroutine function taking a progress callback and returning
+            the tool result
+
+    Returns:
+        The new Job
+    """
+    _prune()
+    job = Job(tool, arguments)
+    _jobs[job.id] = job
+    job.task = asyncio.create_task(job._run(func), name=job.id)
+    return job
+
+
+def get(job_id: str) -> Job:
+    job = _jobs.get(job_id)
+    if job is None:
+        raise ValueError(f"Unknown job: {job_id}")
+    return job
+
+
+async def cancel(job_id: str) -> dict:
+    """Cancel a running job and wait for it to stop."""
+    job = get(job_id)
+    if job.status in ACTIVE_STATES and job.task is not None:
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+        if job.status == "pending":
+            # Cancelled before the task got to run
+            job.status = "cancelled"
+            job.finished = time.time()
+    return job.to_dict(include_result=False)
+
+
+def list_jobs(status: Optional[str] = None) -> dict:
+    """List known jobs, newest first."""
+    _prune()
+    jobs = sorted(_jobs.values(), key=lambda j: j.created, reverse=True)
+    if status:
+        jobs = [j for j in jobs if j.status == status]
+    return {
+        "jobs": [j.to_dict(include_result=False) for j in jobs],
+        "count": len(jobs),
+    }
@@ -0,0 +1,143 @@
+"""
+Memory density controls for test VMs.
+
+Provides virtio-balloon resizing through QMP and host-side KSM (Kernel
+Samepage Merging) status and control, so more identical idle guests fit
+on one host.
+"""
+
+import os
+from pathlib import Path
+from typing import Optional
+
+from . import qmp
+from .qemu_img import _format_size, _parse_size
+
+
+KSM_PATH = Path("/sys/kernel/mm/ksm")
+KSM_COUNTERS = [
+    "run",
+    "pages_shared",
+    "pages_sharing",
+    "pages_unshared",
+    "pages_volatile",
+    "full_scans",
+    "pages_to_scan",
+    "sleep_millisecs",
+]
+
+
+def balloon_args() -> list[str]:
+    """QEMU arguments for a virtio-balloon with free page reporting."""
+    # free-page-reporting hands pages the guest frees back to the host;
+    # deflate-on-oom lets the guest reclaim ballooned memory under pressure.
+    return [
+        "-device",
+        "virtio-balloon-pci,id=balloon0,free-page-reporting=on,deflate-on-oom=on",
+    ]
+
+
+async def balloon(ssh_port: int, target: Optional[str] = None) -> dict:
+    """
+    Query or resize a VM's memory balloon.
+
+    Args:
+        ssh_port: SSH port identifying the VM
+        target: New guest memory size (e.g. "2G"); query only if omitted
+
+    Returns:
+        Dictionary with the balloon's current guest memory size
+    """
+    result: dict = {"ssh_port": ssh_port}
+    if target is not None:
+        target_bytes = _parse_size(target)
+        await qmp.execute(ssh_port, "balloon", {"value": target_bytes})
+        result["target"] = target_bytes
+        result["target-human"] = _format_size(target_bytes)
+
+    info = await qmp.execute(ssh_port, "query-balloon")
+    result["actual"] = info["actual"]
+    result["actual-human"] = _format_size(info["actual"])
+    if target is not None:
+        result["note"] = "The guest driver resizes asynchronously; query again to see progress"
+    return result
+
+
+def process_pss(pid: int) -> Optional[int]:
+    """
+    Proportional set size of a process in bytes (Linux only).
+
+    PSS splits shared pages (including KSM-merged ones) between the
+    processes mapping them, so summing it across VMs gives real host usage.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (FileNotFoundError, PermissionError, ProcessLookupError):
+        return None
+    return None
+
+
+def ksm_status() -> dict:
+    """
+    Report host KSM state and how much memory it is saving.
+
+    Returns:
+        Dictionary with KSM counters and estimated bytes saved
+    """
+    if not KSM_PATH.exists():
+        return {"available": False, "message": "KSM not supported by this kernel"}
+
+    status: dict = {"available": True}
+    for counter in KSM_COUNTERS:
+        counter_file = KSM_PATH / counter
+        if counter_file.exists():
+            status[counter] = int(counter_file.read_text().strip())
+
+    status["enabled"] = status.get("run") == 1
+    # pages_sharing counts page mappings deduplicated onto a shared page
+    saved = status.get("pages_sharing", 0) * os.sysconf("SC_PAGE_SIZE")
+    status["bytes_saved"] = saved
+    status["bytes_saved-human"] = _format_size(saved)
+    return status
+
+
+def ksm_set(
+    enabled: bool,
+    pages_to_scan: Optional[int] = None,
+    sleep_millisecs: Optional[int] = None,
+) -> dict:
+    """
+    Enable or disable host KSM (requires root).
+
+    QEMU marks guest RAM as mergeable by default, so enabling KSM is all
+    that is needed for identical guests to share pages.
+
+    Args:
+        enabled: Turn KSM scanning on or off
+        pages_to_scan: Pages scanned per wake-up (higher merges faster)
+        sleep_millisecs: Delay between scans
+
+    Returns:
+        Dictionary with the resulting KSM status
+    """
+    if not KSM_PATH.exists():
+        raise RuntimeError("KSM not supported by this kernel")
+
+    settings = {"run": 1 if enabled else 0}
+    if pages_to_scan is not None:
+        settings["pages_to_scan"] = pages_to_scan
+    if sleep_millisecs is not None:
+        settings["sleep_millisecs"] = sleep_millisecs
+
+    for name, value in settings.items():
+        try:
+            (KSM_PATH / name).write_text(str(value))
+        except PermissionError:
+            raise PermissionError(
+                f"Permission denied writing {KSM_PATH / name} - KSM control requires root"
+            )
+
+    return {"success": True, **ksm_status()}
@@ -0,0 +1,262 @@
+"""
+Prometheus metrics for qemu-mcp.
+
+A small self-contained registry (no prometheus_client dependency) that
+renders the text exposition format. Metrics are exported either by
+writing a node_exporter textfile-collector file atomically, or by serving
+/metrics on a local HTTP port:
+
+    QEMU_MCP_METRICS_TEXTFILE=/var/lib/prometheus/node-exporter/qemu_mcp.prom
+    QEMU_MCP_METRICS_PORT=9105
+"""
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Callable, Optional
+
+
+logger = logging.getLogger("qemu-mcp")
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {v}"
+            for k, v in sorted(self._values.items())
+        ]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self._samples())
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Compute the (unlabelled) value when metrics are rendered."""
+        self._function = function
+
+    def _samples(self) -> list[str]:
+        if self._function is not None:
+            self._values[()] = self._function()
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1  # +Inf
+        self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels) -> int:
+        counts = self._counts.get(self._key(labels))
+        return counts[-1] if counts else 0
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, counts in sorted(self._counts.items()):
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {self._sums[key]}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+_registry: list[_Metric] = []
+
+
+TOOL_DURATION = Histogram(
+    "qemu_mcp_tool_duration_seconds", "Tool call latency", ("tool",)
+)
+TOOL_CALLS = Counter(
+    "qemu_mcp_tool_calls_total", "Tool calls by outcome", ("tool", "status")
+)
+JOB_DURATION = Histogram(
+    "qemu_mcp_job_duration_seconds", "Background job run time", ("tool", "status")
+)
+TOOL_ERRORS = Counter(
+    "qemu_mcp_tool_errors_total", "Tool call errors by exception type", ("tool", "error_type")
+)
+SUBPROCESS_SPAWNS = Counter(
+    "qemu_mcp_subprocess_spawns_total", "Subprocesses started", ("program",)
+)
+SUBPROCESS_DURATION = Histogram(
+    "qemu_mcp_subprocess_duration_seconds", "Subprocess wall time", ("program",)
+)
+BYTES_CONVERTED = Counter(
+    "qemu_mcp_bytes_converted_total", "Virtual bytes written by qemu-img convert"
+)
+BYTES_VERIFIED = Counter(
+    "qemu_mcp_bytes_verified_total", "Virtual bytes checked by image verify"
+)
+RESPONSE_BYTES = Histogram(
+    "qemu_mcp_response_bytes",
+    "Size of serialized tool responses",
+    ("tool",),
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+IO_QUEUE_WAIT = Histogram(
+    "qemu_mcp_io_queue_wait_seconds",
+    "Time disk-heavy operations waited for an I/O slot",
+    ("priority",),
+    buckets=(0.001, 0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 1800),
+)
+LOOP_LAG = Histogram(
+    "qemu_mcp_event_loop_lag_seconds",
+    "How late the event loop woke from a short sleep",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+LOOP_STALLS = Counter(
+    "qemu_mcp_event_loop_stalls_total", "Lag samples at or above QEMU_MCP_LOOP_LAG_MS"
+)
+CACHE_LOOKUPS = Counter(
+    "qemu_mcp_cache_lookups_total", "Result cache lookups (hit, miss, coalesced)", ("tool", "result")
+)
+RUNNING_VMS = Gauge(
+    "qemu_mcp_running_vms", "VMs started by this server that are still tracked"
+)
+LAST_UPDATE = Gauge(
+    "qemu_mcp_metrics_last_update_timestamp_seconds", "When these metrics were written"
+)
+
+
+def observe_subprocess(cmd: list[str], seconds: float) -> None:
+    """Record one finished subprocess."""
+    program = os.path.basename(cmd[0]) if cmd else "unknown"
+    SUBPROCESS_SPAWNS.inc(program=program)
+    SUBPROCESS_DURATION.observe(seconds, program=program)
+
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format."""
+    LAST_UPDATE.set(time.time())
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+def write_textfile(path: str) -> None:
+    """
+    Write metrics for node_exporter's textfile collector.
+
+    The file is written to a temporary name in the same directory and
+    renamed into place, so node_exporter never reads a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".qemu_mcp.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(render())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def export() -> None:
+    """Write the textfile if QEMU_MCP_METRICS_TEXTFILE is set."""
+    path = os.environ.get("QEMU_MCP_METRICS_TEXTFILE")
+    if not path:
+        return
+    try:
+        write_textfile(path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics textfile {path}: {e}")
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain headers
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = render().encode()
+            status = "200 OK"
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, status, content_type = b"Not Found\n", "404 Not Found", "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(port: int, host: str = "127.0.0.1") -> asyncio.AbstractServer:
+    """Serve /metrics on a local HTTP port."""
+    return await asyncio.start_server(_handle_http, host, port)
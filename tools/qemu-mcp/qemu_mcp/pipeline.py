@@ -0,0 +1,203 @@
+"""
+Run a dependency graph of tool calls in one request.
+
+A pipeline is a list of steps, each naming a tool and its arguments:
+
+    [
+        {"id": "overlay", "tool": "qemu_create_overlay",
+         "arguments": {"base_image": "base.qcow2", "overlay_path": "/tmp/t.qcow2"}},
+        {"id": "grow", "tool": "qemu_image_resize",
+         "arguments": {"image_path": "${overlay.overlay_path}", "size": "+10G"}},
+        {"id": "boot", "tool": "qemu_boot_vm",
+         "arguments": {"image_path": "${overlay.overlay_path}"}, "depends_on": ["grow"]},
+        {"id": "ssh", "tool": "qemu_wait_ssh",
+         "arguments": {"ssh_port": "${boot.ssh_port}"}}
+    ]
+
+"${step.key.subkey}" refers to an earlier step's result. A reference that
+is the whole argument keeps the value's type; one embedded in a longer
+string is substituted as text. References and depends_on both order
+steps. Steps without a path between them run concurrently. When a step
+fails, every step that depends on it is skipped, while independent
+branches carry on.
+"""
+
+import asyncio
+import re
+import time
+from typing import Any, Awaitable, Callable
+
+from . import tracing
+
+
+MAX_STEPS = 50
+
+_REF_RE = re.compile(r"\$\{([A-Za-z0-9_-]+)((?:\.[A-Za-z0-9_-]+)*)\}")
+
+Dispatch = Callable[[str, dict[str, Any]], Awaitable[dict]]
+
+
+def _references(value: Any) -> set[str]:
+    """Step ids referenced anywhere in an argument value."""
+    if isinstance(value, str):
+        return {m.group(1) for m in _REF_RE.finditer(value)}
+    if isinstance(value, list):
+        return set().union(*(_references(v) for v in value))
+    if isinstance(value, dict):
+        return set().union(*(_references(v) for v in value.values()))
+    return set()
+
+
+def _lookup(results: dict[str, dict], step_id: str, path: str) -> Any:
+    value: Any = results[step_id]
+    for part in filter(None, path.split(".")):
+        if isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        elif isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            raise ValueError(f"Reference ${{{step_id}{path}}}: no '{part}' in result")
+    return value
+
+
+def resolve(value: Any, results: dict[str, dict]) -> Any:
+    """Substitute ${step.path} references with values from earlier results."""
+    if isinstance(value, str):
+        whole = _REF_RE.fullmatch(value)
+        if whole:
+            return _lookup(results, whole.group(1), whole.group(2))
+        return _REF_RE.sub(lambda m: str(_lookup(results, m.group(1), m.group(2))), value)
+    if isinstance(value, list):
+        return [resolve(v, results) for v in value]
+    if isinstance(value, dict):
+        return {k: resolve(v, results) for k, v in value.items()}
+    return value
+
+
+def plan(steps: list[dict], tools: set[str]) -> dict[str, set[str]]:
+    """
+    Validate steps and return each step's dependencies.
+
+    Args:
+        steps: Pipeline steps
+        tools: Tool names a step may call
+
+    Returns:
+        Mapping of step id to the ids it depends on
+
+    Raises:
+        ValueError: Malformed steps, unknown tools or references, or a cycle
+    """
+    if not steps:
+        raise ValueError("Pipeline has no steps")
+    if len(steps) > MAX_STEPS:
+        raise ValueError(f"Pipeline has {len(steps)} steps; the limit is {MAX_STEPS}")
+
+    deps: dict[str, set[str]] = {}
+    for step in steps:
+        step_id = step.get("id")
+        if not isinstance(step_id, str) or not re.fullmatch(r"[A-Za-z0-9_-]+", step_id):
+            raise ValueError(f"Step id must be letters, digits, '_' or '-': {step_id!r}")
+        if step_id in deps:
+            raise ValueError(f"Duplicate step id: {step_id}")
+        if step.get("tool") not in tools:
+            raise ValueError(f"Step {step_id}: unknown or disallowed tool {step.get('tool')!r}")
+        arguments = step.get("arguments", {})
+        depends_on = step.get("depends_on", [])
+        if not isinstance(arguments, dict):
+            raise ValueError(f"Step {step_id}: arguments must be an object")
+        if not isinstance(depends_on, list):
+            raise ValueError(f"Step {step_id}: depends_on must be a list")
+        deps[step_id] = set(depends_on) | _references(arguments)
+
+    for step_id, needs in deps.items():
+        unknown = needs - set(deps)
+        if unknown:
+            raise ValueError(f"Step {step_id}: depends on unknown step(s) {sorted(unknown)}")
+
+    # Kahn's algorithm; anything left over is on a cycle
+    remaining = {s: set(d) for s, d in deps.items()}
+    while True:
+        ready = [s for s, d in remaining.items() if not d]
+        if not ready:
+            break
+        for s in ready:
+            del remaining[s]
+        for d in remaining.values():
+            d.difference_update(ready)
+    if remaining:
+        raise ValueError(f"Dependency cycle between steps {sorted(remaining)}")
+    return deps
+
+
+async def run(steps: list[dict], dispatch: Dispatch, tools: set[str]) -> dict:
+    """
+    Run a pipeline.
+
+    Args:
+        steps: Pipeline steps (id, tool, arguments, optional depends_on)
+        dispatch: Coroutine running one tool call and returning its result
+        tools: Tool names a step may call
+
+    Returns:
+        Dictionary with overall success, total duration and, per step,
+        status (succeeded, failed, skipped), start offset, duration and
+        result or error
+    """
+    deps = plan(steps, tools)
+    by_id = {step["id"]: step for step in steps}
+    results: dict[str, dict] = {}
+    report: dict[str, dict] = {}
+    tasks: dict[str, asyncio.Task] = {}
+    start = time.monotonic()
+
+    async def run_step(step_id: str) -> bool:
+        outcomes = await asyncio.gather(*(tasks[d] for d in deps[step_id]))
+        step = by_id[step_id]
+        entry: dict = {"tool": step["tool"]}
+        report[step_id] = entry
+        if not all(outcomes):
+            failed = sorted(d for d, ok in zip(deps[step_id], outcomes) if not ok)
+            entry["status"] = "skipped"
+            entry["reason"] = f"dependency failed or skipped: {', '.join(failed)}"
+            return False
+
+        began = time.monotonic()
+        entry["started"] = round(began - start, 3)
+        try:
+            with tracing.span("step", step=step_id, tool=step["tool"]):
+                arguments = resolve(step.get("arguments", {}), results)
+                results[step_id] = await dispatch(step["tool"], arguments)
+            entry["status"] = "succeeded"
+            entry["result"] = results[step_id]
+            return True
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = {"error_type": type(e).__name__, "message": str(e)}
+            return False
+        finally:
+            entry["duration"] = round(time.monotonic() - began, 3)
+
+    # Create tasks in dependency order so every task's dependencies exist
+    pending = dict(deps)
+    while pending:
+        for step_id in [s for s, d in pending.items() if d <= tasks.keys()]:
+            tasks[step_id] = asyncio.create_task(run_step(step_id))
+            del pending[step_id]
+
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    statuses = [entry["status"] for entry in report.values()]
+    return {
+        "success": all(s == "succeeded" for s in statuses),
+        "duration": round(time.monotonic() - start, 3),
+        "succeeded": statuses.count("succeeded"),
+        "failed": statuses.count("failed"),
+        "skipped": statuses.count("skipped"),
+        # Report steps in the order given
+        "steps": {step["id"]: report[step["id"]] for step in steps},
+    }
@@ -1,33 +1,130 @@
 """
 Wrapper functions for qemu-img commands.
 
-Provides disk image operations: info, convert, create overlay, resize.
+Provides disk image operations: info, map, convert, create overlay, resize,
+verify.
 """
 
 import asyncio
 import json
 import os
+import re
 import shutil
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
+
+from . import eventloop, io_governor, metrics, tracing
+
+# Called with completion as a fraction between 0.0 and 1.0
+ProgressCallback = Callable[[float], None]
+
+_PROGRESS_RE = re.compile(rb"\((\d+(?:\.\d+)?)/100%\)")
 
 
 async def run_command(cmd: list[str], timeout: int = 300) -> tuple[int, str, str]:
     """Run a command asynchronously and return (returncode, stdout, stderr)."""
-    process = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    try:
-        stdout, stderr = await asyncio.wait_for(
-            process.communicate(), timeout=timeout
+    with tracing.span("subprocess", program=os.path.basename(cmd[0])) as span:
+        start = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *io_governor.wrap_command(cmd),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        io_governor.assign_cgroup(process.pid)
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(), timeout=timeout
+            )
+            return process.returncode or 0, stdout.decode(), stderr.decode()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise TimeoutError(f"Command timed out after {timeout}s: {' '.join(cmd)}")
+        except asyncio.CancelledError:
+            # Don't leave the child running when the caller is cancelled
+            process.kill()
+            await process.wait()
+            raise
+        finally:
+            span["returncode"] = process.returncode
+            metrics.observe_subprocess(cmd, time.monotonic() - start)
+
+
+async def run_command_progress(
+    cmd: list[str],
+    progress: ProgressCallback,
+    timeout: int = 300,
+) -> tuple[int, str, str]:
+    """
+    Run a qemu-img command with -p and report its progress.
+
+    qemu-img prints "(NN.NN/100%)" updates separated by carriage returns;
+    each one is passed to the callback as a fraction.
+    """
+    with tracing.span("subprocess", program=os.path.basename(cmd[0])) as span:
+        start = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *io_governor.wrap_command(cmd),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
         )
-        return process.returncode or 0, stdout.decode(), stderr.decode()
-    except asyncio.TimeoutError:
-        process.kill()
-        await process.wait()
-        raise TimeoutError(f"Command timed out after {timeout}s: {' '.join(cmd)}")
+        io_governor.assign_cgroup(process.pid)
+
+        async def read_stdout() -> bytes:
+            output = b""
+            pending = b""
+            while chunk := await process.stdout.read(4096):
+                output += chunk
+                *lines, pending = re.split(rb"[\r\n]", pending + chunk)
+                for line in lines:
+                    match = _PROGRESS_RE.search(line)
+                    if match:
+                        progress(float(match.group(1)) / 100)
+            return output
+
+        async def communicate() -> tuple[bytes, bytes]:
+            stdout, stderr = await asyncio.gather(read_stdout(), process.stderr.read())
+            await process.wait()
+            return stdout, stderr
+
+        try:
+            stdout, stderr = await asyncio.wait_for(communicate(), timeout=timeout)
+            return process.returncode or 0, stdout.decode(), stderr.decode()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise TimeoutError(f"Command timed out after {timeout}s: {' '.join(cmd)}")
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        finally:
+            span["returncode"] = process.returncode
+            metrics.observe_subprocess(cmd, time.monotonic() - start)
+
+
+def _resolve(path: str) -> tuple[Path, bool]:
+    resolved = Path(path).expanduser().resolve()
+    return resolved, resolved.exists()
+
+
+async def _stat_path(path: str) -> tuple[Path, bool]:
+    """Resolve a user-supplied path and check whether it exists."""
+    with tracing.span("file", op="stat", path=path):
+        return await eventloop.run_blocking(_resolve, path)
+
+
+async def _mkdir(path: Path) -> None:
+    """Create a directory and its parents off the event loop."""
+    with tracing.span("file", op="mkdir", path=str(path)):
+        await eventloop.run_blocking(path.mkdir, parents=True, exist_ok=True)
+
+
+async def _remove_partial(path: Path) -> None:
+    """Delete a partially written output file, if any."""
+    with tracing.span("file", op="unlink", path=str(path)):
+        await eventloop.run_blocking(path.unlink, missing_ok=True)
 
 
 def get_qemu_img_path() -> str:
@@ -40,37 +137,81 @@ def get_qemu_img_path() -> str:
     return path
 
 
-async def image_info(image_path: str) -> dict:
+async def image_info(image_path: str, backing_chain: bool = False) -> dict:
     """
     Get detailed information about a disk image.
 
     Args:
         image_path: Path to the disk image
+        backing_chain: Also report every image in the backing chain
 
     Returns:
         Dictionary with image info (format, virtual-size, actual-size, etc.)
     """
-    path = Path(image_path).expanduser().resolve()
-    if not path.exists():
+    path, exists = await _stat_path(image_path)
+    if not exists:
         raise FileNotFoundError(f"Image not found: {image_path}")
 
     qemu_img = get_qemu_img_path()
-    returncode, stdout, stderr = await run_command([
-        qemu_img, "info", "--output=json", str(path)
-    ])
+    cmd = [qemu_img, "info", "--output=json"]
+    if backing_chain:
+        cmd.append("--backing-chain")
+    async with io_governor.slot([str(path)], io_governor.INTERACTIVE):
+        returncode, stdout, stderr = await run_command(cmd + [str(path)])
 
     if returncode != 0:
         raise RuntimeError(f"qemu-img info failed: {stderr}")
 
-    info = json.loads(stdout)
+    # --backing-chain prints a list, top image first
+    chain = json.loads(stdout)
+    if not backing_chain:
+        chain = [chain]
+
+    for info in chain:
+        # Add human-readable sizes
+        if "virtual-size" in info:
+            info["virtual-size-human"] = _format_size(info["virtual-size"])
+        if "actual-size" in info:
+            info["actual-size-human"] = _format_size(info["actual-size"])
+
+    info = chain[0]
+    if backing_chain:
+        info["backing-chain"] = chain[1:]
+    return info
+
 
-    # Add human-readable sizes
-    if "virtual-size" in info:
-        info["virtual-size-human"] = _format_size(info["virtual-size"])
-    if "actual-size" in info:
-        info["actual-size-human"] = _format_size(info["actual-size"])
+async def image_map(image_path: str) -> dict:
+    """
+    Get the allocation map of a disk image.
 
-    return info
+    Args:
+        image_path: Path to the disk image
+
+    Returns:
+        Dictionary with extents (start, length, depth, data, zero, offset)
+        and the number of bytes allocated with data
+    """
+    path, exists = await _stat_path(image_path)
+    if not exists:
+        raise FileNotFoundError(f"Image not found: {image_path}")
+
+    qemu_img = get_qemu_img_path()
+    async with io_governor.slot([str(path)], io_governor.INTERACTIVE):
+        returncode, stdout, stderr = await run_command(
+            [qemu_img, "map", "--output=json", str(path)], timeout=600
+        )
+    if returncode != 0:
+        raise RuntimeError(f"qemu-img map failed: {stderr}")
+
+    extents = json.loads(stdout)
+    allocated = sum(e["length"] for e in extents if e.get("data"))
+    return {
+        "image_path": str(path),
+        "extents": extents,
+        "count": len(extents),
+        "allocated": allocated,
+        "allocated-human": _format_size(allocated),
+    }
 
 
 async def image_convert(
@@ -79,6 +220,7 @@ async def image_convert(
     output_format: str,
     input_format: Optional[str] = None,
     compress: bool = False,
+    progress: Optional[ProgressCallback] = None,
 ) -> dict:
     """
     Convert a disk image to a different format.
@@ -89,21 +231,22 @@ async def image_convert(
         output_format: Target format (raw, qcow2, vmdk, vdi, vhdx)
         input_format: Source format (auto-detected if not specified)
         compress: Enable compression (for qcow2)
+        progress: Called with completion fraction as the conversion runs
 
     Returns:
         Dictionary with conversion results
     """
-    src = Path(input_path).expanduser().resolve()
-    dst = Path(output_path).expanduser().resolve()
+    src, src_exists = await _stat_path(input_path)
+    dst, dst_exists = await _stat_path(output_path)
 
-    if not src.exists():
+    if not src_exists:
         raise FileNotFoundError(f"Source image not found: {input_path}")
 
-    if dst.exists():
+    if dst_exists:
         raise FileExistsError(f"Output path already exists: {output_path}")
 
     # Ensure output directory exists
-    dst.parent.mkdir(parents=True, exist_ok=True)
+    await _mkdir(dst.parent)
 
     valid_formats = {"raw", "qcow2", "vmdk", "vdi", "vhdx", "vpc"}
     if output_format not in valid_formats:
@@ -120,18 +263,29 @@ async def image_convert(
     if compress and output_format == "qcow2":
         cmd.append("-c")
 
+    if progress:
+        cmd.append("-p")
+
     cmd.extend([str(src), str(dst)])
 
-    returncode, stdout, stderr = await run_command(cmd, timeout=3600)  # 1 hour timeout for large images
+    try:
+        async with io_governor.slot([str(src), str(dst)], io_governor.BULK):
+            if progress:
+                returncode, stdout, stderr = await run_command_progress(cmd, progress, timeout=3600)
+            else:
+                returncode, stdout, stderr = await run_command(cmd, timeout=3600)  # 1 hour timeout for large images
+    except asyncio.CancelledError:
+        await _remove_partial(dst)
+        raise
 
     if returncode != 0:
         # Clean up partial output
-        if dst.exists():
-            dst.unlink()
+        await _remove_partial(dst)
         raise RuntimeError(f"qemu-img convert failed: {stderr}")
 
     # Get info about the new image
     new_info = await image_info(str(dst))
+    metrics.BYTES_CONVERTED.inc(new_info.get("virtual-size", 0))
 
     return {
         "success": True,
@@ -156,17 +310,17 @@ async def create_overlay(base_image: str, overlay_path: str) -> dict:
     Returns:
         Dictionary with overlay creation results
     """
-    base = Path(base_image).expanduser().resolve()
-    overlay = Path(overlay_path).expanduser().resolve()
+    base, base_exists = await _stat_path(base_image)
+    overlay, overlay_exists = await _stat_path(overlay_path)
 
-    if not base.exists():
+    if not base_exists:
         raise FileNotFoundError(f"Base image not found: {base_image}")
 
-    if overlay.exists():
+    if overlay_exists:
         raise FileExistsError(f"Overlay path already exists: {overlay_path}")
 
     # Ensure output directory exists
-    overlay.parent.mkdir(parents=True, exist_ok=True)
+    await _mkdir(overlay.parent)
 
     # Get base image info
     base_info = await image_info(str(base))
@@ -181,7 +335,8 @@ async def create_overlay(base_image: str, overlay_path: str) -> dict:
         str(overlay),
     ]
 
-    returncode, stdout, stderr = await run_command(cmd)
+    async with io_governor.slot([str(base), str(overlay)], io_governor.INTERACTIVE):
+        returncode, stdout, stderr = await run_command(cmd)
 
     if returncode != 0:
         raise RuntimeError(f"qemu-img create overlay failed: {stderr}")
@@ -206,9 +361,9 @@ async def image_resize(image_path: str, size: str) -> dict:
     Returns:
         Dictionary with resize results
     """
-    path = Path(image_path).expanduser().resolve()
+    path, exists = await _stat_path(image_path)
 
-    if not path.exists():
+    if not exists:
         raise FileNotFoundError(f"Image not found: {image_path}")
 
     # Validate size format
@@ -223,7 +378,8 @@ async def image_resize(image_path: str, size: str) -> dict:
     qemu_img = get_qemu_img_path()
     cmd = [qemu_img, "resize", str(path), size]
 
-    returncode, stdout, stderr = await run_command(cmd)
+    async with io_governor.slot([str(path)], io_governor.INTERACTIVE):
+        returncode, stdout, stderr = await run_command(cmd)
 
     if returncode != 0:
         raise RuntimeError(f"qemu-img resize failed: {stderr}")
@@ -239,6 +395,81 @@ async def image_resize(image_path: str, size: str) -> dict:
     }
 
 
+async def image_verify(
+    image_path: str,
+    compare_to: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> dict:
+    """
+    Verify a disk image.
+
+    Runs `qemu-img check` for formats that support it and, if compare_to
+    is given, `qemu-img compare` to confirm both images have identical
+    guest-visible contents (e.g. after a conversion).
+
+    Args:
+        image_path: Path to the disk image
+        compare_to: Optional second image whose contents must match
+        progress: Called with completion fraction during the compare
+
+    Returns:
+        Dictionary with check and compare results
+    """
+    path, exists = await _stat_path(image_path)
+    if not exists:
+        raise FileNotFoundError(f"Image not found: {image_path}")
+
+    info = await image_info(str(path))
+    qemu_img = get_qemu_img_path()
+    result = {
+        "image_path": str(path),
+        "format": info.get("format"),
+        "virtual_size": info.get("virtual-size"),
+    }
+
+    if info.get("format") == "raw":
+        result["check"] = {"skipped": "raw images have no metadata to check"}
+    else:
+        async with io_governor.slot([str(path)], io_governor.BULK):
+            returncode, stdout, stderr = await run_command(
+                [qemu_img, "check", "--output=json", str(path)], timeout=3600
+            )
+        # Exit 0: clean, 2: corruptions, 3: leaks only (see qemu-img(1))
+        if returncode not in (0, 2, 3):
+            raise RuntimeError(f"qemu-img check failed: {stderr}")
+        check = json.loads(stdout) if stdout.strip() else {}
+        check["clean"] = returncode in (0, 3) and not check.get("corruptions")
+        result["check"] = check
+
+    if compare_to:
+        other, other_exists = await _stat_path(compare_to)
+        if not other_exists:
+            raise FileNotFoundError(f"Comparison image not found: {compare_to}")
+        cmd = [qemu_img, "compare"]
+        if progress:
+            cmd.append("-p")
+        cmd.extend([str(path), str(other)])
+        async with io_governor.slot([str(path), str(other)], io_governor.BULK):
+            if progress:
+                returncode, stdout, stderr = await run_command_progress(cmd, progress, timeout=3600)
+            else:
+                returncode, stdout, stderr = await run_command(cmd, timeout=3600)
+        # Exit 0: identical, 1: different, other: error
+        if returncode not in (0, 1):
+            raise RuntimeError(f"qemu-img compare failed: {stderr}")
+        result["compare"] = {
+            "compare_to": str(other),
+            "identical": returncode == 0,
+            "detail": re.split(r"[\r\n]", stdout.strip())[-1],
+        }
+
+    metrics.BYTES_VERIFIED.inc(info.get("virtual-size", 0))
+    result["success"] = result["check"].get("clean", True) and result.get(
+        "compare", {}
+    ).get("identical", True)
+    return result
+
+
 def _format_size(size_bytes: int) -> str:
     """Format bytes as human-readable string."""
     for unit in ["B", "KB", "MB", "GB", "TB"]:
@@ -248,6 +479,17 @@ def _format_size(size_bytes: int) -> str:
     return f"{size_bytes:.1f} PB"
 
 
+def _parse_size(size: str) -> int:
+    """Parse an absolute size like '4G' or '512M' into bytes."""
+    import re
+    match = re.match(r'^(\d+(?:\.\d+)?)([KMGTkmgt]?)$', size.strip())
+    if not match:
+        raise ValueError(f"Invalid size format: {size}. Use formats like '4G', '512M'")
+    number, unit = match.groups()
+    multiplier = 1024 ** "BKMGT".index(unit.upper() or "B")
+    return int(float(number) * multiplier)
+
+
 def _validate_size_string(size: str) -> bool:
     """Validate a size string like '100G', '+10G', '-5G'."""
     import re
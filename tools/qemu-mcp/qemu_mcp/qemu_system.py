@@ -5,18 +5,47 @@ Provides VM operations: boot, list, stop, status.
 """
 
 import asyncio
+import functools
+import hashlib
+import json
 import os
 import platform
 import shutil
 import signal
-import socket
+import time
 from pathlib import Path
 from typing import Optional
 
+from . import eventloop, guest_agent, io_governor, metrics, qmp, ssh_session, tracing
+from .memory import balloon_args
+from .qemu_img import ProgressCallback, _stat_path, create_overlay, run_command
+
 
 # Track spawned VMs by SSH port
 _running_vms: dict[int, int] = {}  # ssh_port -> pid
 
+# Drive cache/AIO settings selectable per boot
+IO_PROFILES: dict[str, str] = {
+    "default": "",
+    "writeback": ",cache=writeback",
+    "nocache": ",cache=none,aio=threads",
+    "native": ",cache=none,aio=native",
+    "io_uring": ",cache=none,aio=io_uring",
+}
+
+# Common OVMF locations, checked in order
+OVMF_PATHS = [
+    "/opt/homebrew/share/qemu/edk2-x86_64-code.fd",  # macOS arm64 homebrew
+    "/usr/local/share/qemu/edk2-x86_64-code.fd",    # macOS x86 homebrew
+    "/usr/share/OVMF/OVMF_CODE.fd",                  # Debian/Ubuntu
+    "/usr/share/edk2/ovmf/OVMF_CODE.fd",            # Fedora/RHEL
+]
+
+# Where kernels extracted for direct boot are kept between calls
+KERNEL_CACHE_DIR = Path(
+    os.environ.get("QEMU_MCP_KERNEL_CACHE", "~/.cache/qemu-mcp/kernels")
+).expanduser()
+
 
 def get_qemu_system_path() -> str:
     """Find qemu-system-x86_64 executable."""
@@ -43,10 +72,137 @@ def detect_accelerator() -> str:
     return "tcg"
 
 
-def is_port_in_use(port: int) -> bool:
-    """Check if a TCP port is in use."""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(("127.0.0.1", port)) == 0
+@functools.lru_cache(maxsize=1)
+def find_firmware() -> Optional[str]:
+    """
+    Locate OVMF firmware once and cache the result.
+
+    QEMU_MCP_FIRMWARE overrides the search; an empty value disables UEFI
+    firmware and leaves QEMU on its default BIOS.
+    """
+    override = os.environ.get("QEMU_MCP_FIRMWARE")
+    if override is not None:
+        if not override:
+            return None
+        if not os.path.exists(override):
+            raise FileNotFoundError(f"QEMU_MCP_FIRMWARE not found: {override}")
+        return override
+    for ovmf in OVMF_PATHS:
+        if os.path.exists(ovmf):
+            return ovmf
+    return None
+
+
+def _parse_grub_cmdline(grub_cfg: str) -> Optional[str]:
+    """Return the kernel arguments of the first linux entry in grub.cfg."""
+    for line in grub_cfg.splitlines():
+        parts = line.strip().split()
+        if len(parts) >= 2 and parts[0] in ("linux", "linuxefi"):
+            return " ".join(parts[2:])
+    return None
+
+
+async def extract_boot_files(image_path: str) -> dict:
+    """
+    Extract kernel, initrd and kernel command line from a disk image.
+
+    Uses libguestfs (virt-get-kernel, virt-cat). Results are cached under
+    KERNEL_CACHE_DIR keyed by image path, size and mtime, so repeated test
+    boots of the same image skip extraction.
+
+    Args:
+        image_path: Path to the disk image
+
+    Returns:
+        Dictionary with kernel, initrd and append
+    """
+    path, exists = await _stat_path(image_path)
+    if not exists:
+        raise FileNotFoundError(f"Image not found: {image_path}")
+
+    with tracing.span("file", op="read", path=str(KERNEL_CACHE_DIR)):
+        cache, meta = await eventloop.run_blocking(_read_boot_cache, path)
+        if meta is not None:
+            return meta
+
+    get_kernel = shutil.which("virt-get-kernel")
+    if not get_kernel:
+        raise FileNotFoundError(
+            "virt-get-kernel not found. Install libguestfs-tools or pass kernel/initrd explicitly"
+        )
+
+    await eventloop.run_blocking(cache.mkdir, parents=True, exist_ok=True)
+    async with io_governor.slot([str(path)], io_governor.INTERACTIVE):
+        returncode, stdout, stderr = await run_command(
+            [get_kernel, "--add", str(path), "--output", str(cache)], timeout=600
+        )
+    if returncode != 0:
+        raise RuntimeError(f"virt-get-kernel failed: {stderr}")
+
+    kernel, initrd = await eventloop.run_blocking(
+        lambda: tuple(next(iter(sorted(cache.glob(p))), None) for p in ("vmlinuz*", "initrd*"))
+    )
+    if kernel is None:
+        raise RuntimeError(f"No kernel found in {image_path}")
+
+    append = None
+    virt_cat = shutil.which("virt-cat")
+    if virt_cat:
+        for cfg in ("/boot/grub/grub.cfg", "/boot/grub2/grub.cfg"):
+            async with io_governor.slot([str(path)], io_governor.INTERACTIVE):
+                returncode, stdout, _ = await run_command(
+                    [virt_cat, "-a", str(path), cfg], timeout=300
+                )
+            if returncode == 0:
+                append = _parse_grub_cmdline(stdout)
+                break
+    append = append or "root=/dev/vda1 ro"
+    if "console=" not in append:
+        append += " console=ttyS0"
+
+    meta = {
+        "kernel": str(kernel),
+        "initrd": str(initrd) if initrd else None,
+        "append": append,
+    }
+    await eventloop.run_blocking((cache / "boot.json").write_text, json.dumps(meta))
+    return meta
+
+
+def _read_boot_cache(image: Path) -> tuple[Path, Optional[dict]]:
+    """Cache directory for an image's boot files, and its metadata if present."""
+    st = image.stat()
+    key = hashlib.sha256(f"{image}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:16]
+    cache = KERNEL_CACHE_DIR / key
+    meta_file = cache / "boot.json"
+    if not meta_file.exists():
+        return cache, None
+    return cache, json.loads(meta_file.read_text())
+
+
+def _read_text(path: Path) -> Optional[str]:
+    try:
+        return path.read_text()
+    except FileNotFoundError:
+        return None
+
+
+async def _read_pid_file(ssh_port: int) -> Optional[int]:
+    """PID written by QEMU's -pidfile for a VM, or None if there is none."""
+    pid_file = Path(f"/tmp/qemu-vm-{ssh_port}.pid")
+    with tracing.span("file", op="read", path=str(pid_file)):
+        text = await eventloop.run_blocking(_read_text, pid_file)
+        return int(text.strip()) if text is not None else None
+
+
+async def is_port_in_use(port: int, timeout: float = 1.0) -> bool:
+    """Check if something accepts connections on a local TCP port."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
 
 
 async def boot_vm(
@@ -56,6 +212,18 @@ async def boot_vm(
     ssh_port: int = 2222,
     background: bool = True,
     extra_args: Optional[list[str]] = None,
+    accelerator: Optional[str] = None,
+    disk_format: str = "qcow2",
+    io_profile: str = "default",
+    snapshot: bool = False,
+    serial_log: Optional[str] = None,
+    firmware: Optional[str] = None,
+    direct_boot: bool = False,
+    kernel: Optional[str] = None,
+    initrd: Optional[str] = None,
+    append: Optional[str] = None,
+    enable_guest_agent: bool = True,
+    balloon: bool = False,
 ) -> dict:
     """
     Boot a disk image in QEMU for testing.
@@ -67,22 +235,50 @@ async def boot_vm(
         ssh_port: Host port to forward to guest SSH (port 22)
         background: Run in background (True) or foreground (False)
         extra_args: Additional QEMU arguments
+        accelerator: Force an accelerator (kvm, hvf, tcg) instead of auto-detecting
+        disk_format: Format of the disk image (qcow2, raw)
+        io_profile: Drive cache/AIO profile, one of IO_PROFILES
+        snapshot: Discard guest writes on exit (keeps the image unmodified)
+        serial_log: Write the guest serial console to this file
+        firmware: UEFI firmware path (default: cached OVMF discovery)
+        direct_boot: Boot the kernel directly with -kernel/-initrd/-append,
+            skipping firmware and the guest bootloader. The kernel is
+            extracted from the image unless given.
+        kernel: Kernel to boot directly (implies direct_boot)
+        initrd: Initrd for direct boot
+        append: Kernel command line for direct boot
+        enable_guest_agent: Attach a virtio-serial qemu-ga channel so
+            commands and file copies can bypass SSH
+        balloon: Attach a virtio-balloon with free page reporting so guest
+            memory can be reclaimed by the host and resized via QMP
 
     Returns:
         Dictionary with VM boot info
     """
-    path = Path(image_path).expanduser().resolve()
-    if not path.exists():
+    path, exists = await _stat_path(image_path)
+    if not exists:
         raise FileNotFoundError(f"Image not found: {image_path}")
 
     # Check if port is already in use
-    if is_port_in_use(ssh_port):
+    if await is_port_in_use(ssh_port):
         raise RuntimeError(
             f"Port {ssh_port} is already in use. Choose a different ssh_port or stop the existing VM."
         )
 
+    if io_profile not in IO_PROFILES:
+        raise ValueError(f"Invalid io_profile '{io_profile}'. Valid: {set(IO_PROFILES)}")
+
     qemu = get_qemu_system_path()
-    accel = detect_accelerator()
+    accel = accelerator or detect_accelerator()
+
+    drive = f"file={path},format={disk_format},if=virtio{IO_PROFILES[io_profile]}"
+    if snapshot:
+        drive += ",snapshot=on"
+
+    if serial_log:
+        serial = f"file:{serial_log}"
+    else:
+        serial = "mon:stdio" if not background else "null"
 
     cmd = [
         qemu,
@@ -90,25 +286,41 @@ async def boot_vm(
         "-cpu", "host" if accel in ("kvm", "hvf") else "qemu64",
         "-m", memory,
         "-smp", str(cpus),
-        "-drive", f"file={path},format=qcow2,if=virtio",
+        "-drive", drive,
         "-netdev", f"user,id=net0,hostfwd=tcp::{ssh_port}-:22",
         "-device", "virtio-net-pci,netdev=net0",
         "-display", "none",
-        "-serial", "mon:stdio" if not background else "null",
+        "-serial", serial,
     ]
 
-    # Add UEFI firmware for modern images
-    # Check common locations for OVMF
-    ovmf_paths = [
-        "/opt/homebrew/share/qemu/edk2-x86_64-code.fd",  # macOS arm64 homebrew
-        "/usr/local/share/qemu/edk2-x86_64-code.fd",    # macOS x86 homebrew
-        "/usr/share/OVMF/OVMF_CODE.fd",                  # Debian/Ubuntu
-        "/usr/share/edk2/ovmf/OVMF_CODE.fd",            # Fedora/RHEL
-    ]
-    for ovmf in ovmf_paths:
-        if os.path.exists(ovmf):
-            cmd.extend(["-bios", ovmf])
-            break
+    if kernel or direct_boot:
+        # Direct kernel boot: no firmware, no GRUB
+        if not kernel:
+            boot_files = await extract_boot_files(str(path))
+            kernel = boot_files["kernel"]
+            initrd = initrd or boot_files["initrd"]
+            append = append or boot_files["append"]
+        cmd.extend(["-kernel", kernel])
+        if initrd:
+            cmd.extend(["-initrd", initrd])
+        cmd.extend(["-append", append or "root=/dev/vda1 ro console=ttyS0"])
+        boot_mode = "direct"
+    else:
+        # Add UEFI firmware for modern images
+        if firmware and not await eventloop.run_blocking(os.path.exists, firmware):
+            raise FileNotFoundError(f"Firmware not found: {firmware}")
+        firmware = firmware or find_firmware()
+        if firmware:
+            cmd.extend(["-bios", firmware])
+        boot_mode = "firmware"
+
+    cmd.extend(qmp.qemu_args(ssh_port))
+
+    if enable_guest_agent:
+        cmd.extend(guest_agent.qemu_args(ssh_port))
+
+    if balloon:
+        cmd.extend(balloon_args())
 
     if extra_args:
         cmd.extend(extra_args)
@@ -117,23 +329,26 @@ async def boot_vm(
         # Daemonize by running without stdin/stdout connection
         cmd.extend(["-daemonize", "-pidfile", f"/tmp/qemu-vm-{ssh_port}.pid"])
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        _, stderr = await process.communicate()
+        start = time.monotonic()
+        # Staggers boot storms: QEMU opens and probes the disk before daemonizing
+        async with io_governor.slot([str(path)], io_governor.INTERACTIVE):
+            with tracing.span("subprocess", program=os.path.basename(qemu)) as span:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await process.communicate()
+                span["returncode"] = process.returncode
+        metrics.observe_subprocess(cmd, time.monotonic() - start)
 
         if process.returncode != 0:
             raise RuntimeError(f"Failed to start VM: {stderr.decode()}")
 
         # Read PID from file
-        pid_file = Path(f"/tmp/qemu-vm-{ssh_port}.pid")
-        if pid_file.exists():
-            pid = int(pid_file.read_text().strip())
+        pid = await _read_pid_file(ssh_port)
+        if pid is not None:
             _running_vms[ssh_port] = pid
-        else:
-            pid = None
 
         return {
             "success": True,
@@ -141,9 +356,12 @@ async def boot_vm(
             "pid": pid,
             "ssh_port": ssh_port,
             "accelerator": accel,
+            "boot_mode": boot_mode,
             "memory": memory,
+            "balloon": balloon,
             "cpus": cpus,
             "ssh_command": f"ssh -p {ssh_port} vaultadmin@localhost",
+            "guest_agent_socket": guest_agent.socket_path(ssh_port) if enable_guest_agent else None,
             "note": "VM booting in background. Wait ~30-60s for SSH to become available.",
         }
     else:
@@ -156,6 +374,73 @@ async def boot_vm(
         }
 
 
+async def boot_fleet(
+    base_image: str,
+    count: int,
+    overlay_dir: str,
+    first_port: int = 2222,
+    memory: str = "4G",
+    cpus: int = 2,
+    progress: Optional[ProgressCallback] = None,
+    **boot_args,
+) -> dict:
+    """
+    Boot several test VMs from one base image.
+
+    Each VM gets its own copy-on-write overlay and consecutive SSH ports
+    starting at first_port. Ports already in use are skipped.
+
+    Args:
+        base_image: Backing image shared by all VMs (not modified)
+        count: Number of VMs to boot
+        overlay_dir: Directory for the per-VM overlays
+        first_port: First SSH port to try
+        memory: RAM per VM
+        cpus: CPU cores per VM
+        progress: Called with the fraction of VMs booted so far
+        **boot_args: Passed through to boot_vm
+
+    Returns:
+        Dictionary with the booted VMs and any failures
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+
+    base, exists = await _stat_path(base_image)
+    if not exists:
+        raise FileNotFoundError(f"Base image not found: {base_image}")
+
+    ports = []
+    port = first_port
+    while len(ports) < count:
+        if not await is_port_in_use(port) and port not in _running_vms:
+            ports.append(port)
+        port += 1
+
+    done = 0
+
+    async def boot_one(ssh_port: int) -> dict:
+        nonlocal done
+        overlay = Path(overlay_dir).expanduser() / f"{base.stem}-{ssh_port}.qcow2"
+        try:
+            await create_overlay(str(base), str(overlay))
+            vm = await boot_vm(str(overlay), memory=memory, cpus=cpus, ssh_port=ssh_port, **boot_args)
+        except Exception as e:
+            vm = {"success": False, "ssh_port": ssh_port, "error": f"{type(e).__name__}: {e}"}
+        done += 1
+        if progress:
+            progress(done / count)
+        return vm
+
+    vms = await asyncio.gather(*(boot_one(p) for p in ports))
+    return {
+        "success": all(vm.get("success") for vm in vms),
+        "base_image": str(base),
+        "count": count,
+        "vms": list(vms),
+    }
+
+
 async def list_vms() -> dict:
     """
     List running QEMU VMs.
@@ -163,23 +448,13 @@ async def list_vms() -> dict:
     Returns:
         Dictionary with list of running VMs
     """
-    import subprocess
-
     # Find QEMU processes
     try:
-        result = subprocess.run(
-            ["pgrep", "-fl", "qemu-system"],
-            capture_output=True,
-            text=True,
-        )
+        returncode, stdout, _ = await run_command(["pgrep", "-fl", "qemu-system"], timeout=30)
     except FileNotFoundError:
         # pgrep not available, try ps
-        result = subprocess.run(
-            ["ps", "aux"],
-            capture_output=True,
-            text=True,
-        )
-        lines = [l for l in result.stdout.split("\n") if "qemu-system" in l and "grep" not in l]
+        _, stdout, _ = await run_command(["ps", "aux"], timeout=30)
+        lines = [l for l in stdout.split("\n") if "qemu-system" in l and "grep" not in l]
         processes = []
         for line in lines:
             parts = line.split()
@@ -194,11 +469,11 @@ async def list_vms() -> dict:
                 })
         return {"vms": processes, "count": len(processes)}
 
-    if result.returncode != 0 and not result.stdout:
+    if returncode != 0 and not stdout:
         return {"vms": [], "count": 0}
 
     processes = []
-    for line in result.stdout.strip().split("\n"):
+    for line in stdout.strip().split("\n"):
         if not line:
             continue
         parts = line.split(maxsplit=1)
@@ -215,6 +490,14 @@ async def list_vms() -> dict:
     return {"vms": processes, "count": len(processes)}
 
 
+def _remove_files(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
 def _extract_ssh_port(cmd: str) -> Optional[int]:
     """Extract SSH port from QEMU command line."""
     import re
@@ -240,12 +523,10 @@ async def stop_vm(pid: Optional[int] = None, ssh_port: Optional[int] = None) ->
 
     # If ssh_port provided, find PID from pid file
     if pid is None and ssh_port is not None:
-        pid_file = Path(f"/tmp/qemu-vm-{ssh_port}.pid")
-        if pid_file.exists():
-            pid = int(pid_file.read_text().strip())
-        elif ssh_port in _running_vms:
+        pid = await _read_pid_file(ssh_port)
+        if pid is None and ssh_port in _running_vms:
             pid = _running_vms[ssh_port]
-        else:
+        elif pid is None:
             # Try to find from process list
             vms = await list_vms()
             for vm in vms.get("vms", []):
@@ -270,11 +551,15 @@ async def stop_vm(pid: Optional[int] = None, ssh_port: Optional[int] = None) ->
         except ProcessLookupError:
             pass  # Process already terminated
 
-        # Clean up PID file
+        # Clean up PID file and guest agent connection
         if ssh_port:
-            pid_file = Path(f"/tmp/qemu-vm-{ssh_port}.pid")
-            if pid_file.exists():
-                pid_file.unlink()
+            await guest_agent.close_agent(ssh_port)
+            await ssh_session.close_session(ssh_port)
+            pid_file = f"/tmp/qemu-vm-{ssh_port}.pid"
+            with tracing.span("file", op="unlink", path=pid_file):
+                await eventloop.run_blocking(
+                    _remove_files, [pid_file, guest_agent.socket_path(ssh_port), qmp.socket_path(ssh_port)]
+                )
             if ssh_port in _running_vms:
                 del _running_vms[ssh_port]
 
@@ -318,39 +603,28 @@ async def vm_status(ssh_port: int, timeout: int = 5) -> dict:
     }
 
     # Check if port is open
-    result["port_open"] = is_port_in_use(ssh_port)
+    result["port_open"] = await is_port_in_use(ssh_port)
 
     # Check if QEMU process exists
-    pid_file = Path(f"/tmp/qemu-vm-{ssh_port}.pid")
-    if pid_file.exists():
-        try:
-            pid = int(pid_file.read_text().strip())
+    try:
+        pid = await _read_pid_file(ssh_port)
+        if pid is not None:
             os.kill(pid, 0)  # Check if process exists
             result["process_running"] = True
             result["pid"] = pid
-        except (ProcessLookupError, ValueError):
-            result["process_running"] = False
+    except (ProcessLookupError, ValueError):
+        result["process_running"] = False
 
-    # Try SSH connection test
+    # Try SSH connection test over the multiplexed session
     if result["port_open"]:
         try:
-            proc = await asyncio.create_subprocess_exec(
-                "ssh",
-                "-o", "StrictHostKeyChecking=no",
-                "-o", "UserKnownHostsFile=/dev/null",
-                "-o", f"ConnectTimeout={timeout}",
-                "-o", "BatchMode=yes",
-                "-p", str(ssh_port),
-                "localhost",
-                "echo", "ok",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.DEVNULL,
-            )
-            stdout, _ = await asyncio.wait_for(
-                proc.communicate(), timeout=timeout + 2
+            probe = await ssh_session.run(
+                ssh_port, "echo ok", timeout=timeout + 2, connect_timeout=timeout
             )
-            result["ssh_accessible"] = proc.returncode == 0
-        except (asyncio.TimeoutError, FileNotFoundError):
+            result["ssh_accessible"] = probe["exitcode"] == 0
+            result["ssh_latency"] = probe["duration"]
+            result["ssh_connection_reused"] = probe["reused"]
+        except (TimeoutError, ConnectionError, FileNotFoundError):
             result["ssh_accessible"] = False
 
     # Determine overall status
@@ -368,3 +642,28 @@ async def vm_status(ssh_port: int, timeout: int = 5) -> dict:
         result["message"] = "No VM found on this port"
 
     return result
+
+
+async def wait_for_ssh(ssh_port: int, timeout: int = 300, interval: float = 2) -> dict:
+    """
+    Wait until a booting VM accepts SSH.
+
+    Args:
+        ssh_port: SSH port of the VM
+        timeout: Seconds to wait before giving up
+        interval: Seconds between checks
+
+    Returns:
+        The final vm_status result plus how long the wait took
+    """
+    start = time.monotonic()
+    while True:
+        status = await vm_status(ssh_port)
+        if status["ssh_accessible"]:
+            status["waited"] = round(time.monotonic() - start, 3)
+            return status
+        if status["status"] == "stopped":
+            raise RuntimeError(f"No VM running on port {ssh_port}")
+        if time.monotonic() - start + interval > timeout:
+            raise TimeoutError(f"SSH on port {ssh_port} not ready after {timeout}s")
+        await asyncio.sleep(interval)
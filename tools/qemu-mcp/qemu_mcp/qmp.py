@@ -0,0 +1,78 @@
+"""
+Minimal QMP (QEMU Machine Protocol) client.
+
+boot_vm exposes a QMP monitor for each VM on a unix socket. QEMU serves
+one QMP client per socket at a time, so connections are opened per call
+rather than pooled (unlike the guest agent channel).
+"""
+
+import asyncio
+import json
+import os
+from typing import Any, Optional
+
+
+class QMPError(RuntimeError):
+    """Error returned by the QEMU monitor."""
+
+
+def socket_path(ssh_port: int) -> str:
+    """Host-side unix socket for the QMP monitor of a VM."""
+    return f"/tmp/qemu-vm-{ssh_port}.qmp"
+
+
+def qemu_args(ssh_port: int) -> list[str]:
+    """QEMU arguments that expose a QMP monitor socket."""
+    return ["-qmp", f"unix:{socket_path(ssh_port)},server=on,wait=off"]
+
+
+async def execute(
+    ssh_port: int,
+    command: str,
+    arguments: Optional[dict] = None,
+    timeout: float = 10,
+) -> Any:
+    """
+    Run one QMP command against a VM and return its result.
+
+    Args:
+        ssh_port: SSH port identifying the VM
+        command: QMP command name (e.g. "query-balloon")
+        arguments: Command arguments
+        timeout: Seconds to wait for each reply
+
+    Returns:
+        The "return" value of the command
+    """
+    path = socket_path(ssh_port)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"QMP socket not found: {path}. Is the VM running?")
+
+    reader, writer = await asyncio.open_unix_connection(path)
+
+    async def reply() -> Any:
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=timeout)
+            if not line:
+                raise ConnectionError("QMP connection closed")
+            message = json.loads(line)
+            if "event" in message or "QMP" in message:
+                continue  # asynchronous events and the greeting
+            if "error" in message:
+                error = message["error"]
+                raise QMPError(f"{error.get('class')}: {error.get('desc')}")
+            return message.get("return")
+
+    async def send(name: str, args: Optional[dict] = None) -> Any:
+        request = {"execute": name}
+        if args:
+            request["arguments"] = args
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        return await reply()
+
+    try:
+        await send("qmp_capabilities")
+        return await send(command, arguments)
+    finally:
+        writer.close()
@@ -0,0 +1,236 @@
+"""
+Declarative tool registry.
+
+Each MCP tool is declared once as a ToolSpec: its schema properties (with
+defaults), required arguments and handler. The argument validator is
+compiled from the schema when the spec is created, so each call only runs
+a list of precomputed checks before the handler is looked up by name.
+
+Handlers may be given as "module:function" strings relative to this
+package; the module is imported on first use so the server starts without
+loading every tool's implementation.
+
+Read-only tools may declare a cache TTL and the cache tags they read;
+mutating tools declare the tags they write (see cache.py).
+"""
+
+import importlib
+import inspect
+from typing import Any, Callable, Iterable, Optional, Union
+
+from . import cache
+from .responses import DEFAULT_PAGE_SIZE, OPTION_NAMES
+
+
+_TYPE_CHECKS: dict[str, Callable[[Any], bool]] = {
+    "string": lambda v: isinstance(v, str),
+    # bool is a subclass of int; JSON booleans are not integers
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "array": lambda v: isinstance(v, list),
+    "object": lambda v: isinstance(v, dict),
+}
+
+# Properties every job-backed tool accepts
+WAIT_PROPERTY = {
+    "type": "boolean",
+    "description": "Wait for completion instead of returning a job id",
+    "default": False,
+}
+
+FIELDS_PROPERTY = {
+    "type": "array",
+    "items": {"type": "string"},
+    "description": "Only return these fields (of each item, for list results)",
+}
+
+# Properties every list-style tool accepts
+PAGE_PROPERTIES = {
+    "cursor": {
+        "type": "string",
+        "description": "next_cursor from the previous page",
+    },
+    "limit": {
+        "type": "integer",
+        "description": "Maximum items per page",
+        "default": DEFAULT_PAGE_SIZE,
+    },
+}
+
+
+def _compile_property(tool: str, name: str, schema: dict) -> Callable[[Any], None]:
+    """Build a checker for one property that raises ValueError on bad input."""
+    type_name = schema.get("type")
+    check_type = _TYPE_CHECKS[type_name] if type_name else None
+    enum = frozenset(schema["enum"]) if "enum" in schema else None
+    item_type = schema.get("items", {}).get("type")
+    check_item = _TYPE_CHECKS[item_type] if item_type else None
+
+    def check(value: Any) -> None:
+        if check_type is not None and not check_type(value):
+            raise ValueError(
+                f"{tool}: argument '{name}' must be {type_name}, got {type(value).__name__}"
+            )
+        if enum is not None and value not in enum:
+            raise ValueError(
+                f"{tool}: argument '{name}' must be one of {sorted(enum)}, got {value!r}"
+            )
+        if check_item is not None and not all(check_item(v) for v in value):
+            raise ValueError(f"{tool}: every item of '{name}' must be {item_type}")
+
+    return check
+
+
+class ToolSpec:
+    """One tool: schema, defaults and handler, declared together."""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        handler: Union[str, Callable[..., Any]],
+        properties: Optional[dict[str, dict]] = None,
+        required: tuple[str, ...] = (),
+        job: bool = False,
+        fields: bool = False,
+        list_key: Optional[str] = None,
+        page_key: Optional[Callable[[dict], Any]] = None,
+        descending: bool = False,
+        cache_ttl: Optional[float] = None,
+        reads: Optional[Callable[[dict], Iterable[tuple]]] = None,
+        writes: Optional[Callable[[dict], Iterable[tuple]]] = None,
+    ):
+        """
+        Args:
+            name: Tool name
+            description: Tool description shown to the client
+            handler: Callable, or "module:function" imported on first call.
+                It is called with the validated arguments as keywords.
+            properties: JSON schema properties; "default" values are applied
+                before the handler is called
+            required: Names of required properties
+            job: Run as a background job unless wait=true; the handler also
+                receives a progress callback
+            fields: Accept a fields argument selecting top-level result keys
+            list_key: Result key holding the items of a list-style tool,
+                which then accepts fields, cursor and limit
+            page_key: Sort key of an item, used for the page cursor
+            descending: Page items largest key first
+            cache_ttl: Cache results for this many seconds (read-only tools)
+            reads: Cache tags a cached result depends on, from the arguments
+            writes: Cache tags invalidated before and after each call
+        """
+        self.name = name
+        self.description = description
+        self.properties = dict(properties or {})
+        if job:
+            self.properties["wait"] = WAIT_PROPERTY
+        if fields or list_key:
+            self.properties["fields"] = FIELDS_PROPERTY
+        if list_key:
+            if page_key is None:
+                raise ValueError(f"{name}: list_key requires page_key")
+            self.properties.update(PAGE_PROPERTIES)
+        self.list_key = list_key
+        self.page_key = page_key
+        self.descending = descending
+        self.required = tuple(required)
+        self.job = job
+        self._handler = handler
+        if cache_ttl and writes:
+            raise ValueError(f"{name}: a cached tool cannot also write")
+        self.cache_ttl = cache_ttl
+        self.reads = reads or (lambda arguments: ())
+        self.writes = writes
+
+        unknown = set(self.required) - set(self.properties)
+        if unknown:
+            raise ValueError(f"{name}: required arguments not in schema: {sorted(unknown)}")
+        self._checks = {
+            prop: _compile_property(name, prop, schema)
+            for prop, schema in self.properties.items()
+        }
+        self._defaults = {
+            prop: schema["default"]
+            for prop, schema in self.properties.items()
+            if "default" in schema
+        }
+
+    @property
+    def input_schema(self) -> dict:
+        schema: dict = {"type": "object", "properties": self.properties}
+        if self.required:
+            schema["required"] = list(self.required)
+        return schema
+
+    def validate(self, arguments: Optional[dict[str, Any]]) -> dict[str, Any]:
+        """
+        Check arguments against the schema and fill in defaults.
+
+        Returns:
+            A new dict with defaults applied
+
+        Raises:
+            ValueError: Missing, unknown or mistyped arguments
+        """
+        arguments = arguments or {}
+        missing = [r for r in self.required if r not in arguments]
+        if missing:
+            raise ValueError(f"{self.name}: missing required argument(s): {', '.join(missing)}")
+        unknown = [a for a in arguments if a not in self._checks]
+        if unknown:
+            raise ValueError(
+                f"{self.name}: unknown argument(s): {', '.join(unknown)}. "
+                f"Valid: {', '.join(self._checks)}"
+            )
+        for arg, value in arguments.items():
+            self._checks[arg](value)
+        return {**self._defaults, **arguments}
+
+    def split_options(self, arguments: dict[str, Any]) -> tuple[dict, dict]:
+        """Separate response options (fields, cursor, limit) from handler arguments."""
+        options = {k: v for k, v in arguments.items() if k in OPTION_NAMES}
+        return {k: v for k, v in arguments.items() if k not in OPTION_NAMES}, options
+
+    @property
+    def handler(self) -> Callable[..., Any]:
+        """The handler callable, importing its module on first access."""
+        if isinstance(self._handler, str):
+            module_name, _, func_name = self._handler.partition(":")
+            module = importlib.import_module(f"{__package__}.{module_name}")
+            self._handler = getattr(module, func_name)
+        return self._handler
+
+    async def _invoke(self, arguments: dict[str, Any], **extra) -> Any:
+        result = self.handler(**arguments, **extra)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def call(self, arguments: dict[str, Any], **extra) -> Any:
+        """Call the handler with validated arguments through the result cache."""
+        if self.cache_ttl and cache.ENABLED:
+            return await cache.RESULTS.get(
+                self.name, arguments, self.cache_ttl, self.reads(arguments),
+                lambda: self._invoke(arguments, **extra),
+            )
+        if self.writes is None:
+            return await self._invoke(arguments, **extra)
+        tags = list(self.writes(arguments))
+        cache.RESULTS.invalidate(tags)
+        try:
+            return await self._invoke(arguments, **extra)
+        finally:
+            # Also drop anything read while the mutation was running
+            cache.RESULTS.invalidate(tags)
+
+
+def build(specs: list[ToolSpec]) -> dict[str, ToolSpec]:
+    """Index specs by name, rejecting duplicates."""
+    registry: dict[str, ToolSpec] = {}
+    for spec in specs:
+        if spec.name in registry:
+            raise ValueError(f"Duplicate tool: {spec.name}")
+        registry[spec.name] = spec
+    return registry
@@ -0,0 +1,167 @@
+"""
+Response shaping for tool results.
+
+Results are serialized as compact JSON unless QEMU_MCP_OUTPUT=pretty.
+List-style tools return one page of items at a time with an opaque cursor
+for the next page, tools can be asked for a subset of fields, and every
+response is capped at QEMU_MCP_MAX_RESPONSE_BYTES. Over the cap, list
+pages are shortened (with a cursor to continue) and other results drop
+their trailing fields, so the client always gets valid JSON.
+"""
+
+import base64
+import binascii
+import json
+import os
+from typing import Any, Callable, Optional
+
+
+PRETTY = os.environ.get("QEMU_MCP_OUTPUT", "compact") == "pretty"
+MAX_RESPONSE_BYTES = int(os.environ.get("QEMU_MCP_MAX_RESPONSE_BYTES", "100000"))
+DEFAULT_PAGE_SIZE = 50
+
+# Arguments consumed here rather than passed to tool handlers
+OPTION_NAMES = ("fields", "cursor", "limit")
+
+
+def dumps(result: Any) -> str:
+    if PRETTY:
+        return json.dumps(result, indent=2)
+    return json.dumps(result, separators=(",", ":"))
+
+
+def _size(value: Any) -> int:
+    return len(dumps(value).encode())
+
+
+def encode_cursor(key: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def select_fields(record: dict, fields: Optional[list[str]]) -> dict:
+    """Keep only the named top-level keys of a record."""
+    if not fields:
+        return record
+    return {k: v for k, v in record.items() if k in fields}
+
+
+def paginate(
+    items: list[dict],
+    page_key: Callable[[dict], Any],
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    descending: bool = False,
+) -> tuple[list[dict], Optional[str]]:
+    """
+    Return one page of items and the cursor for the next page.
+
+    The cursor encodes the sort key of the last item returned, so pages
+    stay consistent when items are added or removed between calls.
+
+    Args:
+        items: All items
+        page_key: Sort key for an item (a JSON scalar)
+        cursor: Cursor from the previous page, or None for the first
+        limit: Maximum items per page
+        descending: Sort newest/largest first
+
+    Returns:
+        (page, next_cursor); next_cursor is None on the last page
+    """
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    ordered = sorted(items, key=page_key, reverse=descending)
+    if cursor is not None:
+        last = decode_cursor(cursor)
+        if descending:
+            ordered = [i for i in ordered if page_key(i) < last]
+        else:
+            ordered = [i for i in ordered if page_key(i) > last]
+    page = ordered[:limit]
+    next_cursor = encode_cursor(page_key(page[-1])) if len(ordered) > limit else None
+    return page, next_cursor
+
+
+def shape(
+    result: dict,
+    list_key: Optional[str] = None,
+    page_key: Optional[Callable[[dict], Any]] = None,
+    descending: bool = False,
+    fields: Optional[list[str]] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    max_bytes: Optional[int] = None,
+) -> dict:
+    """
+    Apply pagination and field selection to a tool result.
+
+    For list-style results, fields apply to each item and the page is
+    shortened to fit max_bytes, with next_cursor pointing after the last
+    item kept. For other results, fields apply to the top-level keys.
+    """
+    max_bytes = max_bytes or MAX_RESPONSE_BYTES
+    items = result.get(list_key) if list_key else None
+    if not isinstance(items, list) or page_key is None:
+        return select_fields(result, fields)
+
+    page, next_cursor = paginate(items, page_key, cursor, limit, descending)
+    keys = [page_key(item) for item in page]
+    page = [select_fields(item, fields) for item in page]
+    shaped = {**result, list_key: page, "count": len(page), "total": len(items), "next_cursor": next_cursor}
+
+    # Trim the page to the size cap. Item sizes are summed rather than
+    # re-serializing the whole page for each candidate length.
+    base = _size({**shaped, list_key: []})
+    budget = max_bytes - base
+    kept = 0
+    for item in page:
+        budget -= _size(item) + 1  # separator
+        if budget < 0:
+            break
+        kept += 1
+    if kept < len(page):
+        shaped[list_key] = page[:kept]
+        shaped["count"] = kept
+        shaped["truncated"] = True
+        if kept:
+            shaped["next_cursor"] = encode_cursor(keys[kept - 1])
+        else:
+            # Retry the same page with fewer fields
+            shaped["next_cursor"] = cursor
+            shaped["message"] = "A single item exceeds the response size cap; select fewer fields"
+    return shaped
+
+
+def render(result: Any, max_bytes: Optional[int] = None) -> str:
+    """
+    Serialize a result, dropping trailing top-level fields over the cap.
+
+    List results are normally trimmed by shape() first; this is the
+    fallback for everything else.
+    """
+    max_bytes = max_bytes or MAX_RESPONSE_BYTES
+    text = dumps(result)
+    if len(text.encode()) <= max_bytes or not isinstance(result, dict):
+        return text
+
+    note = {
+        "truncated": True,
+        "message": f"Response exceeded {max_bytes} bytes; use fields to select fewer",
+        "omitted_fields": [],
+    }
+    kept: dict = {}
+    for key, value in result.items():
+        candidate = {**kept, key: value}
+        # The omitted field names themselves can overshoot the cap slightly
+        if _size({**candidate, **note}) <= max_bytes:
+            kept = candidate
+        else:
+            note["omitted_fields"].append(key)
+    return dumps({**kept, **note})
@@ -6,16 +6,20 @@ and VM operations. Enables Claude Code to manage test VMs and
 automate bare metal deployment workflows.
 """
 
+import argparse
 import asyncio
-import json
+import functools
 import logging
-from typing import Any
+import os
+import sys
+import time
+from typing import Any, Optional
 
 from mcp.server import Server
-from mcp.server.stdio import stdio_server
 from mcp.types import TextContent, Tool
 
-from . import qemu_img, qemu_system
+from . import cache, jobs, metrics, responses, tracing
+from .registry import ToolSpec, build
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,173 +28,599 @@ logger = logging.getLogger("qemu-mcp")
 # Create MCP server instance
 server = Server("qemu-mcp")
 
+# Seconds between metrics textfile rewrites (picks up finished jobs)
+METRICS_INTERVAL = 15
+
+# Tool calls running at once; further calls queue. Mostly matters when one
+# HTTP server is shared by many clients.
+MAX_CONCURRENT_CALLS = int(os.environ.get("QEMU_MCP_MAX_CONCURRENT_CALLS", "16"))
+_call_slots: Optional[asyncio.Semaphore] = None
+
+# Seconds read-only results are cached. Images only change through the
+# mutating tools (which invalidate) or outside the server; VM state moves on
+# its own while booting.
+IMAGE_CACHE_TTL = 10
+VM_CACHE_TTL = 2
+
+
+def _running_vm_count() -> int:
+    # qemu_system is imported on first use; no VMs were started before that
+    module = sys.modules.get(f"{__package__}.qemu_system")
+    return len(module._running_vms) if module else 0
+
+
+metrics.RUNNING_VMS.set_function(_running_vm_count)
+
+
+# Handlers whose arguments don't map one-to-one onto a module function
+
+async def _ssh_exec(
+    ssh_port: int,
+    commands: list[str],
+    user: str,
+    timeout: int,
+    reuse: bool,
+    compare_reuse: bool,
+) -> dict:
+    from . import ssh_session
+
+    result = await ssh_session.ssh_exec(
+        ssh_port=ssh_port, commands=commands, user=user, timeout=timeout, reuse=reuse,
+    )
+    if compare_reuse:
+        # Time a no-op: the caller's commands may have side effects and
+        # would be re-run 10 more times
+        result["latency"] = await ssh_session.compare_reuse(ssh_port=ssh_port, user=user)
+    return result
+
+
+def _ksm(
+    action: str,
+    pages_to_scan: Optional[int] = None,
+    sleep_millisecs: Optional[int] = None,
+) -> dict:
+    from . import memory
+
+    if action == "status":
+        return memory.ksm_status()
+    return memory.ksm_set(
+        enabled=action == "enable",
+        pages_to_scan=pages_to_scan,
+        sleep_millisecs=sleep_millisecs,
+    )
+
+
+def _job_status(job_id: str) -> dict:
+    return jobs.get(job_id).to_dict()
+
+
+def _trace_list(tool: Optional[str] = None) -> dict:
+    return tracing.recent(limit=tracing.RECENT_TRACES, name=tool)
+
+
+async def _pipeline(steps: list[dict]) -> dict:
+    from . import pipeline
+
+    async def dispatch(tool: str, arguments: dict[str, Any]) -> dict:
+        # Long operations run inline so later steps can use their results
+        if REGISTRY[tool].job:
+            arguments = {"wait": True, **arguments}
+        return await _dispatch_tool(tool, arguments)
+
+    return await pipeline.run(steps, dispatch, set(REGISTRY) - {"qemu_pipeline"})
+
+
+def _id_number(item_id: str) -> int:
+    """Sequence number of a "job-N" / "trace-N" id, for paging newest first."""
+    return int(item_id.rsplit("-", 1)[1])
+
 
 # Tool definitions
 TOOLS = [
     # Image operations
-    Tool(
+    ToolSpec(
         name="qemu_image_info",
         description="Get detailed information about a disk image including format, virtual size, actual size, and backing file info.",
-        inputSchema={
-            "type": "object",
-            "properties": {
-                "image_path": {
-                    "type": "string",
-                    "description": "Path to the disk image file",
-                }
-            },
-            "required": ["image_path"],
+        handler="qemu_img:image_info",
+        cache_ttl=IMAGE_CACHE_TTL,
+        reads=lambda args: [cache.image(args["image_path"])],
+        fields=True,
+        properties={
+            "image_path": {
+                "type": "string",
+                "description": "Path to the disk image file",
+            },
+            "backing_chain": {
+                "type": "boolean",
+                "description": "Also report every image in the backing chain",
+                "default": False,
+            },
         },
+        required=("image_path",),
     ),
-    Tool(
+    ToolSpec(
+        name="qemu_image_map",
+        description="Show which ranges of a disk image are allocated, zero or backed by another image (qemu-img map). Paginated.",
+        handler="qemu_img:image_map",
+        cache_ttl=IMAGE_CACHE_TTL,
+        reads=lambda args: [cache.image(args["image_path"])],
+        list_key="extents",
+        page_key=lambda extent: extent["start"],
+        properties={
+            "image_path": {
+                "type": "string",
+                "description": "Path to the disk image",
+            },
+        },
+        required=("image_path",),
+    ),
+    ToolSpec(
         name="qemu_image_convert",
-        description="Convert a disk image between formats (raw, qcow2, vmdk, vdi, vhdx). Useful for preparing images for different hypervisors.",
-        inputSchema={
-            "type": "object",
-            "properties": {
-                "input_path": {
-                    "type": "string",
-                    "description": "Path to the source image",
-                },
-                "output_path": {
-                    "type": "string",
-                    "description": "Path for the output image",
-                },
-                "output_format": {
-                    "type": "string",
-                    "description": "Target format: raw, qcow2, vmdk, vdi, vhdx",
-                    "enum": ["raw", "qcow2", "vmdk", "vdi", "vhdx"],
-                },
-                "input_format": {
-                    "type": "string",
-                    "description": "Source format (auto-detected if not specified)",
-                },
-                "compress": {
-                    "type": "boolean",
-                    "description": "Enable compression (only for qcow2 output)",
-                    "default": False,
-                },
-            },
-            "required": ["input_path", "output_path", "output_format"],
+        description="Convert a disk image between formats (raw, qcow2, vmdk, vdi, vhdx). Useful for preparing images for different hypervisors. Runs as a background job unless wait=true.",
+        handler="qemu_img:image_convert",
+        writes=lambda args: [cache.image(args["output_path"])],
+        job=True,
+        properties={
+            "input_path": {
+                "type": "string",
+                "description": "Path to the source image",
+            },
+            "output_path": {
+                "type": "string",
+                "description": "Path for the output image",
+            },
+            "output_format": {
+                "type": "string",
+                "description": "Target format: raw, qcow2, vmdk, vdi, vhdx",
+                "enum": ["raw", "qcow2", "vmdk", "vdi", "vhdx"],
+            },
+            "input_format": {
+                "type": "string",
+                "description": "Source format (auto-detected if not specified)",
+            },
+            "compress": {
+                "type": "boolean",
+                "description": "Enable compression (only for qcow2 output)",
+                "default": False,
+            },
         },
+        required=("input_path", "output_path", "output_format"),
     ),
-    Tool(
+    ToolSpec(
+        name="qemu_image_verify",
+        description="Verify a disk image with qemu-img check, optionally comparing its contents against another image (e.g. after conversion). Runs as a background job unless wait=true.",
+        handler="qemu_img:image_verify",
+        job=True,
+        properties={
+            "image_path": {
+                "type": "string",
+                "description": "Path to the disk image",
+            },
+            "compare_to": {
+                "type": "string",
+                "description": "Image whose guest-visible contents must match",
+            },
+        },
+        required=("image_path",),
+    ),
+    ToolSpec(
         name="qemu_create_overlay",
         description="Create a copy-on-write overlay image backed by a base image. Changes go to the overlay without modifying the original - perfect for testing.",
-        inputSchema={
-            "type": "object",
-            "properties": {
-                "base_image": {
-                    "type": "string",
-                    "description": "Path to the backing image (will not be modified)",
-                },
-                "overlay_path": {
-                    "type": "string",
-                    "description": "Path for the new overlay image",
-                },
-            },
-            "required": ["base_image", "overlay_path"],
+        handler="qemu_img:create_overlay",
+        writes=lambda args: [cache.image(args["overlay_path"])],
+        properties={
+            "base_image": {
+                "type": "string",
+                "description": "Path to the backing image (will not be modified)",
+            },
+            "overlay_path": {
+                "type": "string",
+                "description": "Path for the new overlay image",
+            },
         },
+        required=("base_image", "overlay_path"),
     ),
-    Tool(
+    ToolSpec(
         name="qemu_image_resize",
         description="Resize a disk image. Use +/- prefix for relative sizing.",
-        inputSchema={
-            "type": "object",
-            "properties": {
-                "image_path": {
-                    "type": "string",
-                    "description": "Path to the disk image",
-                },
-                "size": {
-                    "type": "string",
-                    "description": "New size (e.g., '100G', '+10G', '-5G')",
-                },
-            },
-            "required": ["image_path", "size"],
+        handler="qemu_img:image_resize",
+        writes=lambda args: [cache.image(args["image_path"])],
+        properties={
+            "image_path": {
+                "type": "string",
+                "description": "Path to the disk image",
+            },
+            "size": {
+                "type": "string",
+                "description": "New size (e.g., '100G', '+10G', '-5G')",
+            },
         },
+        required=("image_path", "size"),
     ),
     # VM operations
-    Tool(
+    ToolSpec(
         name="qemu_boot_vm",
         description="Boot a disk image in QEMU for testing. Automatically detects and uses the best available accelerator (KVM/HVF/TCG).",
-        inputSchema={
-            "type": "object",
-            "properties": {
-                "image_path": {
-                    "type": "string",
-                    "description": "Path to the disk image to boot",
-                },
-                "memory": {
-                    "type": "string",
-                    "description": "RAM allocation (e.g., '4G', '8192M')",
-                    "default": "4G",
-                },
-                "cpus": {
-                    "type": "integer",
-                    "description": "Number of CPU cores",
-                    "default": 2,
-                },
-                "ssh_port": {
-                    "type": "integer",
-                    "description": "Host port to forward to guest SSH (port 22)",
-                    "default": 2222,
-                },
-                "background": {
-                    "type": "boolean",
-                    "description": "Run in background (true) or return command for manual execution (false)",
-                    "default": True,
-                },
-            },
-            "required": ["image_path"],
+        handler="qemu_system:boot_vm",
+        writes=lambda args: [cache.VMS],
+        properties={
+            "image_path": {
+                "type": "string",
+                "description": "Path to the disk image to boot",
+            },
+            "memory": {
+                "type": "string",
+                "description": "RAM allocation (e.g., '4G', '8192M')",
+                "default": "4G",
+            },
+            "cpus": {
+                "type": "integer",
+                "description": "Number of CPU cores",
+                "default": 2,
+            },
+            "ssh_port": {
+                "type": "integer",
+                "description": "Host port to forward to guest SSH (port 22)",
+                "default": 2222,
+            },
+            "background": {
+                "type": "boolean",
+                "description": "Run in background (true) or return command for manual execution (false)",
+                "default": True,
+            },
+            "firmware": {
+                "type": "string",
+                "description": "UEFI firmware path (auto-detected OVMF if not specified)",
+            },
+            "direct_boot": {
+                "type": "boolean",
+                "description": "Boot the kernel directly, skipping firmware and GRUB. Kernel/initrd/cmdline are extracted from the image unless given.",
+                "default": False,
+            },
+            "kernel": {
+                "type": "string",
+                "description": "Kernel image for direct boot",
+            },
+            "initrd": {
+                "type": "string",
+                "description": "Initrd for direct boot",
+            },
+            "append": {
+                "type": "string",
+                "description": "Kernel command line for direct boot",
+            },
+            "enable_guest_agent": {
+                "type": "boolean",
+                "description": "Attach a qemu-guest-agent channel for qemu_vm_exec/qemu_vm_copy",
+                "default": True,
+            },
+            "balloon": {
+                "type": "boolean",
+                "description": "Attach a virtio-balloon with free page reporting (resize with qemu_vm_balloon)",
+                "default": False,
+            },
         },
+        required=("image_path",),
     ),
-    Tool(
-        name="qemu_list_vms",
-        description="List all running QEMU virtual machines with their PIDs and SSH ports.",
-        inputSchema={
-            "type": "object",
-            "properties": {},
+    ToolSpec(
+        name="qemu_boot_fleet",
+        description="Boot several test VMs from one base image, each on its own overlay and SSH port. Runs as a background job unless wait=true.",
+        handler="qemu_system:boot_fleet",
+        writes=lambda args: [cache.VMS],
+        job=True,
+        properties={
+            "base_image": {
+                "type": "string",
+                "description": "Backing image shared by all VMs (not modified)",
+            },
+            "count": {
+                "type": "integer",
+                "description": "Number of VMs to boot",
+            },
+            "overlay_dir": {
+                "type": "string",
+                "description": "Directory for the per-VM overlays",
+            },
+            "first_port": {
+                "type": "integer",
+                "description": "First SSH port (ports in use are skipped)",
+                "default": 2222,
+            },
+            "memory": {
+                "type": "string",
+                "description": "RAM per VM",
+                "default": "4G",
+            },
+            "cpus": {
+                "type": "integer",
+                "description": "CPU cores per VM",
+                "default": 2,
+            },
         },
+        required=("base_image", "count", "overlay_dir"),
+    ),
+    ToolSpec(
+        name="qemu_list_vms",
+        description="List all running QEMU virtual machines with their PIDs and SSH ports. Paginated.",
+        handler="qemu_system:list_vms",
+        cache_ttl=VM_CACHE_TTL,
+        reads=lambda args: [cache.VMS],
+        list_key="vms",
+        page_key=lambda vm: vm["pid"],
     ),
-    Tool(
+    ToolSpec(
         name="qemu_stop_vm",
         description="Stop a running QEMU VM by PID or SSH port.",
-        inputSchema={
-            "type": "object",
-            "properties": {
-                "pid": {
-                    "type": "integer",
-                    "description": "Process ID of the VM to stop",
-                },
-                "ssh_port": {
-                    "type": "integer",
-                    "description": "SSH port of the VM to stop (alternative to pid)",
-                },
+        handler="qemu_system:stop_vm",
+        writes=lambda args: [cache.VMS],
+        properties={
+            "pid": {
+                "type": "integer",
+                "description": "Process ID of the VM to stop",
+            },
+            "ssh_port": {
+                "type": "integer",
+                "description": "SSH port of the VM to stop (alternative to pid)",
             },
         },
     ),
-    Tool(
+    ToolSpec(
         name="qemu_vm_status",
         description="Check if a VM is running and whether SSH is accessible.",
-        inputSchema={
-            "type": "object",
-            "properties": {
-                "ssh_port": {
-                    "type": "integer",
-                    "description": "SSH port to check",
-                },
-            },
-            "required": ["ssh_port"],
+        handler="qemu_system:vm_status",
+        cache_ttl=VM_CACHE_TTL,
+        reads=lambda args: [cache.VMS],
+        fields=True,
+        properties={
+            "ssh_port": {
+                "type": "integer",
+                "description": "SSH port to check",
+            },
         },
+        required=("ssh_port",),
+    ),
+    ToolSpec(
+        name="qemu_wait_ssh",
+        description="Wait until a booting VM accepts SSH, polling its status.",
+        handler="qemu_system:wait_for_ssh",
+        properties={
+            "ssh_port": {
+                "type": "integer",
+                "description": "SSH port of the VM",
+            },
+            "timeout": {
+                "type": "integer",
+                "description": "Seconds to wait before giving up",
+                "default": 300,
+            },
+        },
+        required=("ssh_port",),
+    ),
+    ToolSpec(
+        name="qemu_vm_exec",
+        description="Run shell commands inside a VM through the QEMU guest agent (no SSH). Multiple commands run concurrently over one persistent connection.",
+        handler="guest_agent:vm_exec",
+        properties={
+            "ssh_port": {
+                "type": "integer",
+                "description": "SSH port identifying the VM",
+            },
+            "commands": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Shell commands to run (each via /bin/sh -c)",
+            },
+            "timeout": {
+                "type": "integer",
+                "description": "Per-command timeout in seconds",
+                "default": 60,
+            },
+        },
+        required=("ssh_port", "commands"),
+    ),
+    ToolSpec(
+        name="qemu_vm_copy",
+        description="Copy a file between host and VM through the QEMU guest agent (no SSH), in chunks.",
+        handler="guest_agent:vm_copy",
+        properties={
+            "ssh_port": {
+                "type": "integer",
+                "description": "SSH port identifying the VM",
+            },
+            "source": {
+                "type": "string",
+                "description": "Source path (host path for to_guest, guest path for from_guest)",
+            },
+            "destination": {
+                "type": "string",
+                "description": "Destination path",
+            },
+            "direction": {
+                "type": "string",
+                "description": "Copy direction",
+                "enum": ["to_guest", "from_guest"],
+                "default": "to_guest",
+            },
+            "chunk_size": {
+                "type": "integer",
+                "description": "Bytes per transfer chunk",
+                "default": 1024 * 1024,
+            },
+        },
+        required=("ssh_port", "source", "destination"),
+    ),
+    ToolSpec(
+        name="qemu_ssh_exec",
+        description="Run shell commands on a VM over SSH, reusing one persistent multiplexed (ControlMaster) connection per VM.",
+        handler=_ssh_exec,
+        properties={
+            "ssh_port": {
+                "type": "integer",
+                "description": "SSH port of the VM",
+            },
+            "commands": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Shell commands to run",
+            },
+            "user": {
+                "type": "string",
+                "description": "Remote user",
+                "default": "vaultadmin",
+            },
+            "timeout": {
+                "type": "integer",
+                "description": "Per-command timeout in seconds",
+                "default": 60,
+            },
+            "reuse": {
+                "type": "boolean",
+                "description": "Reuse the pooled connection (false opens a fresh connection per command)",
+                "default": True,
+            },
+            "compare_reuse": {
+                "type": "boolean",
+                "description": "Also report the latency of a no-op command (true) with and without connection reuse",
+                "default": False,
+            },
+        },
+        required=("ssh_port", "commands"),
+    ),
+    ToolSpec(
+        name="qemu_vm_balloon",
+        description="Query or resize a VM's memory balloon through QMP. The VM must be booted with balloon=true.",
+        handler="memory:balloon",
+        properties={
+            "ssh_port": {
+                "type": "integer",
+                "description": "SSH port identifying the VM",
+            },
+            "target": {
+                "type": "string",
+                "description": "New guest memory size (e.g., '2G'). Omit to query only.",
+            },
+        },
+        required=("ssh_port",),
+    ),
+    ToolSpec(
+        name="qemu_ksm",
+        description="Report host Kernel Samepage Merging (KSM) status and savings, or enable/disable it (requires root).",
+        handler=_ksm,
+        properties={
+            "action": {
+                "type": "string",
+                "description": "status, enable or disable",
+                "enum": ["status", "enable", "disable"],
+                "default": "status",
+            },
+            "pages_to_scan": {
+                "type": "integer",
+                "description": "Pages scanned per KSM wake-up",
+            },
+            "sleep_millisecs": {
+                "type": "integer",
+                "description": "Milliseconds between KSM scans",
+            },
+        },
+    ),
+    # Job operations
+    ToolSpec(
+        name="qemu_job_status",
+        description="Get the status, progress, timings and result of a background job.",
+        handler=_job_status,
+        fields=True,
+        properties={
+            "job_id": {
+                "type": "string",
+                "description": "Job id returned by a long-running tool",
+            },
+        },
+        required=("job_id",),
+    ),
+    ToolSpec(
+        name="qemu_job_cancel",
+        description="Cancel a running background job.",
+        handler=jobs.cancel,
+        properties={
+            "job_id": {
+                "type": "string",
+                "description": "Job id to cancel",
+            },
+        },
+        required=("job_id",),
+    ),
+    ToolSpec(
+        name="qemu_job_list",
+        description="List background jobs, newest first. Paginated.",
+        handler=jobs.list_jobs,
+        list_key="jobs",
+        page_key=lambda job: _id_number(job["job_id"]),
+        descending=True,
+        properties={
+            "status": {
+                "type": "string",
+                "description": "Only list jobs in this state",
+                "enum": ["pending", "running", "succeeded", "failed", "cancelled"],
+            },
+        },
+    ),
+    # Batching
+    ToolSpec(
+        name="qemu_pipeline",
+        description=(
+            "Run several tool calls in one request as a dependency graph, e.g. create overlay -> resize -> "
+            "boot -> wait for SSH. Arguments can reference earlier results as ${step_id.field}. "
+            "Independent steps run concurrently; steps depending on a failed step are skipped. "
+            "Background-job tools run to completion. Returns every step's result and timing."
+        ),
+        handler=_pipeline,
+        properties={
+            "steps": {
+                "type": "array",
+                "items": {"type": "object"},
+                "description": "Steps: {id, tool, arguments, depends_on (optional list of step ids)}",
+            },
+        },
+        required=("steps",),
+    ),
+    # Diagnostics
+    ToolSpec(
+        name="qemu_trace_list",
+        description="Show recent per-call traces: wall and CPU time with spans for dispatch, subprocesses and file operations. Paginated, newest first.",
+        handler=_trace_list,
+        list_key="traces",
+        page_key=lambda trace: _id_number(trace["trace_id"]),
+        descending=True,
+        properties={
+            "tool": {
+                "type": "string",
+                "description": "Only traces for this tool (background jobs are named job:<tool>)",
+            },
+        },
+    ),
+    ToolSpec(
+        name="qemu_io_status",
+        description="Show the disk I/O governor: slots in use and waiters per device, and recent queue-wait times for interactive and bulk operations.",
+        handler="io_governor:status",
+        fields=True,
     ),
 ]
 
+REGISTRY = build(TOOLS)
+
+
+@functools.lru_cache(maxsize=1)
+def _tool_list() -> list[Tool]:
+    return [
+        Tool(name=spec.name, description=spec.description, inputSchema=spec.input_schema)
+        for spec in TOOLS
+    ]
+
 
 @server.list_tools()
 async def list_tools() -> list[Tool]:
     """Return the list of available tools."""
-    return TOOLS
+    return _tool_list()
 
 
 @server.call_tool()
@@ -198,88 +628,159 @@ async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
     """Handle tool calls."""
     logger.info(f"Tool call: {name} with args: {arguments}")
 
-    try:
-        result = await _dispatch_tool(name, arguments)
-        return [TextContent(type="text", text=json.dumps(result, indent=2))]
-    except Exception as e:
-        logger.error(f"Tool error: {e}")
-        error_result = {
-            "error": True,
-            "error_type": type(e).__name__,
-            "message": str(e),
-        }
-        return [TextContent(type="text", text=json.dumps(error_result, indent=2))]
+    start = time.monotonic()
+    with tracing.trace(name) as trace:
+        try:
+            slots = _call_slots_for()
+            with tracing.span("queue"):
+                await slots.acquire()
+            try:
+                with tracing.span("dispatch"):
+                    result = await _dispatch_tool(name, arguments)
+            finally:
+                slots.release()
+            metrics.TOOL_CALLS.inc(tool=name, status="ok")
+            with tracing.span("serialize") as span:
+                text = responses.render(result)
+                span["bytes"] = len(text.encode())
+            metrics.RESPONSE_BYTES.observe(span["bytes"], tool=name)
+            return [TextContent(type="text", text=text)]
+        except Exception as e:
+            logger.error(f"Tool error: {e}")
+            trace.error = type(e).__name__
+            metrics.TOOL_CALLS.inc(tool=name, status="error")
+            metrics.TOOL_ERRORS.inc(tool=name, error_type=type(e).__name__)
+            error_result = {
+                "error": True,
+                "error_type": type(e).__name__,
+                "message": str(e),
+            }
+            text = responses.dumps(error_result)
+            metrics.RESPONSE_BYTES.observe(len(text.encode()), tool=name)
+            return [TextContent(type="text", text=text)]
+        finally:
+            metrics.TOOL_DURATION.observe(time.monotonic() - start, tool=name)
+            metrics.export()
+
+
+def _call_slots_for() -> asyncio.Semaphore:
+    global _call_slots
+    if _call_slots is None:
+        _call_slots = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+    return _call_slots
 
 
 async def _dispatch_tool(name: str, arguments: dict[str, Any]) -> dict:
-    """Dispatch tool call to appropriate handler."""
+    """Validate arguments, dispatch the tool call and shape its result."""
+    spec = REGISTRY.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown tool: {name}")
+    arguments, options = spec.split_options(spec.validate(arguments))
 
-    # Image operations
-    if name == "qemu_image_info":
-        return await qemu_img.image_info(arguments["image_path"])
-
-    elif name == "qemu_image_convert":
-        return await qemu_img.image_convert(
-            input_path=arguments["input_path"],
-            output_path=arguments["output_path"],
-            output_format=arguments["output_format"],
-            input_format=arguments.get("input_format"),
-            compress=arguments.get("compress", False),
+    if spec.job:
+        wait = arguments.pop("wait")
+        return await _run_or_submit(
+            name, arguments, lambda progress: spec.call(arguments, progress=progress), wait
         )
+    result = await spec.call(arguments)
+    return responses.shape(result, spec.list_key, spec.page_key, spec.descending, **options)
 
-    elif name == "qemu_create_overlay":
-        return await qemu_img.create_overlay(
-            base_image=arguments["base_image"],
-            overlay_path=arguments["overlay_path"],
-        )
 
-    elif name == "qemu_image_resize":
-        return await qemu_img.image_resize(
-            image_path=arguments["image_path"],
-            size=arguments["size"],
-        )
+async def _run_or_submit(name: str, arguments: dict[str, Any], func, wait: bool) -> dict:
+    """Run a long operation inline if wait=true, otherwise as a background job."""
+    if wait:
+        return await func(None)
+    job = jobs.submit(name, arguments, func)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "note": "Running in background. Poll with qemu_job_status, cancel with qemu_job_cancel.",
+    }
 
-    # VM operations
-    elif name == "qemu_boot_vm":
-        return await qemu_system.boot_vm(
-            image_path=arguments["image_path"],
-            memory=arguments.get("memory", "4G"),
-            cpus=arguments.get("cpus", 2),
-            ssh_port=arguments.get("ssh_port", 2222),
-            background=arguments.get("background", True),
-        )
 
-    elif name == "qemu_list_vms":
-        return await qemu_system.list_vms()
+async def _export_metrics_periodically():
+    """Keep the metrics textfile fresh between tool calls."""
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        metrics.export()
 
-    elif name == "qemu_stop_vm":
-        return await qemu_system.stop_vm(
-            pid=arguments.get("pid"),
-            ssh_port=arguments.get("ssh_port"),
-        )
 
-    elif name == "qemu_vm_status":
-        return await qemu_system.vm_status(
-            ssh_port=arguments["ssh_port"],
-        )
+async def run_server(
+    transport: str = "stdio",
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: Optional[str] = None,
+    max_connections: int = 32,
+):
+    """
+    Run the MCP server.
 
-    else:
-        raise ValueError(f"Unknown tool: {name}")
+    Args:
+        transport: "stdio" for one client, or "http" to serve many clients
+            from this process over streamable HTTP
+        host: Loopback address for the HTTP transport
+        port: TCP port for the HTTP transport
+        socket_path: Unix socket for the HTTP transport instead of TCP
+        max_connections: Concurrent HTTP connections before HTTP 503
+    """
+    from . import eventloop
 
+    background = [asyncio.create_task(eventloop.monitor_lag())]
+    if os.environ.get("QEMU_MCP_METRICS_TEXTFILE"):
+        background.append(asyncio.create_task(_export_metrics_periodically()))
+    metrics_server = None
+    if os.environ.get("QEMU_MCP_METRICS_PORT"):
+        metrics_port = int(os.environ["QEMU_MCP_METRICS_PORT"])
+        metrics_server = await metrics.serve_http(metrics_port)
+        logger.info(f"Serving metrics on http://127.0.0.1:{metrics_port}/metrics")
 
-async def run_server():
-    """Run the MCP server."""
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            server.create_initialization_options(),
-        )
+    try:
+        if transport == "http":
+            from . import http_transport
+
+            await http_transport.serve(
+                server, host=host, port=port, socket_path=socket_path, max_connections=max_connections,
+            )
+        else:
+            from mcp.server.stdio import stdio_server
+
+            async with stdio_server() as (read_stream, write_stream):
+                await server.run(
+                    read_stream,
+                    write_stream,
+                    server.create_initialization_options(),
+                )
+    finally:
+        for task in background:
+            task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        metrics.export()
 
 
 def main():
     """Entry point for the server."""
-    asyncio.run(run_server())
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="QEMU MCP server")
+    parser.add_argument(
+        "--transport", choices=["stdio", "http"], default=env("QEMU_MCP_TRANSPORT", "stdio"),
+        help="stdio (one client) or http (shared server for many clients)",
+    )
+    parser.add_argument("--host", default=env("QEMU_MCP_HTTP_HOST", "127.0.0.1"), help="HTTP: loopback address")
+    parser.add_argument("--port", type=int, default=int(env("QEMU_MCP_HTTP_PORT", "8765")), help="HTTP: TCP port")
+    parser.add_argument("--socket", default=env("QEMU_MCP_HTTP_SOCKET"), help="HTTP: unix socket path instead of TCP")
+    parser.add_argument(
+        "--max-connections", type=int, default=int(env("QEMU_MCP_MAX_CONNECTIONS", "32")),
+        help="HTTP: concurrent connections before HTTP 503",
+    )
+    args = parser.parse_args()
+    asyncio.run(run_server(
+        transport=args.transport,
+        host=args.host,
+        port=args.port,
+        socket_path=args.socket,
+        max_connections=args.max_connections,
+    ))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+"""
+Multiplexed SSH sessions to test VMs.
+
+Keeps one OpenSSH ControlMaster connection per VM so repeated commands
+and status polls reuse an authenticated channel instead of doing a full
+key exchange each time. The master exits on its own after an idle timeout
+(ControlPersist). A master is health-checked with `ssh -O check` when
+first seen and again only after a command through it fails to connect.
+"""
+
+import asyncio
+import os
+import shutil
+import time
+
+from . import metrics, tracing
+from .qemu_img import run_command
+
+
+DEFAULT_USER = "vaultadmin"
+IDLE_TIMEOUT = 300  # seconds a master stays up without sessions
+
+# Test VMs are recreated constantly, so their host keys are never pinned
+_COMMON_OPTIONS = [
+    "-o", "StrictHostKeyChecking=no",
+    "-o", "UserKnownHostsFile=/dev/null",
+    "-o", "LogLevel=ERROR",
+    "-o", "BatchMode=yes",
+]
+
+# Per (port, user): serializes check-and-spawn so concurrent commands
+# don't start duplicate masters or unlink each other's sockets
+_locks: dict[tuple[int, str], asyncio.Lock] = {}
+# Masters known to be up, so commands skip `ssh -O check`
+_live: set[tuple[int, str]] = set()
+
+
+def control_path(ssh_port: int, user: str = DEFAULT_USER) -> str:
+    """ControlMaster socket for a VM (kept short for the unix socket limit)."""
+    return f"/tmp/qemu-mcp-ssh-{user}-{ssh_port}.sock"
+
+
+def _ssh() -> str:
+    path = shutil.which("ssh")
+    if not path:
+        raise FileNotFoundError("ssh not found. Install an OpenSSH client")
+    return path
+
+
+def _base_cmd(ssh_port: int, timeout: int) -> list[str]:
+    return [
+        _ssh(),
+        *_COMMON_OPTIONS,
+        "-o", f"ConnectTimeout={timeout}",
+        "-p", str(ssh_port),
+    ]
+
+
+async def is_alive(ssh_port: int, user: str = DEFAULT_USER) -> bool:
+    """Health check: is a master connection up for this VM?"""
+    if not os.path.exists(control_path(ssh_port, user)):
+        return False
+    returncode, _, _ = await run_command(
+        [_ssh(), "-S", control_path(ssh_port, user), "-O", "check", "-p", str(ssh_port),
+         f"{user}@localhost"],
+        timeout=5,
+    )
+    return returncode == 0
+
+
+async def open_session(
+    ssh_port: int,
+    user: str = DEFAULT_USER,
+    timeout: int = 10,
+    idle_timeout: int = IDLE_TIMEOUT,
+) -> bool:
+    """
+    Ensure a master connection exists for a VM.
+
+    Returns:
+        True if an existing master was reused, False if a new one was opened
+    """
+    key = (ssh_port, user)
+    path = control_path(ssh_port, user)
+    if key in _live and os.path.exists(path):
+        return True
+    async with _locks.setdefault(key, asyncio.Lock()):
+        # Another caller may have opened it while we waited
+        if key in _live and os.path.exists(path):
+            return True
+        if await is_alive(ssh_port, user):
+            _live.add(key)
+            return True
+        _live.discard(key)
+        if os.path.exists(path):
+            os.unlink(path)  # stale socket from a dead master
+        await _spawn_master(ssh_port, user, path, timeout, idle_timeout)
+        _live.add(key)
+        return False
+
+
+async def _spawn_master(ssh_port: int, user: str, path: str, timeout: int, idle_timeout: int) -> None:
+    """Start a background ControlMaster and wait for it to authenticate."""
+    # -f backgrounds the master after authentication. Its output goes to
+    # /dev/null so it does not hold our pipes open for ControlPersist.
+    process = await asyncio.create_subprocess_exec(
+        *_base_cmd(ssh_port, timeout),
+        "-o", "ControlMaster=yes",
+        "-o", f"ControlPath={path}",
+        "-o", f"ControlPersist={idle_timeout}",
+        "-N", "-f",
+        f"{user}@localhost",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    start = time.monotonic()
+    with tracing.span("subprocess", program="ssh", op="master") as span:
+        try:
+            await asyncio.wait_for(process.wait(), timeout=timeout + 5)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise TimeoutError(f"SSH master to port {ssh_port} not established after {timeout}s")
+        finally:
+            span["returncode"] = process.returncode
+            metrics.observe_subprocess(["ssh"], time.monotonic() - start)
+    if process.returncode != 0:
+        raise ConnectionError(f"SSH connection to port {ssh_port} failed (exit {process.returncode})")
+
+
+async def close_session(ssh_port: int, user: str = DEFAULT_USER) -> None:
+    """Stop the master connection for a VM, if any."""
+    _live.discard((ssh_port, user))
+    path = control_path(ssh_port, user)
+    if os.path.exists(path):
+        await run_command(
+            [_ssh(), "-S", path, "-O", "exit", "-p", str(ssh_port), f"{user}@localhost"],
+            timeout=5,
+        )
+
+
+async def run(
+    ssh_port: int,
+    command: str,
+    user: str = DEFAULT_USER,
+    timeout: int = 60,
+    reuse: bool = True,
+    connect_timeout: int = 10,
+) -> dict:
+    """
+    Run one command on a VM over SSH.
+
+    Args:
+        ssh_port: SSH port of the VM
+        command: Remote shell command
+        user: Remote user
+        timeout: Command timeout in seconds
+        reuse: Go through the pooled master connection (False opens a
+            fresh connection, for comparison)
+        connect_timeout: SSH connection timeout in seconds
+
+    Returns:
+        Dictionary with exit code, output, duration and whether the
+        connection was reused
+    """
+    start = time.monotonic()
+    reused = False
+    if reuse:
+        reused = await open_session(ssh_port, user, timeout=connect_timeout)
+        mux = ["-o", "ControlMaster=no", "-o", f"ControlPath={control_path(ssh_port, user)}"]
+    else:
+        mux = ["-o", "ControlMaster=no", "-o", "ControlPath=none"]
+
+    returncode, stdout, stderr = await run_command(
+        [*_base_cmd(ssh_port, connect_timeout), *mux, f"{user}@localhost", command],
+        timeout=timeout,
+    )
+    if reuse and returncode == 255:
+        # ssh's own connection error: the master may be gone, so check it next time
+        _live.discard((ssh_port, user))
+    return {
+        "command": command,
+        "exitcode": returncode,
+        "stdout": stdout,
+        "stderr": stderr,
+        "duration": round(time.monotonic() - start, 4),
+        "reused": reused,
+    }
+
+
+async def ssh_exec(
+    ssh_port: int,
+    commands: list[str],
+    user: str = DEFAULT_USER,
+    timeout: int = 60,
+    reuse: bool = True,
+) -> dict:
+    """
+    Run commands on a VM, reusing one multiplexed connection.
+
+    Commands run concurrently as separate sessions on the shared master.
+    """
+    if not commands:
+        raise ValueError("Must provide at least one command")
+    if reuse:
+        # Open the master once up front so concurrent commands share it
+        await open_session(ssh_port, user)
+    results = await asyncio.gather(
+        *(run(ssh_port, c, user, timeout, reuse) for c in commands)
+    )
+    return {
+        "ssh_port": ssh_port,
+        "success": all(r["exitcode"] == 0 for r in results),
+        "results": list(results),
+    }
+
+
+async def compare_reuse(
+    ssh_port: int,
+    command: str = "true",
+    iterations: int = 5,
+    user: str = DEFAULT_USER,
+) -> dict:
+    """Measure per-command latency with and without connection reuse."""
+    latencies: dict[str, list[float]] = {"without_reuse": [], "with_reuse": []}
+    await open_session(ssh_port, user)  # don't count master setup as reuse
+    for _ in range(iterations):
+        latencies["without_reuse"].append((await run(ssh_port, command, user, reuse=False))["duration"])
+        latencies["with_reuse"].append((await run(ssh_port, command, user, reuse=True))["duration"])
+
+    report = {"command": command, "iterations": iterations}
+    for mode, values in latencies.items():
+        ordered = sorted(values)
+        report[mode] = {
+            "mean": round(sum(values) / len(values), 4),
+            "p50": ordered[len(ordered) // 2],
+            "max": ordered[-1],
+        }
+    if report["with_reuse"]["mean"] > 0:
+        report["speedup"] = round(report["without_reuse"]["mean"] / report["with_reuse"]["mean"], 1)
+    return report
+
@@ -0,0 +1,215 @@
+"""
+Per-call tracing and opt-in profiling.
+
+Every tool call records a trace with spans for dispatch, each subprocess
+run, each file operation and JSON serialization, plus wall and CPU time
+for the whole call. Wall time far above CPU time means waiting on
+subprocesses or I/O; CPU time close to wall time on a slow call means
+the event loop was busy. Calls slower than QEMU_MCP_SLOW_CALL_MS are
+appended to a JSON-lines slow-call log.
+
+Profiling is opt-in: tools listed in QEMU_MCP_PROFILE_TOOLS ("*" for
+all) run under cProfile and the stats are saved for offline analysis
+(`python -m pstats <file>` or snakeviz). Only one profiler can be active
+at a time, so a call that overlaps a profiled call runs unprofiled and
+its trace is marked `profile_skipped`.
+"""
+
+import contextvars
+import itertools
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+logger = logging.getLogger("qemu-mcp")
+
+RECENT_TRACES = 50
+SLOW_CALL_MS = float(os.environ.get("QEMU_MCP_SLOW_CALL_MS", "1000"))
+SLOW_LOG = Path(
+    os.environ.get("QEMU_MCP_SLOW_LOG", "~/.cache/qemu-mcp/slow-calls.jsonl")
+).expanduser()
+PROFILE_DIR = Path(
+    os.environ.get("QEMU_MCP_PROFILE_DIR", "~/.cache/qemu-mcp/profiles")
+).expanduser()
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar(
+    "qemu_mcp_trace", default=None
+)
+_recent: deque = deque(maxlen=RECENT_TRACES)
+_ids = itertools.count(1)
+# Set while a cProfile.Profile is enabled; profiles can't nest or overlap
+_profiling = False
+
+
+class Trace:
+    """Timing record for one tool call or background job."""
+
+    def __init__(self, name: str):
+        self.id = f"trace-{next(_ids)}"
+        self.name = name
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self.duration_ms: Optional[float] = None
+        self.cpu_ms: Optional[float] = None
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.spans: list[dict] = []
+        self.profile: Optional[str] = None
+        self.profile_skipped = False
+
+    def add_span(self, name: str, start: float, end: float, **attrs) -> None:
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self._start) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+            **attrs,
+        })
+
+    def finish(self, status: str) -> None:
+        self.status = status
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        # Process-wide CPU time: includes other tasks running concurrently
+        self.cpu_ms = round((time.process_time() - self._cpu_start) * 1000, 3)
+
+    def to_dict(self) -> dict:
+        info = {
+            "trace_id": self.id,
+            "name": self.name,
+            "started": self.started,
+            "status": self.status,
+            "duration_ms": self.duration_ms,
+            "cpu_ms": self.cpu_ms,
+            "error": self.error,
+            "spans": self.spans,
+        }
+        if self.profile:
+            info["profile"] = self.profile
+        if self.profile_skipped:
+            info["profile_skipped"] = True
+        return info
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[dict]:
+    """
+    Time a block as a span of the current trace (no-op outside a trace).
+
+    Yields a dict that the block can add attributes to.
+    """
+    trace = _current.get()
+    extra: dict = {}
+    start = time.perf_counter()
+    try:
+        yield extra
+    except BaseException as e:
+        extra["error"] = type(e).__name__
+        raise
+    finally:
+        if trace is not None:
+            trace.add_span(name, start, time.perf_counter(), **attrs, **extra)
+
+
+def _profile_enabled(name: str) -> bool:
+    tools = os.environ.get("QEMU_MCP_PROFILE_TOOLS", "")
+    selected = {t.strip() for t in tools.split(",") if t.strip()}
+    # A tool's background job is profiled along with the tool call
+    return "*" in selected or name.removeprefix("job:") in selected
+
+
+@contextmanager
+def trace(name: str) -> Iterator[Trace]:
+    """
+    Record a trace for the enclosed call and make it current.
+
+    Callers that handle errors themselves set `error` on the yielded
+    trace to mark it failed. Slow traces are logged; profiled traces save cProfile stats.
+    """
+    global _profiling
+    current = Trace(name)
+    token = _current.set(current)
+    profiler = None
+    if _profile_enabled(name):
+        if _profiling:
+            current.profile_skipped = True
+        else:
+            profiler = _start_profiler()
+            current.profile_skipped = profiler is None
+    status = "error"
+    try:
+        yield current
+        status = "ok"
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profiling = False
+            current.profile = _save_profile(profiler, current)
+        current.finish("error" if current.error else status)
+        _current.reset(token)
+        _recent.append(current)
+        if current.duration_ms >= SLOW_CALL_MS:
+            _log_slow(current)
+
+
+def _start_profiler():
+    """Enable a cProfile.Profile, or return None if another profiler is active."""
+    global _profiling
+    import cProfile
+
+    # cProfile sees everything on the event loop thread while enabled,
+    # including other concurrent calls.
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Python 3.12+: another profiling tool (e.g. an external profiler) holds the hook
+        logger.warning(f"Profiling skipped: {e}")
+        return None
+    _profiling = True
+    return profiler
+
+
+def _save_profile(profiler, current: Trace) -> Optional[str]:
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(current.started))
+        name = current.name.replace(":", "-")
+        path = PROFILE_DIR / f"{name}-{stamp}-{current.id}.prof"
+        profiler.dump_stats(str(path))
+        return str(path)
+    except OSError as e:
+        logger.warning(f"Could not save profile for {current.name}: {e}")
+        return None
+
+
+def _log_slow(current: Trace) -> None:
+    logger.warning(
+        f"Slow call: {current.name} took {current.duration_ms:.0f}ms "
+        f"(cpu {current.cpu_ms:.0f}ms, {len(current.spans)} spans)"
+    )
+    try:
+        SLOW_LOG.parent.mkdir(parents=True, exist_ok=True)
+        with open(SLOW_LOG, "a") as f:
+            f.write(json.dumps(current.to_dict()) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not write slow-call log {SLOW_LOG}: {e}")
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def recent(limit: int = 20, name: Optional[str] = None) -> dict:
+    """Most recent traces, newest first."""
+    traces = [t for t in reversed(_recent) if name is None or t.name == name]
+    return {
+        "traces": [t.to_dict() for t in traces[:limit]],
+        "count": min(len(traces), limit),
+        "slow_call_ms": SLOW_CALL_MS,
+    }
@@ -6,14 +6,31 @@ Some tests require QEMU to be installed.
 """
 
 import asyncio
+import base64
+import collections
+import json
 import os
+import subprocess
+import sys
 import tempfile
+import time
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from qemu_mcp import qemu_img, qemu_system
+from qemu_mcp import (
+    bench, cache, eventloop, guest_agent, http_transport, io_governor, jobs, memory, metrics, pipeline,
+    qemu_img, qemu_system, qmp, registry, responses, server, ssh_session, tracing,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_result_cache():
+    """Tool results must not leak between tests through the server cache."""
+    cache.RESULTS.clear()
+    yield
+    cache.RESULTS.clear()
 
 
 class TestQemuImgHelpers:
@@ -31,6 +48,12 @@ class TestQemuImgHelpers:
     def test_format_size_gb(self):
         assert qemu_img._format_size(100 * 1024 * 1024 * 1024) == "100.0 GB"
 
+    def test_parse_size(self):
+        assert qemu_img._parse_size("4G") == 4 * 1024 ** 3
+        assert qemu_img._parse_size("512M") == 512 * 1024 ** 2
+        with pytest.raises(ValueError, match="Invalid size"):
+            qemu_img._parse_size("+10G")
+
     def test_validate_size_absolute(self):
         assert qemu_img._validate_size_string("100G") is True
         assert qemu_img._validate_size_string("50M") is True
@@ -69,6 +92,37 @@ class TestQemuSystemHelpers:
         with patch("platform.system", return_value="Windows"):
             assert qemu_system.detect_accelerator() == "tcg"
 
+    def test_find_firmware_cached(self):
+        qemu_system.find_firmware.cache_clear()
+        try:
+            with patch.dict(os.environ, {}, clear=False):
+                os.environ.pop("QEMU_MCP_FIRMWARE", None)
+                with patch("os.path.exists", return_value=True) as exists:
+                    first = qemu_system.find_firmware()
+                    second = qemu_system.find_firmware()
+                    assert first == second == qemu_system.OVMF_PATHS[0]
+                    assert exists.call_count == 1
+        finally:
+            qemu_system.find_firmware.cache_clear()
+
+    def test_find_firmware_override_disabled(self):
+        qemu_system.find_firmware.cache_clear()
+        try:
+            with patch.dict(os.environ, {"QEMU_MCP_FIRMWARE": ""}):
+                assert qemu_system.find_firmware() is None
+        finally:
+            qemu_system.find_firmware.cache_clear()
+
+    def test_parse_grub_cmdline(self):
+        grub_cfg = """
+menuentry 'Ubuntu' {
+        linux   /boot/vmlinuz-6.8.0-31-generic root=UUID=abcd ro quiet splash
+        initrd  /boot/initrd.img-6.8.0-31-generic
+}
+"""
+        assert qemu_system._parse_grub_cmdline(grub_cfg) == "root=UUID=abcd ro quiet splash"
+        assert qemu_system._parse_grub_cmdline("set default=0") is None
+
     def test_extract_ssh_port(self):
         cmd = "qemu-system-x86_64 -netdev user,id=net0,hostfwd=tcp::2222-:22"
         assert qemu_system._extract_ssh_port(cmd) == 2222
@@ -77,11 +131,16 @@ class TestQemuSystemHelpers:
         cmd = "qemu-system-x86_64 -m 4G"
         assert qemu_system._extract_ssh_port(cmd) is None
 
-    def test_is_port_in_use(self):
-        # Port 22 is typically SSH and may or may not be in use
+    @pytest.mark.asyncio
+    async def test_is_port_in_use(self):
         # Port 65432 is unlikely to be in use
-        result = qemu_system.is_port_in_use(65432)
-        assert isinstance(result, bool)
+        assert await qemu_system.is_port_in_use(65432) is False
+        listener = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            assert await qemu_system.is_port_in_use(port) is True
+        finally:
+            listener.close()
 
 
 class TestQemuImgCommands:
@@ -119,6 +178,11 @@ class TestQemuImgCommands:
                 "/tmp/overlay.qcow2",
             )
 
+    @pytest.mark.asyncio
+    async def test_image_verify_file_not_found(self):
+        with pytest.raises(FileNotFoundError):
+            await qemu_img.image_verify("/nonexistent/image.qcow2")
+
     @pytest.mark.asyncio
     async def test_image_resize_file_not_found(self):
         with pytest.raises(FileNotFoundError):
@@ -130,6 +194,33 @@ class TestQemuImgCommands:
             with pytest.raises(ValueError, match="Invalid size"):
                 await qemu_img.image_resize(tmp.name, "invalid")
 
+    @pytest.mark.asyncio
+    async def test_image_info_backing_chain(self):
+        chain = [
+            {"filename": "overlay.qcow2", "virtual-size": 1024, "backing-filename": "base.qcow2"},
+            {"filename": "base.qcow2", "virtual-size": 1024},
+        ]
+        with tempfile.NamedTemporaryFile(suffix=".qcow2") as tmp, \
+                patch.object(qemu_img, "get_qemu_img_path", return_value="qemu-img"), \
+                patch.object(qemu_img, "run_command", AsyncMock(return_value=(0, json.dumps(chain), ""))) as run:
+            info = await qemu_img.image_info(tmp.name, backing_chain=True)
+        assert "--backing-chain" in run.call_args.args[0]
+        assert info["filename"] == "overlay.qcow2"
+        assert info["backing-chain"][0]["virtual-size-human"] == "1.0 KB"
+
+    @pytest.mark.asyncio
+    async def test_image_map_allocated(self):
+        extents = [
+            {"start": 0, "length": 65536, "depth": 0, "data": True, "zero": False},
+            {"start": 65536, "length": 1048576, "depth": 0, "data": False, "zero": True},
+        ]
+        with tempfile.NamedTemporaryFile(suffix=".qcow2") as tmp, \
+                patch.object(qemu_img, "get_qemu_img_path", return_value="qemu-img"), \
+                patch.object(qemu_img, "run_command", AsyncMock(return_value=(0, json.dumps(extents), ""))):
+            result = await qemu_img.image_map(tmp.name)
+        assert result["count"] == 2
+        assert result["allocated"] == 65536
+
 
 class TestQemuSystemCommands:
     """Test qemu-system command wrappers."""
@@ -139,6 +230,23 @@ class TestQemuSystemCommands:
         with pytest.raises(FileNotFoundError):
             await qemu_system.boot_vm("/nonexistent/image.qcow2")
 
+    @pytest.mark.asyncio
+    async def test_boot_vm_invalid_io_profile(self):
+        with tempfile.NamedTemporaryFile(suffix=".qcow2") as tmp:
+            with patch.object(qemu_system, "is_port_in_use", AsyncMock(return_value=False)):
+                with pytest.raises(ValueError, match="Invalid io_profile"):
+                    await qemu_system.boot_vm(tmp.name, io_profile="turbo")
+
+    @pytest.mark.asyncio
+    async def test_extract_boot_files_image_not_found(self):
+        with pytest.raises(FileNotFoundError):
+            await qemu_system.extract_boot_files("/nonexistent/image.qcow2")
+
+    @pytest.mark.asyncio
+    async def test_boot_fleet_invalid_count(self):
+        with pytest.raises(ValueError, match="count"):
+            await qemu_system.boot_fleet("/nonexistent/image.qcow2", 0, "/tmp")
+
     @pytest.mark.asyncio
     async def test_stop_vm_missing_params(self):
         with pytest.raises(ValueError, match="Must provide"):
@@ -159,6 +267,1202 @@ class TestQemuSystemCommands:
         assert result["port_open"] is False
 
 
+class TestBench:
+    """Test the boot benchmark helpers."""
+
+    def test_expand_matrix_defaults(self):
+        cases = bench.expand_matrix({})
+        assert len(cases) == 1
+        assert cases[0]["boot"] == "firmware"
+
+    def test_expand_matrix_product(self):
+        cases = bench.expand_matrix({"accel": ["tcg", "kvm"], "disk": ["overlay", "raw"]})
+        assert len(cases) == 4
+        assert len({bench.case_key(c) for c in cases}) == 4
+
+    def test_expand_matrix_unknown_axis(self):
+        with pytest.raises(ValueError, match="Unknown matrix axes"):
+            bench.expand_matrix({"gpu": ["yes"]})
+
+    def test_percentile(self):
+        values = [1.0, 2.0, 3.0, 4.0, 5.0]
+        assert bench.percentile(values, 50) == 3.0
+        assert bench.percentile(values, 95) == pytest.approx(4.8)
+        assert bench.percentile([], 50) is None
+
+    def test_summarize_skips_missing_phases(self):
+        runs = [{"spawned": 0.1, "ssh": 10.0}, {"spawned": 0.3, "ssh": 12.0}]
+        summary = bench.summarize(runs)
+        assert set(summary) == {"spawned", "ssh"}
+        assert summary["ssh"]["p50"] == 11.0
+
+    @pytest.mark.asyncio
+    async def test_density_restores_ksm(self, tmp_path):
+        ksm = tmp_path / "ksm"
+        ksm.mkdir()
+        for counter in memory.KSM_COUNTERS:
+            (ksm / counter).write_text("0\n")
+        (ksm / "pages_to_scan").write_text("100\n")
+        image = tmp_path / "base.qcow2"
+        image.touch()
+        with patch.object(memory, "KSM_PATH", ksm), \
+                patch.object(bench.qemu_img, "create_overlay", AsyncMock(side_effect=RuntimeError("boom"))):
+            with pytest.raises(RuntimeError, match="boom"):
+                await bench.run_density(str(image), "1G", features=True)
+        assert (ksm / "run").read_text() == "0"
+        assert (ksm / "pages_to_scan").read_text() == "100"
+
+    def test_compare_to_baseline(self):
+        baseline = {"cases": {"a": {"summary": {"ssh": {"p50": 10.0}, "kernel": {"p50": 2.0}}}}}
+        results = {"cases": {"a": {"summary": {"ssh": {"p50": 13.0}, "kernel": {"p50": 2.1}}}}}
+        regressions = bench.compare_to_baseline(results, baseline, threshold=0.2)
+        assert [r["phase"] for r in regressions] == ["ssh"]
+        assert regressions[0]["change"] == 0.3
+
+    def test_boot_mode_savings(self):
+        results = {"cases": {
+            "accel=tcg,io=default,mem=1G,boot=firmware,disk=overlay": {
+                "settings": {"boot": "firmware"}, "summary": {"ssh": {"p50": 20.0}},
+            },
+            "accel=tcg,io=default,mem=1G,boot=direct,disk=overlay": {
+                "settings": {"boot": "direct"}, "summary": {"ssh": {"p50": 12.5}},
+            },
+        }}
+        savings = bench.boot_mode_savings(results)
+        assert len(savings) == 1
+        assert savings[0]["saved"] == 7.5
+
+    @pytest.mark.asyncio
+    async def test_boot_once_kernel_only_for_direct(self, tmp_path):
+        direct_kernel = {"kernel": "/k", "initrd": "/i", "append": "root=/dev/vda1"}
+        case = {"memory": "1G", "accel": "tcg", "io_profile": "default", "disk": "raw"}
+        with patch.object(bench.qemu_system, "boot_vm", AsyncMock()) as boot_vm, \
+                patch.object(bench.qemu_system, "stop_vm", AsyncMock()), \
+                patch.object(bench, "_watch_boot", AsyncMock(return_value={"ssh": 1.0})):
+            await bench.boot_once("base.raw", {**case, "boot": "firmware"}, tmp_path, 0,
+                                  direct_kernel=direct_kernel)
+            firmware = boot_vm.call_args.kwargs
+            await bench.boot_once("base.raw", {**case, "boot": "direct"}, tmp_path, 1,
+                                  direct_kernel=direct_kernel)
+            direct = boot_vm.call_args.kwargs
+        assert firmware["kernel"] is None and firmware["direct_boot"] is False
+        assert direct["kernel"] == "/k" and direct["direct_boot"] is True
+
+    @pytest.mark.asyncio
+    async def test_boot_once_overlay_failure_recorded(self, tmp_path):
+        case = {"memory": "1G", "accel": "tcg", "io_profile": "default", "boot": "firmware",
+                "disk": "overlay"}
+        with patch.object(bench.qemu_img, "create_overlay", AsyncMock(side_effect=RuntimeError("full"))), \
+                patch.object(bench.qemu_system, "boot_vm", AsyncMock()) as boot_vm, \
+                patch.object(bench.qemu_system, "stop_vm", AsyncMock()):
+            record = await bench.boot_once("base.qcow2", case, tmp_path, 0)
+        boot_vm.assert_not_called()
+        assert record["success"] is False
+        assert record["error"] == "RuntimeError: full"
+
+    @pytest.mark.asyncio
+    async def test_run_benchmark_image_not_found(self):
+        with pytest.raises(FileNotFoundError):
+            await bench.run_benchmark("/nonexistent/image.qcow2")
+
+
+class FakeGuestAgent:
+    """Minimal qemu-ga speaking the JSON protocol on a unix socket."""
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self.handles: dict[int, dict] = {}
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while line := await reader.readline():
+            request = json.loads(line)
+            args = request.get("arguments", {})
+            prefix = b""
+            command = request["execute"]
+            if command == "guest-sync-delimited":
+                prefix, result = b"\xff", args["id"]
+            elif command == "guest-exec":
+                result = {"pid": 100 + len(self.handles)}
+                self.handles[result["pid"]] = {"cmd": args["arg"][-1]}
+            elif command == "guest-exec-status":
+                cmd = self.handles[args["pid"]]["cmd"]
+                failed = cmd.startswith("false")
+                result = {
+                    # "sleep" commands never finish
+                    "exited": not cmd.startswith("sleep"),
+                    "exitcode": 1 if failed else 0,
+                    "out-data": base64.b64encode(cmd.encode()).decode(),
+                }
+            elif command == "guest-file-open":
+                handle = 1000 + len(self.handles)
+                self.handles[handle] = {"path": args["path"], "pos": 0}
+                if "w" in args["mode"]:
+                    self.files[args["path"]] = b""
+                result = handle
+            elif command == "guest-file-write":
+                h = self.handles[args["handle"]]
+                self.files[h["path"]] += base64.b64decode(args["buf-b64"])
+                result = {"count": len(args["buf-b64"]), "eof": False}
+            elif command == "guest-file-read":
+                h = self.handles[args["handle"]]
+                data = self.files[h["path"]][h["pos"]:h["pos"] + args["count"]]
+                h["pos"] += len(data)
+                result = {
+                    "count": len(data),
+                    "buf-b64": base64.b64encode(data).decode(),
+                    "eof": h["pos"] >= len(self.files[h["path"]]),
+                }
+            elif command == "guest-file-close":
+                result = {}
+            else:
+                writer.write(json.dumps({"error": {"class": "CommandNotFound", "desc": command}}).encode() + b"\n")
+                continue
+            writer.write(prefix + json.dumps({"return": result}).encode() + b"\n")
+            await writer.drain()
+
+
+@pytest.fixture
+async def fake_agent(tmp_path):
+    agent = FakeGuestAgent()
+    sock = str(tmp_path / "qga.sock")
+    server = await asyncio.start_unix_server(agent.handle, path=sock)
+    with patch.object(guest_agent, "socket_path", return_value=sock):
+        yield agent
+    await guest_agent.close_agent(2299)
+    server.close()
+
+
+class TestGuestAgent:
+    """Test the qemu-ga client against a fake agent."""
+
+    def test_qemu_args(self):
+        args = guest_agent.qemu_args(2222)
+        assert "virtserialport,chardev=qga0,name=org.qemu.guest_agent.0" in args
+        assert any(guest_agent.socket_path(2222) in a for a in args)
+
+    @pytest.mark.asyncio
+    async def test_vm_exec_batch_single_connection(self, fake_agent):
+        result = await guest_agent.vm_exec(2299, ["echo one", "echo two"])
+        assert result["success"] is True
+        assert [r["stdout"] for r in result["results"]] == ["echo one", "echo two"]
+        await guest_agent.vm_exec(2299, ["uptime"])
+        assert fake_agent.connections == 1
+
+    @pytest.mark.asyncio
+    async def test_vm_exec_failure(self, fake_agent):
+        result = await guest_agent.vm_exec(2299, ["false"])
+        assert result["success"] is False
+        assert result["results"][0]["exitcode"] == 1
+
+    @pytest.mark.asyncio
+    async def test_vm_exec_timeout_is_per_command(self, fake_agent):
+        start = time.monotonic()
+        result = await guest_agent.vm_exec(2299, ["sleep 60", "sleep 60", "echo ok"], timeout=1)
+        # Budgets overlap: two hung commands don't add up to 2x the timeout
+        assert time.monotonic() - start < 1.8
+        assert result["success"] is False
+        hung, also_hung, ok = result["results"]
+        assert hung["timed_out"] is True and hung["exitcode"] is None
+        assert also_hung["timed_out"] is True
+        assert ok["exitcode"] == 0 and ok["stdout"] == "echo ok"
+
+    @pytest.mark.asyncio
+    async def test_vm_copy_file_io_off_loop(self, fake_agent, tmp_path):
+        src = tmp_path / "payload.bin"
+        src.write_bytes(os.urandom(5000))
+        calls = []
+        real = eventloop.run_blocking
+
+        async def record(func, *args, **kwargs):
+            calls.append(func.__name__)
+            return await real(func, *args, **kwargs)
+
+        with patch.object(eventloop, "run_blocking", side_effect=record):
+            await guest_agent.vm_copy(2299, str(src), "/tmp/p.bin", chunk_size=2048)
+            await guest_agent.vm_copy(2299, "/tmp/p.bin", str(tmp_path / "out" / "p.bin"),
+                                      direction="from_guest", chunk_size=2048)
+        assert (tmp_path / "out" / "p.bin").read_bytes() == src.read_bytes()
+        assert {"_resolve_existing", "_prepare_destination", "open", "read", "write", "close"} <= set(calls)
+
+    @pytest.mark.asyncio
+    async def test_vm_exec_no_commands(self):
+        with pytest.raises(ValueError, match="at least one command"):
+            await guest_agent.vm_exec(2299, [])
+
+    @pytest.mark.asyncio
+    async def test_vm_copy_round_trip(self, fake_agent, tmp_path):
+        src = tmp_path / "payload.bin"
+        src.write_bytes(os.urandom(10_000))
+        result = await guest_agent.vm_copy(2299, str(src), "/tmp/payload.bin", chunk_size=4096)
+        assert result["bytes"] == 10_000
+        assert result["chunks"] == 3
+        assert fake_agent.files["/tmp/payload.bin"] == src.read_bytes()
+
+        back = tmp_path / "back.bin"
+        result = await guest_agent.vm_copy(
+            2299, "/tmp/payload.bin", str(back), direction="from_guest", chunk_size=4096
+        )
+        assert back.read_bytes() == src.read_bytes()
+
+    @pytest.mark.asyncio
+    async def test_vm_copy_invalid_direction(self):
+        with pytest.raises(ValueError, match="Invalid direction"):
+            await guest_agent.vm_copy(2299, "a", "b", direction="sideways")
+
+    @pytest.mark.asyncio
+    async def test_missing_socket(self):
+        with patch.object(guest_agent, "socket_path", return_value="/nonexistent/qga.sock"):
+            with pytest.raises(FileNotFoundError, match="Guest agent socket"):
+                await guest_agent.vm_exec(2298, ["true"])
+        await guest_agent.close_agent(2298)
+
+
+class TestSSHSession:
+    """Test multiplexed SSH session handling."""
+
+    def test_control_path(self):
+        assert ssh_session.control_path(2222) == "/tmp/qemu-mcp-ssh-vaultadmin-2222.sock"
+
+    @pytest.mark.asyncio
+    async def test_is_alive_without_socket(self):
+        assert await ssh_session.is_alive(65434) is False
+
+    @pytest.mark.asyncio
+    async def test_run_uses_control_path(self):
+        with patch.object(ssh_session, "open_session", AsyncMock(return_value=True)), \
+                patch.object(ssh_session, "run_command", AsyncMock(return_value=(0, "ok\n", ""))) as run:
+            result = await ssh_session.run(2222, "echo ok")
+        cmd = run.call_args.args[0]
+        assert f"ControlPath={ssh_session.control_path(2222)}" in cmd
+        assert result["reused"] is True
+        assert result["exitcode"] == 0
+
+    @pytest.mark.asyncio
+    async def test_run_without_reuse(self):
+        with patch.object(ssh_session, "open_session", AsyncMock()) as open_session, \
+                patch.object(ssh_session, "run_command", AsyncMock(return_value=(0, "", ""))) as run:
+            result = await ssh_session.run(2222, "true", reuse=False)
+        open_session.assert_not_called()
+        assert "ControlPath=none" in run.call_args.args[0]
+        assert result["reused"] is False
+
+    @pytest.mark.asyncio
+    async def test_open_session_spawns_one_master(self, tmp_path):
+        sock = tmp_path / "master.sock"
+
+        async def spawn(*args):
+            await asyncio.sleep(0.01)
+            sock.touch()
+
+        with patch.object(ssh_session, "control_path", return_value=str(sock)), \
+                patch.object(ssh_session, "_live", set()), \
+                patch.object(ssh_session, "_locks", {}), \
+                patch.object(ssh_session, "is_alive", AsyncMock(return_value=False)) as is_alive, \
+                patch.object(ssh_session, "_spawn_master", side_effect=spawn) as spawn_master:
+            reused = await asyncio.gather(*(ssh_session.open_session(2222) for _ in range(5)))
+            # A known-live master is reused without another `ssh -O check`
+            assert await ssh_session.open_session(2222) is True
+        assert spawn_master.call_count == 1
+        assert is_alive.call_count == 1
+        assert sorted(reused) == [False, True, True, True, True]
+
+    @pytest.mark.asyncio
+    async def test_run_connection_error_forgets_master(self):
+        live = {(2222, ssh_session.DEFAULT_USER)}
+        with patch.object(ssh_session, "_live", live), \
+                patch.object(ssh_session, "open_session", AsyncMock(return_value=True)), \
+                patch.object(ssh_session, "run_command", AsyncMock(return_value=(255, "", "mux error"))):
+            await ssh_session.run(2222, "true")
+        assert not live
+
+    @pytest.mark.asyncio
+    async def test_ssh_exec_no_commands(self):
+        with pytest.raises(ValueError, match="at least one command"):
+            await ssh_session.ssh_exec(2222, [])
+
+    @pytest.mark.asyncio
+    async def test_ssh_exec_compare_reuse_times_noop(self):
+        with patch.object(ssh_session, "ssh_exec", AsyncMock(return_value={"success": True})), \
+                patch.object(ssh_session, "compare_reuse", AsyncMock(return_value={})) as compare:
+            await server._ssh_exec(2222, ["rm -rf /tmp/x"], "vaultadmin", 60, True, True)
+        # The caller's command is never re-run for timing
+        assert "command" not in compare.call_args.kwargs
+
+    @pytest.mark.asyncio
+    async def test_compare_reuse(self):
+        async def fake_run(ssh_port, command, user, reuse=True):
+            return {"duration": 0.01 if reuse else 0.2}
+
+        with patch.object(ssh_session, "open_session", AsyncMock(return_value=True)), \
+                patch.object(ssh_session, "run", side_effect=fake_run):
+            report = await ssh_session.compare_reuse(2222, iterations=3)
+        assert report["without_reuse"]["mean"] == 0.2
+        assert report["with_reuse"]["mean"] == 0.01
+        assert report["speedup"] == 20.0
+
+
+@pytest.fixture
+async def fake_qmp(tmp_path):
+    """QMP monitor that tracks a balloon size."""
+    state = {"actual": 4 * 1024 ** 3, "commands": []}
+
+    async def handle(reader, writer):
+        writer.write(b'{"QMP": {"version": {}, "capabilities": []}}\n')
+        while line := await reader.readline():
+            request = json.loads(line)
+            state["commands"].append(request["execute"])
+            if request["execute"] == "balloon":
+                state["actual"] = request["arguments"]["value"]
+                writer.write(b'{"event": "BALLOON_CHANGE", "data": {}}\n')
+                result = {}
+            elif request["execute"] == "query-balloon":
+                result = {"actual": state["actual"]}
+            else:
+                result = {}
+            writer.write(json.dumps({"return": result}).encode() + b"\n")
+            await writer.drain()
+
+    sock = str(tmp_path / "qmp.sock")
+    server = await asyncio.start_unix_server(handle, path=sock)
+    with patch.object(qmp, "socket_path", return_value=sock):
+        yield state
+    server.close()
+
+
+class TestMemory:
+    """Test balloon and KSM helpers."""
+
+    def test_balloon_args(self):
+        assert "free-page-reporting=on" in memory.balloon_args()[1]
+
+    @pytest.mark.asyncio
+    async def test_balloon_resize(self, fake_qmp):
+        result = await memory.balloon(2222, "2G")
+        assert result["actual"] == 2 * 1024 ** 3
+        assert fake_qmp["commands"][0] == "qmp_capabilities"
+        assert "balloon" in fake_qmp["commands"]
+
+    @pytest.mark.asyncio
+    async def test_balloon_no_socket(self):
+        with pytest.raises(FileNotFoundError, match="QMP socket"):
+            await memory.balloon(65435)
+
+    def test_ksm_status_and_set(self, tmp_path):
+        for counter in memory.KSM_COUNTERS:
+            (tmp_path / counter).write_text("0\n")
+        (tmp_path / "pages_sharing").write_text("256\n")
+        with patch.object(memory, "KSM_PATH", tmp_path):
+            status = memory.ksm_status()
+            assert status["enabled"] is False
+            assert status["bytes_saved"] == 256 * os.sysconf("SC_PAGE_SIZE")
+            result = memory.ksm_set(True, pages_to_scan=1000)
+        assert result["enabled"] is True
+        assert (tmp_path / "pages_to_scan").read_text() == "1000"
+
+    def test_ksm_unavailable(self, tmp_path):
+        with patch.object(memory, "KSM_PATH", tmp_path / "missing"):
+            assert memory.ksm_status()["available"] is False
+
+    @pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="Linux only")
+    def test_process_pss(self):
+        assert memory.process_pss(os.getpid()) > 0
+        assert memory.process_pss(2 ** 22 + 1) is None
+
+
+class TestJobs:
+    """Test the background job subsystem."""
+
+    @pytest.mark.asyncio
+    async def test_job_succeeds_with_progress(self):
+        release = asyncio.Event()
+
+        async def work(progress):
+            progress(0.5)
+            await release.wait()
+            return {"success": True}
+
+        job = jobs.submit("test_tool", {}, work)
+        await asyncio.sleep(0)
+        assert job.status == "running"
+        assert job.progress == 0.5
+        release.set()
+        await job.task
+        info = jobs.get(job.id).to_dict()
+        assert info["status"] == "succeeded"
+        assert info["result"] == {"success": True}
+        assert info["elapsed"] >= 0
+
+    @pytest.mark.asyncio
+    async def test_job_failure(self):
+        async def work(progress):
+            raise RuntimeError("boom")
+
+        job = jobs.submit("test_tool", {}, work)
+        await job.task
+        assert job.status == "failed"
+        assert job.error == {"error_type": "RuntimeError", "message": "boom"}
+
+    @pytest.mark.asyncio
+    async def test_job_cancel(self):
+        async def work(progress):
+            await asyncio.sleep(60)
+
+        job = jobs.submit("test_tool", {}, work)
+        await asyncio.sleep(0)
+        result = await jobs.cancel(job.id)
+        assert result["status"] == "cancelled"
+        assert job.id in [j["job_id"] for j in jobs.list_jobs(status="cancelled")["jobs"]]
+
+    @pytest.mark.asyncio
+    async def test_unknown_job(self):
+        with pytest.raises(ValueError, match="Unknown job"):
+            jobs.get("job-does-not-exist")
+
+    @pytest.mark.asyncio
+    async def test_retention_cap(self):
+        async def work(progress):
+            return {}
+
+        with patch.object(jobs, "MAX_FINISHED_JOBS", 2):
+            submitted = [jobs.submit("test_tool", {}, work) for _ in range(4)]
+            await asyncio.gather(*(j.task for j in submitted))
+            jobs.list_jobs()
+            finished = [j for j in jobs._jobs.values() if j.status not in jobs.ACTIVE_STATES]
+            assert len(finished) == 2
+            assert submitted[-1].id in jobs._jobs
+
+    @pytest.mark.asyncio
+    async def test_convert_returns_job_id(self):
+        result = await server._dispatch_tool("qemu_image_convert", {
+            "input_path": "/nonexistent/source.qcow2",
+            "output_path": "/tmp/output.raw",
+            "output_format": "raw",
+        })
+        job = jobs.get(result["job_id"])
+        await job.task
+        assert job.status == "failed"
+        assert job.error["error_type"] == "FileNotFoundError"
+
+    @pytest.mark.asyncio
+    async def test_convert_wait(self):
+        with pytest.raises(FileNotFoundError):
+            await server._dispatch_tool("qemu_image_convert", {
+                "input_path": "/nonexistent/source.qcow2",
+                "output_path": "/tmp/output.raw",
+                "output_format": "raw",
+                "wait": True,
+            })
+
+
+class TestMetrics:
+    """Test the Prometheus metrics registry and exporters."""
+
+    def test_histogram_buckets(self):
+        histogram = metrics.Histogram("test_latency_seconds", "Test", ("tool",), buckets=(0.1, 1))
+        histogram.observe(0.05, tool="a")
+        histogram.observe(0.5, tool="a")
+        text = histogram.render()
+        assert 'test_latency_seconds_bucket{tool="a",le="0.1"} 1' in text
+        assert 'test_latency_seconds_bucket{tool="a",le="1"} 2' in text
+        assert 'test_latency_seconds_bucket{tool="a",le="+Inf"} 2' in text
+        assert 'test_latency_seconds_count{tool="a"} 2' in text
+        metrics._registry.remove(histogram)
+
+    def test_counter_label_escaping(self):
+        counter = metrics.Counter("test_total", "Test", ("path",))
+        counter.inc(path='a"b')
+        assert 'test_total{path="a\\"b"} 1.0' in counter.render()
+        metrics._registry.remove(counter)
+
+    def test_write_textfile_atomic(self, tmp_path):
+        path = tmp_path / "qemu_mcp.prom"
+        metrics.write_textfile(str(path))
+        text = path.read_text()
+        assert "# TYPE qemu_mcp_tool_duration_seconds histogram" in text
+        assert "qemu_mcp_running_vms" in text
+        assert [p.name for p in tmp_path.iterdir()] == ["qemu_mcp.prom"]
+
+    @pytest.mark.asyncio
+    async def test_call_tool_records_metrics(self, tmp_path):
+        before = metrics.TOOL_ERRORS.value(tool="qemu_image_info", error_type="FileNotFoundError")
+        with patch.dict(os.environ, {"QEMU_MCP_METRICS_TEXTFILE": str(tmp_path / "m.prom")}):
+            await server.call_tool("qemu_image_info", {"image_path": "/nonexistent/image.qcow2"})
+        after = metrics.TOOL_ERRORS.value(tool="qemu_image_info", error_type="FileNotFoundError")
+        assert after == before + 1
+        assert metrics.TOOL_DURATION.count(tool="qemu_image_info") >= 1
+        assert "qemu_mcp_tool_errors_total" in (tmp_path / "m.prom").read_text()
+
+    @pytest.mark.asyncio
+    async def test_run_command_counts_spawns(self):
+        before = metrics.SUBPROCESS_SPAWNS.value(program="echo")
+        await qemu_img.run_command(["echo", "hi"])
+        assert metrics.SUBPROCESS_SPAWNS.value(program="echo") == before + 1
+
+    @pytest.mark.asyncio
+    async def test_http_endpoint(self):
+        http = await metrics.serve_http(0)
+        port = http.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+        finally:
+            http.close()
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert b"qemu_mcp_tool_calls_total" in response
+
+
+class TestTracing:
+    """Test per-call tracing, the slow-call log and opt-in profiling."""
+
+    @pytest.mark.asyncio
+    async def test_call_tool_records_spans(self):
+        await server.call_tool("qemu_image_info", {"image_path": "/nonexistent/image.qcow2"})
+        trace = tracing.recent(limit=1, name="qemu_image_info")["traces"][0]
+        assert trace["status"] == "error"
+        assert trace["error"] == "FileNotFoundError"
+        names = [s["name"] for s in trace["spans"]]
+        assert "dispatch" in names
+        stat = next(s for s in trace["spans"] if s["name"] == "file")
+        assert stat["op"] == "stat"
+        assert stat["path"] == "/nonexistent/image.qcow2"
+
+    @pytest.mark.asyncio
+    async def test_subprocess_span(self):
+        with tracing.trace("test") as trace:
+            await qemu_img.run_command(["sh", "-c", "exit 3"])
+        span = trace.spans[0]
+        assert span["name"] == "subprocess"
+        assert span["program"] == "sh"
+        assert span["returncode"] == 3
+
+    def test_span_outside_trace_is_noop(self):
+        with tracing.span("file", op="stat") as span:
+            span["bytes"] = 1
+        assert tracing.current() is None
+
+    def test_slow_call_log(self, tmp_path):
+        log = tmp_path / "slow.jsonl"
+        with patch.object(tracing, "SLOW_CALL_MS", 0), patch.object(tracing, "SLOW_LOG", log):
+            with tracing.trace("slow_tool"):
+                with tracing.span("dispatch"):
+                    pass
+        entry = json.loads(log.read_text().splitlines()[-1])
+        assert entry["name"] == "slow_tool"
+        assert entry["status"] == "ok"
+        assert entry["spans"][0]["name"] == "dispatch"
+
+    @pytest.mark.asyncio
+    async def test_profile_opt_in(self, tmp_path):
+        with patch.object(tracing, "PROFILE_DIR", tmp_path), \
+                patch.dict(os.environ, {"QEMU_MCP_PROFILE_TOOLS": "qemu_job_list"}):
+            await server.call_tool("qemu_job_list", {})
+            await server.call_tool("qemu_trace_list", {})
+        profiles = list(tmp_path.glob("*.prof"))
+        assert len(profiles) == 1
+        assert profiles[0].name.startswith("qemu_job_list-")
+        trace = tracing.recent(limit=1, name="qemu_job_list")["traces"][0]
+        assert trace["profile"] == str(profiles[0])
+
+    @pytest.mark.asyncio
+    async def test_overlapping_profiles_skip(self, tmp_path):
+        async def profiled(name):
+            with tracing.trace(name) as trace:
+                await asyncio.sleep(0.05)
+            return trace
+
+        with patch.object(tracing, "PROFILE_DIR", tmp_path), \
+                patch.dict(os.environ, {"QEMU_MCP_PROFILE_TOOLS": "*"}):
+            first, second = await asyncio.gather(profiled("first"), profiled("second"))
+            # The profiler is released once the overlapping calls finish
+            third = await profiled("third")
+        assert first.profile is not None and not first.profile_skipped
+        assert second.profile is None
+        assert second.to_dict()["profile_skipped"] is True
+        assert third.profile is not None
+        assert len(list(tmp_path.glob("*.prof"))) == 2
+
+
+class TestRegistry:
+    """Test the declarative tool registry and argument validation."""
+
+    def spec(self, **kwargs):
+        return registry.ToolSpec(
+            name="test_tool",
+            description="Test",
+            handler=lambda **args: args,
+            properties={
+                "path": {"type": "string"},
+                "count": {"type": "integer", "default": 2},
+                "mode": {"type": "string", "enum": ["a", "b"]},
+                "items": {"type": "array", "items": {"type": "string"}},
+            },
+            required=("path",),
+            **kwargs,
+        )
+
+    def test_defaults_applied(self):
+        assert self.spec().validate({"path": "/x"}) == {"path": "/x", "count": 2}
+
+    def test_missing_required(self):
+        with pytest.raises(ValueError, match="missing required argument"):
+            self.spec().validate({})
+
+    def test_unknown_argument(self):
+        with pytest.raises(ValueError, match="unknown argument"):
+            self.spec().validate({"path": "/x", "colour": "red"})
+
+    def test_wrong_type(self):
+        with pytest.raises(ValueError, match="'count' must be integer"):
+            self.spec().validate({"path": "/x", "count": "2"})
+        with pytest.raises(ValueError, match="'count' must be integer"):
+            self.spec().validate({"path": "/x", "count": True})
+
+    def test_enum_and_items(self):
+        with pytest.raises(ValueError, match="must be one of"):
+            self.spec().validate({"path": "/x", "mode": "c"})
+        with pytest.raises(ValueError, match="every item"):
+            self.spec().validate({"path": "/x", "items": ["a", 1]})
+
+    def test_job_spec_gets_wait(self):
+        spec = self.spec(job=True)
+        assert spec.validate({"path": "/x"})["wait"] is False
+
+    def test_required_must_be_declared(self):
+        with pytest.raises(ValueError, match="not in schema"):
+            registry.ToolSpec("bad", "Bad", handler=print, required=("missing",))
+
+    def test_duplicate_tool(self):
+        with pytest.raises(ValueError, match="Duplicate tool"):
+            registry.build([self.spec(), self.spec()])
+
+    def test_lazy_handler(self):
+        spec = registry.ToolSpec("info", "Info", handler="qemu_img:image_info")
+        assert spec.handler is qemu_img.image_info
+
+    def test_all_tools_registered(self):
+        assert [t.name for t in server._tool_list()] == list(server.REGISTRY)
+        assert len(server.REGISTRY) == len(server.TOOLS)
+
+    @pytest.mark.asyncio
+    async def test_dispatch_reports_missing_argument(self):
+        with pytest.raises(ValueError, match="qemu_boot_vm: missing required argument"):
+            await server._dispatch_tool("qemu_boot_vm", {})
+
+    def test_server_import_is_lazy(self):
+        code = "import sys, qemu_mcp.server; print(sorted(m for m in sys.modules if m.startswith('qemu_mcp.')))"
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent.parent,
+        ).stdout
+        for module in ("qemu_system", "qemu_img", "guest_agent", "ssh_session", "memory", "bench"):
+            assert f"qemu_mcp.{module}'" not in output
+
+    @pytest.mark.asyncio
+    async def test_startup_within_budget(self):
+        result = await bench.measure_startup(runs=1)
+        assert result["within_budget"], f"Server startup {result['p50']}s over {result['budget']}s"
+
+
+class TestResponses:
+    """Test compact output, field selection, pagination and the size cap."""
+
+    def items(self, n):
+        return [{"pid": i, "ssh_port": 2222 + i, "command_snippet": "x" * 50} for i in range(n)]
+
+    def test_compact_by_default(self):
+        assert responses.dumps({"a": [1, 2]}) == '{"a":[1,2]}'
+
+    def test_paginate_follows_cursor(self):
+        items = self.items(5)
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = responses.paginate(items, lambda i: i["pid"], cursor, limit=2)
+            seen.extend(i["pid"] for i in page)
+            if cursor is None:
+                break
+        assert seen == [0, 1, 2, 3, 4]
+
+    def test_paginate_descending(self):
+        page, cursor = responses.paginate(self.items(5), lambda i: i["pid"], limit=2, descending=True)
+        assert [i["pid"] for i in page] == [4, 3]
+        page, _ = responses.paginate(self.items(5), lambda i: i["pid"], cursor, limit=2, descending=True)
+        assert [i["pid"] for i in page] == [2, 1]
+
+    def test_invalid_cursor(self):
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            responses.paginate(self.items(2), lambda i: i["pid"], cursor="not a cursor!")
+
+    def test_shape_selects_item_fields(self):
+        shaped = responses.shape(
+            {"vms": self.items(3), "count": 3}, "vms", lambda i: i["pid"],
+            fields=["pid"], limit=2,
+        )
+        assert shaped["vms"] == [{"pid": 0}, {"pid": 1}]
+        assert shaped["count"] == 2
+        assert shaped["total"] == 3
+        assert shaped["next_cursor"] is not None
+
+    def test_shape_trims_page_to_cap(self):
+        result = {"vms": self.items(100), "count": 100}
+        shaped = responses.shape(result, "vms", lambda i: i["pid"], limit=100, max_bytes=1000)
+        assert shaped["truncated"] is True
+        assert len(responses.dumps(shaped)) <= 1000
+        rest = responses.shape(
+            result, "vms", lambda i: i["pid"], cursor=shaped["next_cursor"], limit=100, max_bytes=1000,
+        )
+        assert rest["vms"][0]["pid"] == shaped["vms"][-1]["pid"] + 1
+
+    def test_render_drops_trailing_fields(self):
+        text = responses.render({"format": "qcow2", "snapshots": ["s" * 100] * 50}, max_bytes=300)
+        result = json.loads(text)
+        assert result["format"] == "qcow2"
+        assert result["truncated"] is True
+        assert result["omitted_fields"] == ["snapshots"]
+
+    @pytest.mark.asyncio
+    async def test_list_vms_paginated_through_server(self):
+        listing = {"vms": self.items(3), "count": 3}
+        with patch.object(qemu_system, "list_vms", AsyncMock(return_value=listing)):
+            content = await server.call_tool("qemu_list_vms", {"limit": 2, "fields": ["pid"]})
+        result = json.loads(content[0].text)
+        assert result["vms"] == [{"pid": 0}, {"pid": 1}]
+        assert result["total"] == 3
+        assert metrics.RESPONSE_BYTES.count(tool="qemu_list_vms") >= 1
+
+
+class TestPipeline:
+    """Test the dependency-graph pipeline tool."""
+
+    TOOLS = {"make", "use", "slow", "fail"}
+
+    async def dispatch(self, tool, arguments):
+        if tool == "fail":
+            raise RuntimeError("boom")
+        if tool == "slow":
+            await asyncio.sleep(0.2)
+        return {"tool": tool, "port": 2222, "path": "/tmp/x.qcow2", **arguments}
+
+    def test_resolve_keeps_type_of_whole_reference(self):
+        results = {"boot": {"ssh_port": 2222, "vms": [{"pid": 7}]}}
+        assert pipeline.resolve("${boot.ssh_port}", results) == 2222
+        assert pipeline.resolve("port ${boot.ssh_port}", results) == "port 2222"
+        assert pipeline.resolve({"pid": "${boot.vms.0.pid}"}, results) == {"pid": 7}
+
+    def test_resolve_missing_key(self):
+        with pytest.raises(ValueError, match="no 'nope'"):
+            pipeline.resolve("${boot.nope}", {"boot": {}})
+
+    def test_plan_dependencies(self):
+        deps = pipeline.plan([
+            {"id": "a", "tool": "make"},
+            {"id": "b", "tool": "use", "arguments": {"p": "${a.path}"}},
+            {"id": "c", "tool": "use", "depends_on": ["a", "b"]},
+        ], self.TOOLS)
+        assert deps == {"a": set(), "b": {"a"}, "c": {"a", "b"}}
+
+    @pytest.mark.parametrize("steps,match", [
+        ([{"id": "a", "tool": "make", "depends_on": ["b"]}, {"id": "b", "tool": "make", "depends_on": ["a"]}], "cycle"),
+        ([{"id": "a", "tool": "use", "arguments": {"p": "${z.path}"}}], "unknown step"),
+        ([{"id": "a", "tool": "make"}, {"id": "a", "tool": "make"}], "Duplicate"),
+        ([{"id": "a", "tool": "qemu_pipeline"}], "unknown or disallowed tool"),
+        ([], "no steps"),
+    ])
+    def test_plan_rejects(self, steps, match):
+        with pytest.raises(ValueError, match=match):
+            pipeline.plan(steps, self.TOOLS)
+
+    @pytest.mark.asyncio
+    async def test_independent_steps_run_concurrently(self):
+        start = asyncio.get_running_loop().time()
+        result = await pipeline.run(
+            [{"id": "a", "tool": "slow"}, {"id": "b", "tool": "slow"}], self.dispatch, self.TOOLS,
+        )
+        assert result["success"]
+        assert asyncio.get_running_loop().time() - start < 0.35
+        assert result["steps"]["a"]["duration"] >= 0.2
+
+    @pytest.mark.asyncio
+    async def test_failure_skips_dependents_only(self):
+        result = await pipeline.run([
+            {"id": "bad", "tool": "fail"},
+            {"id": "after", "tool": "use", "arguments": {"p": "${bad.path}"}},
+            {"id": "later", "tool": "use", "depends_on": ["after"]},
+            {"id": "other", "tool": "make"},
+            {"id": "uses_other", "tool": "use", "arguments": {"port": "${other.port}"}},
+        ], self.dispatch, self.TOOLS)
+        steps = result["steps"]
+        assert not result["success"]
+        assert steps["bad"]["status"] == "failed"
+        assert steps["bad"]["error"]["message"] == "boom"
+        assert steps["after"]["status"] == "skipped"
+        assert steps["later"]["status"] == "skipped"
+        assert steps["uses_other"]["result"]["port"] == 2222
+        assert (result["succeeded"], result["failed"], result["skipped"]) == (2, 1, 2)
+
+    @pytest.mark.asyncio
+    async def test_pipeline_through_server(self):
+        result = await server._dispatch_tool("qemu_pipeline", {"steps": [
+            {"id": "info", "tool": "qemu_image_info", "arguments": {"image_path": "/nonexistent.qcow2"}},
+            {"id": "grow", "tool": "qemu_image_resize",
+             "arguments": {"image_path": "${info.filename}", "size": "+1G"}},
+            {"id": "jobs", "tool": "qemu_job_list", "arguments": {"limit": 1}},
+        ]})
+        assert result["steps"]["info"]["error"]["error_type"] == "FileNotFoundError"
+        assert result["steps"]["grow"]["status"] == "skipped"
+        assert result["steps"]["jobs"]["status"] == "succeeded"
+
+    @pytest.mark.asyncio
+    async def test_wait_for_ssh(self):
+        statuses = [
+            {"ssh_accessible": False, "status": "booting"},
+            {"ssh_accessible": True, "status": "running"},
+        ]
+        with patch.object(qemu_system, "vm_status", AsyncMock(side_effect=statuses)):
+            result = await qemu_system.wait_for_ssh(2222, timeout=5, interval=0.01)
+        assert result["status"] == "running"
+        assert "waited" in result
+
+
+class TestHttpTransport:
+    """Test the shared streamable HTTP transport."""
+
+    @staticmethod
+    def free_port():
+        import socket
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    @pytest.mark.parametrize("host,expected", [
+        ("127.0.0.1", True), ("localhost", True), ("::1", True), ("0.0.0.0", False), ("example.com", False),
+    ])
+    def test_is_loopback(self, host, expected):
+        assert http_transport.is_loopback(host) is expected
+
+    @pytest.mark.asyncio
+    async def test_refuses_public_address(self):
+        with pytest.raises(ValueError, match="non-loopback"):
+            await http_transport.serve(server.server, host="0.0.0.0", port=self.free_port())
+
+    def test_unix_socket_private_and_replaces_stale(self, tmp_path):
+        import socket
+        import stat
+        path = str(tmp_path / "mcp.sock")
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(path)
+        stale.close()
+        sock = http_transport._bind_unix(path)
+        try:
+            assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+            with pytest.raises(RuntimeError, match="Another server"):
+                http_transport._bind_unix(path)
+        finally:
+            sock.close()
+
+    def test_refuses_to_replace_regular_file(self, tmp_path):
+        path = tmp_path / "mcp.sock"
+        path.write_text("")
+        with pytest.raises(FileExistsError):
+            http_transport._bind_unix(str(path))
+
+    @pytest.mark.asyncio
+    async def test_clients_share_one_server(self):
+        from mcp import ClientSession
+        try:
+            from mcp.client.streamable_http import streamable_http_client
+        except ImportError:  # mcp < 1.24 only has the old name
+            from mcp.client.streamable_http import streamablehttp_client as streamable_http_client
+
+        port = self.free_port()
+        started = asyncio.Event()
+        task = asyncio.create_task(http_transport.serve(server.server, port=port, started=started))
+        await asyncio.wait_for(started.wait(), 5)
+        url = f"http://127.0.0.1:{port}/mcp"
+
+        async def session_call(tool, arguments):
+            async with streamable_http_client(url) as (read, write, _):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    result = await session.call_tool(tool, arguments)
+                    return json.loads(result.content[0].text)
+
+        try:
+            first, second = await asyncio.gather(
+                session_call("qemu_job_list", {}), session_call("qemu_job_list", {}),
+            )
+            assert "jobs" in first and "jobs" in second
+            # A third client sees the traces of the first two: one process, shared state
+            traces = await session_call("qemu_trace_list", {"tool": "qemu_job_list"})
+            assert traces["count"] >= 2
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    @pytest.mark.asyncio
+    async def test_tool_calls_limited(self):
+        running = []
+        peak = []
+
+        async def slow(name, arguments):
+            running.append(name)
+            peak.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove(name)
+            return {}
+
+        with patch.object(server, "_call_slots", asyncio.Semaphore(2)), \
+                patch.object(server, "_dispatch_tool", slow):
+            await asyncio.gather(*(server.call_tool("qemu_job_list", {}) for _ in range(5)))
+        assert max(peak) == 2
+
+
+class TestResultCache:
+    """Test the read-through result cache."""
+
+    def counting(self, value=None, delay=0.0, error=None):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(delay)
+            if error:
+                raise error
+            return dict(value or {"n": len(calls)})
+
+        return compute, calls
+
+    @pytest.mark.asyncio
+    async def test_hit_within_ttl_returns_copy(self):
+        results = cache.ResultCache()
+        compute, calls = self.counting()
+        first = await results.get("t", {"a": 1}, 60, [], compute)
+        first["mutated"] = True
+        second = await results.get("t", {"a": 1}, 60, [], compute)
+        assert len(calls) == 1
+        assert second == {"n": 1}
+
+    @pytest.mark.asyncio
+    async def test_expires(self):
+        results = cache.ResultCache()
+        compute, calls = self.counting()
+        await results.get("t", {}, 0.01, [], compute)
+        await asyncio.sleep(0.02)
+        await results.get("t", {}, 0.01, [], compute)
+        assert len(calls) == 2
+
+    def test_key_normalizes_paths(self, tmp_path):
+        (tmp_path / "sub").mkdir()
+        assert cache.make_key("t", {"image_path": f"{tmp_path}/sub/../a.qcow2", "x": 1}) == \
+            cache.make_key("t", {"x": 1, "image_path": f"{tmp_path}/a.qcow2"})
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_coalesced(self):
+        results = cache.ResultCache()
+        compute, calls = self.counting(delay=0.05)
+        values = await asyncio.gather(*(results.get("t", {}, 60, [], compute) for _ in range(5)))
+        assert len(calls) == 1
+        assert all(v == {"n": 1} for v in values)
+
+    @pytest.mark.asyncio
+    async def test_errors_shared_not_cached(self):
+        results = cache.ResultCache()
+        compute, calls = self.counting(delay=0.02, error=RuntimeError("boom"))
+        outcomes = await asyncio.gather(
+            *(results.get("t", {}, 60, [], compute) for _ in range(3)), return_exceptions=True,
+        )
+        assert all(isinstance(o, RuntimeError) for o in outcomes)
+        with pytest.raises(RuntimeError):
+            await results.get("t", {}, 60, [], compute)
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_invalidate_by_tag(self):
+        results = cache.ResultCache()
+        compute, calls = self.counting()
+        await results.get("a", {}, 60, [cache.image("/x.qcow2")], compute)
+        await results.get("b", {}, 60, [cache.VMS], compute)
+        assert results.invalidate([cache.image("/x.qcow2")]) == 1
+        await results.get("a", {}, 60, [cache.image("/x.qcow2")], compute)
+        await results.get("b", {}, 60, [cache.VMS], compute)
+        assert len(calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_result_overlapping_invalidation_not_stored(self):
+        results = cache.ResultCache()
+        compute, calls = self.counting(delay=0.05)
+        pending = asyncio.create_task(results.get("t", {}, 60, [cache.VMS], compute))
+        await asyncio.sleep(0.01)
+        results.invalidate([cache.VMS])
+        await pending
+        await results.get("t", {}, 60, [cache.VMS], compute)
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_mutating_tool_invalidates_image_info(self, tmp_path):
+        image = tmp_path / "disk.qcow2"
+        image.write_bytes(b"")
+
+        async def run(cmd, *args, **kwargs):
+            if "info" in cmd:
+                return 0, json.dumps({"filename": str(image), "virtual-size": 1024}), ""
+            return 0, "", ""
+
+        with patch.object(qemu_img, "get_qemu_img_path", return_value="qemu-img"), \
+                patch.object(qemu_img, "run_command", AsyncMock(side_effect=run)) as run_command:
+            await server._dispatch_tool("qemu_image_info", {"image_path": str(image)})
+            await server._dispatch_tool("qemu_image_info", {"image_path": f"{tmp_path}/./disk.qcow2"})
+            assert run_command.await_count == 1
+            await server._dispatch_tool("qemu_image_resize", {"image_path": str(image), "size": "+1G"})
+            calls = run_command.await_count
+            await server._dispatch_tool("qemu_image_info", {"image_path": str(image)})
+            assert run_command.await_count == calls + 1
+
+
+class TestIoGovernor:
+    """Test per-device I/O slots and priorities."""
+
+    @pytest.fixture(autouse=True)
+    def small_limits(self):
+        with patch.object(io_governor, "SLOTS_PER_DEVICE", 1), \
+                patch.object(io_governor, "INTERACTIVE_RESERVE", 1), \
+                patch.object(io_governor, "_devices", {}):
+            yield
+
+    async def hold(self, path, priority, order, name, seconds=0.05):
+        async with io_governor.slot([path], priority):
+            order.append(name)
+            await asyncio.sleep(seconds)
+
+    @pytest.mark.asyncio
+    async def test_bulk_limited_per_device(self, tmp_path):
+        running, peak = [], []
+
+        async def bulk():
+            async with io_governor.slot([str(tmp_path / "out.raw")], io_governor.BULK):
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.02)
+                running.pop()
+
+        await asyncio.gather(*(bulk() for _ in range(4)))
+        assert max(peak) == 1
+
+    @pytest.mark.asyncio
+    async def test_interactive_uses_reserve(self, tmp_path):
+        order = []
+        bulk = asyncio.create_task(self.hold(str(tmp_path), io_governor.BULK, order, "bulk", 0.5))
+        await asyncio.sleep(0.01)
+        start = time.monotonic()
+        await self.hold(str(tmp_path), io_governor.INTERACTIVE, order, "info", 0)
+        assert time.monotonic() - start < 0.1
+        bulk.cancel()
+        await asyncio.gather(bulk, return_exceptions=True)
+
+    @pytest.mark.asyncio
+    async def test_interactive_queued_ahead_of_bulk(self, tmp_path):
+        order = []
+        with patch.object(io_governor, "INTERACTIVE_RESERVE", 0):
+            first = asyncio.create_task(self.hold(str(tmp_path), io_governor.BULK, order, "first"))
+            await asyncio.sleep(0.01)
+            queued = [
+                asyncio.create_task(self.hold(str(tmp_path), io_governor.BULK, order, "bulk", 0)),
+                asyncio.create_task(self.hold(str(tmp_path), io_governor.INTERACTIVE, order, "info", 0)),
+            ]
+            await asyncio.gather(first, *queued)
+        assert order == ["first", "info", "bulk"]
+
+    @pytest.mark.asyncio
+    async def test_nested_slots_do_not_deadlock(self, tmp_path):
+        async with io_governor.slot([str(tmp_path / "a")], io_governor.BULK):
+            async with io_governor.slot([str(tmp_path / "b")], io_governor.INTERACTIVE):
+                # The nested call keeps the outer (bulk) priority for its processes
+                assert io_governor._priority.get() == io_governor.BULK
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_leaves_queue(self, tmp_path):
+        order = []
+        with patch.object(io_governor, "INTERACTIVE_RESERVE", 0):
+            first = asyncio.create_task(self.hold(str(tmp_path), io_governor.BULK, order, "first"))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.create_task(self.hold(str(tmp_path), io_governor.BULK, order, "never", 0))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await first
+            await asyncio.wait_for(self.hold(str(tmp_path), io_governor.BULK, order, "next", 0), 1)
+        assert order == ["first", "next"]
+        assert io_governor.status()["devices"][0]["active"] == {"interactive": 0, "bulk": 0}
+
+    @pytest.mark.asyncio
+    async def test_ionice_only_for_bulk(self, tmp_path):
+        with patch.object(io_governor.shutil, "which", return_value="/usr/bin/ionice"), \
+                patch.object(io_governor.sys, "platform", "linux"):
+            assert io_governor.wrap_command(["qemu-img"]) == ["qemu-img"]
+            async with io_governor.slot([str(tmp_path)], io_governor.INTERACTIVE):
+                assert io_governor.wrap_command(["qemu-img"]) == ["qemu-img"]
+            async with io_governor.slot([str(tmp_path)], io_governor.BULK):
+                assert io_governor.wrap_command(["qemu-img"])[:3] == ["/usr/bin/ionice", "-c", "2"]
+
+    @pytest.mark.asyncio
+    async def test_queue_wait_reported(self, tmp_path):
+        order = []
+        with patch.object(io_governor, "_waits", {p: collections.deque() for p in ("interactive", "bulk")}):
+            await asyncio.gather(*(self.hold(str(tmp_path), io_governor.BULK, order, i, 0.02) for i in range(2)))
+            waits = io_governor.status()["queue_wait"]["bulk"]
+        assert waits["count"] == 2
+        assert waits["max"] >= 0.015
+
+
+class TestEventLoop:
+    """Test that blocking work stays off the event loop."""
+
+    @pytest.mark.asyncio
+    async def test_run_blocking_keeps_loop_free(self):
+        loop = asyncio.get_running_loop()
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(loop.time())
+                await asyncio.sleep(0.02)
+
+        await asyncio.gather(eventloop.run_blocking(time.sleep, 0.15), ticker())
+        gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+        assert max(gaps) < 0.1
+
+    @pytest.mark.asyncio
+    async def test_lag_monitor_reports_stall(self, caplog):
+        before = metrics.LOOP_STALLS.value()
+        monitor = asyncio.create_task(eventloop.monitor_lag(interval=0.01, threshold_ms=50))
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)  # block the loop on purpose
+        await asyncio.sleep(0.05)
+        monitor.cancel()
+        await asyncio.gather(monitor, return_exceptions=True)
+        assert metrics.LOOP_STALLS.value() > before
+        assert "Event loop blocked" in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_list_vms_uses_async_subprocess(self):
+        output = "4242 qemu-system-x86_64 -netdev user,id=net0,hostfwd=tcp::2222-:22\n"
+        with patch.object(qemu_system, "run_command", AsyncMock(return_value=(0, output, ""))) as run:
+            result = await qemu_system.list_vms()
+        assert run.call_args.args[0][0] == "pgrep"
+        assert result["vms"] == [{"pid": 4242, "ssh_port": 2222, "command_snippet": output.split(" ", 1)[1].strip()}]
+
+    @pytest.mark.asyncio
+    async def test_read_pid_file(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(qemu_system, "Path", lambda p: Path(tmp) / Path(p).name):
+            assert await qemu_system._read_pid_file(65001) is None
+            (Path(tmp) / "qemu-vm-65001.pid").write_text("1234\n")
+            assert await qemu_system._read_pid_file(65001) == 1234
+
+
 class TestRunCommand:
     """Test the run_command helper."""
 
@@ -178,6 +1482,24 @@ class TestRunCommand:
         with pytest.raises(TimeoutError):
             await qemu_img.run_command(["sleep", "10"], timeout=1)
 
+    @pytest.mark.asyncio
+    async def test_run_command_progress(self):
+        updates = []
+        script = r"printf '    (0.00/100%%)\r    (42.50/100%%)\r    (100.00/100%%)\r\n'"
+        returncode, stdout, stderr = await qemu_img.run_command_progress(
+            ["sh", "-c", script], updates.append
+        )
+        assert returncode == 0
+        assert updates == [0.0, 0.425, 1.0]
+
+    @pytest.mark.asyncio
+    async def test_run_command_cancel_kills_process(self):
+        task = asyncio.create_task(qemu_img.run_command(["sleep", "30"]))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
 
 # Integration tests - only run if QEMU is installed
 @pytest.mark.skipif(
@@ -256,3 +1578,28 @@ class TestQemuIntegration:
             info = await qemu_img.image_info(str(image_path))
             expected_size = (1024 + 512) * 1024 * 1024  # 1.5GB
             assert info["virtual-size"] == expected_size
+
+    @pytest.mark.asyncio
+    async def test_image_verify_after_convert(self):
+        """Convert an image and verify the copy matches."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = Path(tmpdir) / "test.qcow2"
+            raw_path = Path(tmpdir) / "test.raw"
+
+            proc = await asyncio.create_subprocess_exec(
+                "qemu-img", "create", "-f", "qcow2", str(image_path), "64M",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            await proc.communicate()
+
+            progress = []
+            await qemu_img.image_convert(
+                str(image_path), str(raw_path), "raw", progress=progress.append
+            )
+            assert progress and progress[-1] == 1.0
+
+            result = await qemu_img.image_verify(str(image_path), compare_to=str(raw_path))
+            assert result["success"] is True
+            assert result["check"]["clean"] is True
+            assert result["compare"]["identical"] is True